@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 from flask import Flask, jsonify, render_template_string, request, session, redirect, url_for
 from flask_cors import CORS
-import subprocess
+import socket
+import time
 import csv
 import io
+import os
 import hashlib
 from functools import wraps
 import secrets
@@ -30,19 +32,68 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-HAPROXY_SOCKET = '/run/haproxy/admin.sock'
+HAPROXY_SOCKET = os.environ.get('HAPROXY_SOCKET', '/run/haproxy/admin.sock')
+HAPROXY_SOCKET_TIMEOUT = 2.0  # ثانیه
+
+class HAProxySocketError(Exception):
+    """خطای ارتباط با سوکت مدیریتی HAProxy"""
+
+def haproxy_command(command, socket_path=None, timeout=HAPROXY_SOCKET_TIMEOUT):
+    """ارسال یک دستور به runtime API از طریق سوکت یونیکس (بدون socat)"""
+    socket_path = socket_path or HAPROXY_SOCKET
+    deadline = time.monotonic() + timeout
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        try:
+            sock.connect(socket_path)
+        except FileNotFoundError:
+            raise HAProxySocketError(f"HAProxy socket not found: {socket_path}")
+        except PermissionError:
+            raise HAProxySocketError(f"Permission denied on HAProxy socket: {socket_path}")
+        except socket.timeout:
+            raise HAProxySocketError(f"Timed out connecting to HAProxy socket: {socket_path}")
+        except OSError as e:
+            raise HAProxySocketError(f"Could not connect to HAProxy socket {socket_path}: {e}")
+        
+        chunks = []
+        try:
+            sock.sendall(command.encode() + b'\n')
+            # HAProxy بعد از پاسخ در حالت غیر تعاملی اتصال را می‌بندد
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise socket.timeout()
+                sock.settimeout(remaining)
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        except socket.timeout:
+            raise HAProxySocketError(f"Timed out after {timeout}s waiting for reply to '{command}'")
+        except OSError as e:
+            raise HAProxySocketError(f"Error talking to HAProxy socket {socket_path}: {e}")
+    finally:
+        sock.close()
+    
+    return b''.join(chunks).decode('utf-8', errors='replace')
 
 def get_haproxy_stats():
     """دریافت آمار از HAProxy"""
     try:
-        cmd = f'echo "show stat" | socat stdio {HAPROXY_SOCKET}'
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+        try:
+            # فقط سرورها (type=4) از HAProxy خواسته می‌شوند، نه frontend/backend
+            output = haproxy_command('show stat -1 4 -1')
+        except HAProxySocketError as e:
+            print(f"Error getting stats: {e}")
+            return None
         
-        if result.returncode != 0:
+        if not output.startswith('# pxname'):
+            print(f"Unexpected reply from HAProxy: {output.strip()[:200]}")
             return None
             
         stats = {}
-        reader = csv.DictReader(io.StringIO(result.stdout))
+        reader = csv.DictReader(io.StringIO(output.replace('# pxname', 'pxname', 1)))
         
         for row in reader:
             if row['svname'] in ['wireguard', 'openvpn', 'v2ray']:
@@ -1,17 +1,84 @@
 #!/usr/bin/env python3
-from flask import Flask, jsonify, render_template_string, request, session, redirect, url_for
+from flask import Flask, Response, jsonify, render_template_string, request, session, redirect, url_for
 from flask_cors import CORS
-import subprocess
+import socket
+import threading
+import time
 import csv
-import io
+import json
+import os
+import re
 import hashlib
-from functools import wraps
+import gzip
+import fcntl
+import itertools
+import operator
+import math
+import bisect
+import mmap
+import struct
+from array import array
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from email.utils import formatdate
+from functools import lru_cache, wraps
 import secrets
+import shlex
+import sqlite3
+import subprocess
+import urllib.request
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
 
 app = Flask(__name__)
 CORS(app)
 
-app.secret_key = secrets.token_hex(16)
+# کلید امضای کوکی session باید بین ری‌استارت‌ها و بین worker ها یکی باشد
+SECRET_KEY_FILE = os.environ.get('SECRET_KEY_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.secret_key'))
+
+def load_secret_key():
+    """SECRET_KEY از محیط، یا کلید ذخیره شده در SECRET_KEY_FILE (اولین بار ساخته می‌شود)"""
+    key = os.environ.get('SECRET_KEY')
+    if key:
+        return key
+    try:
+        with open(SECRET_KEY_FILE) as f:
+            key = f.read().strip()
+        if key:
+            return key
+    except FileNotFoundError:
+        pass
+    
+    key = secrets.token_hex(32)
+    tmp_path = f'{SECRET_KEY_FILE}.{os.getpid()}.tmp'
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(key)
+            f.flush()
+            os.fsync(f.fileno())
+        # link اتمیک است و اگر worker دیگری زودتر ساخته باشد شکست می‌خورد؛ آن وقت کلید او استفاده می‌شود
+        try:
+            os.link(tmp_path, SECRET_KEY_FILE)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp_path)
+        with open(SECRET_KEY_FILE) as f:
+            return f.read().strip()
+    except OSError as e:
+        print(f"[ERROR] Could not persist secret key to {SECRET_KEY_FILE}: {e}; sessions will not survive a restart")
+        return key
+
+app.secret_key = load_secret_key()
 
 # یوزر و پسورد - اینا رو عوض کن!
 ADMIN_USERNAME = 'soheil'
@@ -28,117 +95,2500 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-HAPROXY_SOCKET = '/run/haproxy/admin.sock'
+HAPROXY_SOCKET = os.environ.get('HAPROXY_SOCKET', '/run/haproxy/admin.sock')
+HAPROXY_SOCKET_TIMEOUT = 2.0  # ثانیه
+
+class HAProxySocketError(Exception):
+    """خطای ارتباط با سوکت مدیریتی HAProxy"""
+
+def _connect_unix(socket_path, timeout):
+    """اتصال به سوکت یونیکس HAProxy با پیام خطای واضح"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+    except FileNotFoundError:
+        sock.close()
+        raise HAProxySocketError(f"HAProxy socket not found: {socket_path}")
+    except PermissionError:
+        sock.close()
+        raise HAProxySocketError(f"Permission denied on HAProxy socket: {socket_path}")
+    except socket.timeout:
+        sock.close()
+        raise HAProxySocketError(f"Timed out connecting to HAProxy socket: {socket_path}")
+    except OSError as e:
+        sock.close()
+        raise HAProxySocketError(f"Could not connect to HAProxy socket {socket_path}: {e}")
+    return sock
+
+def _connect_tcp(address, timeout):
+    """اتصال به stats socket ای که HAProxy روی TCP باز کرده (مثلاً روی نودهای دیگر)"""
+    host, _, port = address.rpartition(':')
+    try:
+        return socket.create_connection((host.strip('[]'), int(port)), timeout=timeout)
+    except socket.timeout:
+        raise HAProxySocketError(f"Timed out connecting to HAProxy socket: {address}")
+    except (OSError, ValueError) as e:
+        raise HAProxySocketError(f"Could not connect to HAProxy socket {address}: {e}")
+
+def is_tcp_address(address):
+    """host:port در برابر مسیر سوکت یونیکس"""
+    if address.startswith('/') or address.startswith('.'):
+        return False
+    _, separator, port = address.rpartition(':')
+    return bool(separator) and port.isdigit()
+
+def connect_haproxy(address, timeout):
+    if is_tcp_address(address):
+        return _connect_tcp(address, timeout)
+    return _connect_unix(address, timeout)
+
+def haproxy_command(command, socket_path=None, timeout=HAPROXY_SOCKET_TIMEOUT):
+    """ارسال یک دستور به runtime API از طریق سوکت یونیکس یا TCP (بدون socat)"""
+    socket_path = socket_path or HAPROXY_SOCKET
+    deadline = time.monotonic() + timeout
+    sock = connect_haproxy(socket_path, timeout)
+    try:
+        chunks = []
+        try:
+            sock.sendall(command.encode() + b'\n')
+            # HAProxy بعد از پاسخ در حالت غیر تعاملی اتصال را می‌بندد
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise socket.timeout()
+                sock.settimeout(remaining)
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        except socket.timeout:
+            raise HAProxySocketError(f"Timed out after {timeout}s waiting for reply to '{command}'")
+        except OSError as e:
+            raise HAProxySocketError(f"Error talking to HAProxy socket {socket_path}: {e}")
+    finally:
+        sock.close()
+    
+    return b''.join(chunks).decode('utf-8', errors='replace')
+
+class HAProxyRuntimeSession:
+    """نشست پایدار با runtime API در حالت prompt - چند دستور در یک رفت و برگشت"""
+    
+    # در حالت تعاملی HAProxy بعد از پاسخ هر دستور این prompt را می‌فرستد
+    PROMPT = b'\n> '
+    
+    def __init__(self, socket_path=None, timeout=HAPROXY_SOCKET_TIMEOUT):
+        self.socket_path = socket_path or HAPROXY_SOCKET
+        self.timeout = timeout
+        self._sock = None
+        self._buffer = b''
+        self._lock = threading.Lock()
+    
+    def _connect(self):
+        self._sock = connect_haproxy(self.socket_path, self.timeout)
+        self._buffer = b''
+        print(f"[DEBUG] Opened runtime API session on {self.socket_path}")
+        deadline = time.monotonic() + self.timeout
+        self._sock.sendall(b'prompt\n')
+        self._read_replies(1, deadline)
+    
+    def _read_replies(self, count, deadline):
+        """خواندن پاسخ‌ها تا رسیدن به count عدد prompt"""
+        while self._buffer.count(self.PROMPT) < count:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout()
+            self._sock.settimeout(remaining)
+            chunk = self._sock.recv(65536)
+            if not chunk:
+                raise HAProxySocketError(f"HAProxy closed the runtime API session on {self.socket_path}")
+            self._buffer += chunk
+        
+        replies = []
+        for _ in range(count):
+            reply, _, self._buffer = self._buffer.partition(self.PROMPT)
+            replies.append(reply.decode('utf-8', errors='replace') + '\n')
+        return replies
+    
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._buffer = b''
+    
+    def execute_many(self, commands):
+        """ارسال چند دستور با هم (pipelining) و جدا کردن پاسخ هر کدام"""
+        for command in commands:
+            if '\n' in command or ';' in command:
+                raise ValueError(f"Invalid runtime API command: {command!r}")
+        payload = ''.join(f"{command}\n" for command in commands).encode()
+        
+        with self._lock:
+            # اگر اتصال قبلی (مثلاً به خاطر timeout بیکاری یا ریلود HAProxy) بسته شده، یک بار دوباره وصل می‌شویم
+            for attempt in (1, 2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    deadline = time.monotonic() + self.timeout
+                    self._sock.sendall(payload)
+                    return self._read_replies(len(commands), deadline)
+                except (HAProxySocketError, OSError) as e:
+                    self.close()
+                    if isinstance(e, socket.timeout):
+                        e = HAProxySocketError(f"Timed out after {self.timeout}s waiting for reply to {commands}")
+                    elif not isinstance(e, HAProxySocketError):
+                        e = HAProxySocketError(f"Error talking to HAProxy socket {self.socket_path}: {e}")
+                    if attempt == 2:
+                        raise e
+                    print(f"[DEBUG] Runtime API session lost ({e}), reconnecting")
+    
+    def execute(self, command):
+        return self.execute_many([command])[0]
+
+# فایل قواعد تشخیص نوع و موقعیت سرور (JSON، یا YAML/TOML اگر کتابخانه‌اش در دسترس باشد)
+CLASSIFICATION_RULES_FILE = os.environ.get(
+    'CLASSIFICATION_RULES_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'classification-rules.json')
+)
+
+# اگر فایل قواعد خوانده نشود همه‌ی سرورها با این مقادیر نمایش داده می‌شوند
+UNKNOWN_SERVER_TYPE = {'type': 'Unknown', 'icon': '❓', 'priority': 99}
+UNKNOWN_LOCATION = {'location': 'نامشخص', 'flag': '🌍'}
+
+# نام سرور به توکن شکسته می‌شود: 'openvpn-ssl' -> ['openvpn', 'ssl'] پس 'ss' دیگر اشتباهی match نمی‌شود
+NAME_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+class RuleMatcher:
+    """قواعد کامپایل شده: توکن‌ها در یک dict و الگوهای regex در یک regex ترکیبی"""
+    
+    def __init__(self, rules, default):
+        # ترتیب بررسی: priority و بعد ترتیب در فایل
+        ordered = sorted(enumerate(rules), key=lambda item: (item[1].get('priority', 99), item[0]))
+        self.default = default
+        self.infos = []
+        self.tokens = {}
+        self.group_ranks = {}
+        alternatives = []
+        
+        for rank, (_, rule) in enumerate(ordered):
+            # فیلدهای خروجی همان فیلدهای مقدار پیش‌فرض هستند
+            self.infos.append({key: rule.get(key, value) for key, value in default.items()})
+            for token in rule.get('tokens', []):
+                self.tokens.setdefault(token.lower(), rank)
+            patterns = rule.get('patterns', [])
+            for pattern in patterns:
+                try:
+                    re.compile(pattern)
+                except re.error as e:
+                    raise ValueError(f"Invalid pattern {pattern!r} in rule {rule}: {e}")
+            if patterns:
+                group = f"r{rank}"
+                self.group_ranks[group] = rank
+                alternatives.append(f"(?P<{group}>" + '|'.join(f"(?:{pattern})" for pattern in patterns) + ')')
+        
+        # lookahead تا match های هم‌پوشان هم دیده شوند؛ در هر موقعیت قاعده‌ی با اولویت بالاتر اول امتحان می‌شود
+        self.pattern = re.compile('(?=' + '|'.join(alternatives) + ')', re.IGNORECASE) if alternatives else None
+    
+    def match(self, name):
+        """قاعده‌ی با بالاترین اولویت که با یکی از توکن‌ها یا الگوها match شود"""
+        name_lower = name.lower()
+        best = None
+        for token in NAME_TOKEN_RE.findall(name_lower):
+            rank = self.tokens.get(token)
+            if rank is None:
+                # 'wg1' و 'de01' مثل 'wg' و 'de' در نظر گرفته می‌شوند
+                rank = self.tokens.get(token.rstrip('0123456789'))
+            if rank is not None and (best is None or rank < best):
+                best = rank
+        if self.pattern is not None:
+            for match in self.pattern.finditer(name_lower):
+                rank = self.group_ranks[match.lastgroup]
+                if best is None or rank < best:
+                    best = rank
+        return self.infos[best] if best is not None else self.default
+
+def read_rules_file(path):
+    """خواندن فایل قواعد بر اساس پسوند آن"""
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, 'rb') as f:
+        data = f.read()
+    if extension in ('.yaml', '.yml'):
+        if yaml is None:
+            raise ValueError("PyYAML is not installed, use a JSON rules file")
+        return yaml.safe_load(data)
+    if extension == '.toml':
+        if tomllib is None:
+            raise ValueError("TOML rules need Python 3.11+, use a JSON rules file")
+        return tomllib.loads(data.decode())
+    return json.loads(data)
+
+SERVER_TYPE_MATCHER = RuleMatcher([], UNKNOWN_SERVER_TYPE)
+LOCATION_MATCHER = RuleMatcher([], UNKNOWN_LOCATION)
 
 def detect_server_type(server_name):
     """تشخیص نوع سرور بر اساس نام"""
-    name_lower = server_name.lower()
-    
-    if 'wg' in name_lower or 'wireguard' in name_lower:
-        return {'type': 'WireGuard', 'icon': '🔐', 'priority': 1}
-    elif 'ipsec' in name_lower or 'esp' in name_lower:
-        return {'type': 'IPSec', 'icon': '🛡️', 'priority': 2}
-    elif 'vxlan' in name_lower:
-        return {'type': 'VXLAN', 'icon': '🌐', 'priority': 3}
-    elif 'openvpn' in name_lower or 'ovpn' in name_lower:
-        return {'type': 'OpenVPN', 'icon': '🔒', 'priority': 4}
-    elif 'v2ray' in name_lower or 'vmess' in name_lower:
-        return {'type': 'V2Ray', 'icon': '⚡', 'priority': 5}
-    elif 'shadowsocks' in name_lower or 'ss' in name_lower:
-        return {'type': 'Shadowsocks', 'icon': '👤', 'priority': 6}
-    else:
-        return {'type': 'Unknown', 'icon': '❓', 'priority': 99}
+    return SERVER_TYPE_MATCHER.match(server_name)
 
 def detect_location(server_name):
     """تشخیص موقعیت جغرافیایی سرور"""
-    name_lower = server_name.lower()
-    
-    if 'de' in name_lower or 'germany' in name_lower or 'german' in name_lower:
-        return {'location': 'آلمان', 'flag': '🇩🇪'}
-    elif 'fl' in name_lower or 'finland' in name_lower or 'finnish' in name_lower:
-        return {'location': 'فنلاند', 'flag': '🇫🇮'}
-    elif 'us' in name_lower or 'usa' in name_lower or 'america' in name_lower:
-        return {'location': 'آمریکا', 'flag': '🇺🇸'}
-    elif 'uk' in name_lower or 'britain' in name_lower or 'england' in name_lower:
-        return {'location': 'انگلستان', 'flag': '🇬🇧'}
-    elif 'fr' in name_lower or 'france' in name_lower:
-        return {'location': 'فرانسه', 'flag': '🇫🇷'}
-    elif 'nl' in name_lower or 'netherlands' in name_lower or 'holland' in name_lower:
-        return {'location': 'هلند', 'flag': '🇳🇱'}
-    else:
-        return {'location': 'نامشخص', 'flag': '🌍'}
+    return LOCATION_MATCHER.match(server_name)
 
-def get_haproxy_stats():
-    """دریافت آمار از HAProxy - اصلاح نهایی"""
-    try:
-        cmd = f'echo "show stat" | socat stdio {HAPROXY_SOCKET}'
-        print(f"[DEBUG] Running command: {cmd}")
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+# نام سرورها تقریباً هیچ‌وقت عوض نمی‌شود؛ تشخیص و لیبل‌ها برای هر نام یک بار ساخته می‌شوند
+CLASSIFICATION_CACHE_SIZE = 16384
+
+@lru_cache(maxsize=CLASSIFICATION_CACHE_SIZE)
+def classify_server(server_name):
+    """اطلاعات تشخیص خودکار و لیبل‌های نمایشی سرور (cache شده)"""
+    server_type_info = detect_server_type(server_name)
+    location_info = detect_location(server_name)
+    return {
+        'type': server_type_info['type'],
+        'icon': server_type_info['icon'],
+        'priority': server_type_info['priority'],
+        'location': location_info['location'],
+        'flag': location_info['flag'],
         
-        print(f"[DEBUG] Return code: {result.returncode}")
-        print(f"[DEBUG] Output length: {len(result.stdout)}")
+        # لیبل ترکیبی
+        'display_name': f"{location_info['flag']} {server_type_info['icon']} {server_name}",
+        'full_label': f"{location_info['location']} - {server_type_info['type']}"
+    }
+
+def load_classification_rules(path=None):
+    """خواندن و کامپایل قواعد تشخیص (یک بار در شروع برنامه)"""
+    global SERVER_TYPE_MATCHER, LOCATION_MATCHER
+    path = path or CLASSIFICATION_RULES_FILE
+    try:
+        rules = read_rules_file(path)
+        server_types = RuleMatcher(rules['server_types']['rules'], rules['server_types'].get('default', UNKNOWN_SERVER_TYPE))
+        locations = RuleMatcher(rules['locations']['rules'], rules['locations'].get('default', UNKNOWN_LOCATION))
+    except Exception as e:
+        print(f"[ERROR] Could not load classification rules from {path}: {e}")
+        return False
+    
+    SERVER_TYPE_MATCHER, LOCATION_MATCHER = server_types, locations
+    classify_server.cache_clear()
+    print(f"[DEBUG] Loaded classification rules from {path}")
+    return True
+
+load_classification_rules()
+
+# محدود کردن show stat در خود HAProxy: فقط این proxy ها (خالی یعنی همه) و فقط این نوع اشیا
+STATS_PROXIES = [name for name in os.environ.get('STATS_PROXIES', '').split(',') if name]
+STATS_OBJECT_TYPES = os.environ.get('STATS_OBJECT_TYPES', 'server').split(',')
+
+# بیت‌های نوع شیء در دستور show stat <iid> <type> <sid>
+STAT_TYPE_BITS = {'frontend': 1, 'backend': 2, 'server': 4}
+
+def build_stat_commands(proxies, object_types):
+    """ساخت دستورات show stat محدود شده؛ برای هر proxy یک دستور (همه در یک batch)"""
+    type_mask = 0
+    for object_type in object_types:
+        if object_type not in STAT_TYPE_BITS:
+            raise ValueError(f"Unknown stat object type: {object_type}")
+        type_mask |= STAT_TYPE_BITS[object_type]
+    return [f"show stat {proxy} {type_mask} -1" for proxy in (proxies or ['-1'])]
+
+# دستوراتی که هر بار با هم (در یک رفت و برگشت) به HAProxy فرستاده می‌شوند
+STATS_POLL_COMMANDS = build_stat_commands(STATS_PROXIES, STATS_OBJECT_TYPES) + ['show info']
+
+def parse_haproxy_info(output):
+    """تبدیل خروجی show info به دیکشنری"""
+    info = {}
+    for line in output.splitlines():
+        key, sep, value = line.partition(':')
+        if sep:
+            info[key.strip()] = value.strip()
+    return info
+
+# ستون‌هایی از show stat که واقعاً استفاده می‌شوند (از حدود ۱۰۰ ستون)
+STAT_COLUMNS = ('pxname', 'svname', 'status', 'scur', 'stot', 'bin', 'bout', 'check_status', 'act', 'bck', 'weight')
+# ستون‌های زمانی (میلی‌ثانیه، lastchg ثانیه)؛ در نسخه‌های قدیمی HAProxy ممکن است نباشند و خالی بودنشان یعنی None
+STAT_TIMING_COLUMNS = ('check_duration', 'lastchg', 'qtime', 'ctime', 'rtime', 'ttime')
+
+def _split_stat_line(line):
+    """جدا کردن یک خط CSV؛ فقط خطوط دارای کوتیشن (مثل check_desc) به ماژول csv می‌روند"""
+    if '"' in line:
+        return next(csv.reader([line]))
+    return line.split(',')
+
+def parse_haproxy_stats(output):
+    """تبدیل خروجی CSV دستور show stat به آمار سرورها - header فقط یک بار به index ستون‌ها تبدیل می‌شود"""
+    try:
+        print(f"[DEBUG] Output length: {len(output)}")
         
-        if result.returncode != 0:
-            print(f"[ERROR] Command failed: {result.stderr}")
+        if not output.startswith('# pxname'):
+            print(f"[ERROR] Unexpected reply from HAProxy: {output.strip()[:200]}")
             return None
         
+        header, _, body = output.partition('\n')
         # حذف # از ابتدای header
-        csv_data = result.stdout.replace('# pxname', 'pxname')
-        print(f"[DEBUG] CSV data first line: {csv_data.split(chr(10))[0][:100]}...")
-        
-        stats = {}
-        reader = csv.DictReader(io.StringIO(csv_data))
+        positions = {name: i for i, name in enumerate(header[2:].split(','))}
+        missing = [name for name in STAT_COLUMNS if name not in positions]
+        if missing:
+            print(f"[ERROR] show stat output is missing columns: {missing}")
+            return None
         
-        # چاپ فیلدهای موجود
-        print(f"[DEBUG] CSV fieldnames: {reader.fieldnames[:10] if reader.fieldnames else 'None'}...")
+        (i_pxname, i_svname, i_status, i_scur, i_stot, i_bin, i_bout,
+         i_check_status, i_act, i_bck, i_weight) = (positions[name] for name in STAT_COLUMNS)
+        timings = [(name, positions[name]) for name in STAT_TIMING_COLUMNS if name in positions]
+        width = max(positions[name] for name in STAT_COLUMNS + tuple(name for name, _ in timings)) + 1
         
-        for row in reader:
+        stats = {}
+        for line in body.split('\n'):
+            # pxname و svname هیچ‌وقت کاما یا کوتیشن ندارند؛ svname بدون split کامل خط خوانده می‌شود
+            first = line.find(',')
+            if first < 0:
+                continue
+            second = line.find(',', first + 1)
+            server_name = line[first + 1:second] if second >= 0 else line[first + 1:]
+            
             # فقط server ها را در نظر بگیریم (نه frontend/backend)
-            svname = row.get('svname', '')
-            if svname and svname not in ['FRONTEND', 'BACKEND']:
-                server_name = svname
-                print(f"[DEBUG] Processing server: {server_name}")
-                
-                # اطلاعات تشخیص خودکار
-                server_type_info = detect_server_type(server_name)
-                location_info = detect_location(server_name)
-                
-                # ساخت آمار با safe access
-                stats[server_name] = {
-                    'status': row.get('status', 'UNKNOWN'),
-                    'current_sessions': int(row.get('scur', '0') or '0'),
-                    'total_sessions': int(row.get('stot', '0') or '0'),
-                    'bytes_in': int(row.get('bin', '0') or '0'),
-                    'bytes_out': int(row.get('bout', '0') or '0'),
-                    'check_status': row.get('check_status', 'N/A'),
-                    'active': row.get('act', '0') == '1',
-                    'backup': row.get('bck', '0') == '1',
-                    'weight': int(row.get('weight', '0') or '0'),
-                    'backend': row.get('pxname', 'Unknown'),
-                    
-                    # اطلاعات تشخیص شده
-                    'type': server_type_info['type'],
-                    'icon': server_type_info['icon'],
-                    'priority': server_type_info['priority'],
-                    'location': location_info['location'],
-                    'flag': location_info['flag'],
-                    
-                    # لیبل ترکیبی
-                    'display_name': f"{location_info['flag']} {server_type_info['icon']} {server_name}",
-                    'full_label': f"{location_info['location']} - {server_type_info['type']}"
-                }
-                
-                print(f"[DEBUG] Added server {server_name}: status={stats[server_name]['status']}, sessions={stats[server_name]['current_sessions']}")
+            if not server_name or server_name == 'FRONTEND' or server_name == 'BACKEND':
+                continue
+            
+            row = _split_stat_line(line)
+            if len(row) < width:
+                row.extend([''] * (width - len(row)))
+            
+            server = stats[server_name] = {
+                'status': row[i_status],
+                'current_sessions': int(row[i_scur] or 0),
+                'total_sessions': int(row[i_stot] or 0),
+                'bytes_in': int(row[i_bin] or 0),
+                'bytes_out': int(row[i_bout] or 0),
+                'check_status': row[i_check_status],
+                'active': row[i_act] == '1',
+                'backup': row[i_bck] == '1',
+                'weight': int(row[i_weight] or 0),
+                'backend': row[i_pxname]
+            }
+            for name, position in timings:
+                value = row[position]
+                server[name] = int(value) if value else None
+            # اطلاعات تشخیص شده
+            server.update(classify_server(server_name))
         
         print(f"[DEBUG] Total servers found: {len(stats)}")
         return stats
         
     except Exception as e:
-        print(f"[ERROR] Exception in get_haproxy_stats: {e}")
+        print(f"[ERROR] Exception in parse_haproxy_stats: {e}")
         import traceback
         traceback.print_exc()
         return None
 
+# شمارنده‌های تجمعی HAProxy -> فیلد نرخ (در ثانیه) در خروجی /api/stats
+RATE_COUNTERS = {
+    'bytes_in': 'bytes_in_per_sec',
+    'bytes_out': 'bytes_out_per_sec',
+    'total_sessions': 'sessions_per_sec',
+}
+
+class CounterRates:
+    """محاسبه‌ی نرخ هر سرور از اختلاف دو نمونه‌ی پشت سر هم"""
+    
+    def __init__(self, counters=RATE_COUNTERS):
+        self.counters = dict(counters)
+        self._previous = {}
+        self._timestamp = None
+    
+    def apply(self, timestamp, stats, uptime=None):
+        """اضافه کردن فیلدهای نرخ به آمار هر سرور (None برای اولین نمونه)"""
+        elapsed = timestamp - self._timestamp if self._timestamp is not None else 0.0
+        # اگر HAProxy در همین فاصله ریلود شده، همه‌ی شمارنده‌ها از صفر شروع شده‌اند
+        reloaded = uptime is not None and elapsed > 0 and uptime < elapsed
+        
+        previous_samples = self._previous
+        self._previous = {}
+        for name, data in stats.items():
+            previous = previous_samples.get(name)
+            current = self._previous[name] = {counter: data.get(counter, 0) for counter in self.counters}
+            for counter, field in self.counters.items():
+                if previous is None or elapsed <= 0:
+                    data[field] = None
+                    continue
+                delta = current[counter] - previous[counter]
+                window = elapsed
+                if reloaded or delta < 0:
+                    # ریست شمارنده (ریلود یا clear counters): مقدار فعلی از زمان ریست جمع شده
+                    delta = current[counter]
+                    if uptime:
+                        window = min(elapsed, uptime)
+                data[field] = round(delta / window, 2)
+        self._timestamp = timestamp
+
+# چند HAProxy از یک داشبورد: لیست جدا شده با کاما از name=address@timeout (name و timeout اختیاری)
+# address مسیر سوکت یونیکس یا host:port برای stats socket روی TCP؛ خالی یعنی فقط HAPROXY_SOCKET
+HAPROXY_TARGETS = os.environ.get('HAPROXY_TARGETS', '')
+
+class HAProxyTarget:
+    """یک نمونه‌ی HAProxy: نشست runtime API، تشخیص ریلود و نرخ شمارنده‌های خودش"""
+    
+    def __init__(self, name, address, timeout=HAPROXY_SOCKET_TIMEOUT):
+        self.name = name
+        self.address = address
+        self.timeout = timeout
+        self.session = HAProxyRuntimeSession(address, timeout)
+        self.rates = CounterRates()
+        self._identity = None
+    
+    def detect_reload(self, info):
+        """تشخیص ریلود HAProxy از روی تغییر Pid یا کم شدن Uptime"""
+        pid = info.get('Pid')
+        uptime = int(info.get('Uptime_sec', '0') or '0')
+        previous = self._identity
+        self._identity = (pid, uptime)
+        return previous is not None and (previous[0] != pid or uptime < previous[1])
+
+def parse_haproxy_targets(value):
+    targets = []
+    for entry in value.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, separator, address = entry.partition('=')
+        if not separator:
+            name, address = '', entry
+        address, separator, timeout = address.partition('@')
+        targets.append(HAProxyTarget(name or address, address, float(timeout) if separator else HAPROXY_SOCKET_TIMEOUT))
+    if not targets:
+        targets.append(HAProxyTarget(socket.gethostname(), HAPROXY_SOCKET))
+    
+    names = [target.name for target in targets]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate HAProxy target names: {', '.join(duplicates)}")
+    return targets
+
+haproxy_targets = parse_haproxy_targets(HAPROXY_TARGETS)
+
+# اولین هدف؛ برای دستورات تک نمونه‌ای
+runtime_session = haproxy_targets[0].session
+
+# هر هدف در thread خودش خوانده می‌شود تا یک نود کند بقیه را معطل نکند
+_scrape_pool = ThreadPoolExecutor(max_workers=len(haproxy_targets), thread_name_prefix='haproxy-scrape') if len(haproxy_targets) > 1 else None
+
+# آخرین scrape هر هدف؛ هدفی که scrape قبلی‌اش هنوز تمام نشده دوباره فرستاده نمی‌شود
+# تا thread های pool پشت یک نود گیر کرده صف نکشند
+_scrape_futures = {}
+
+def scrape_target(target):
+    """(stats, info, error) یک نمونه در یک رفت و برگشت روی نشست پایدار آن"""
+    print(f"[DEBUG] Sending {STATS_POLL_COMMANDS} to {target.address}")
+    try:
+        replies = target.session.execute_many(STATS_POLL_COMMANDS)
+    except HAProxySocketError as e:
+        print(f"[ERROR] {target.name}: {e}")
+        return None, None, str(e)
+    return process_target_replies(target, replies)
+
+def process_target_replies(target, replies):
+    """تبدیل پاسخ‌های STATS_POLL_COMMANDS یک نمونه به (stats, info, error)"""
+    *stat_outputs, info_output = replies
+    info = parse_haproxy_info(info_output)
+    if target.detect_reload(info):
+        # بعد از ریلود ممکن است سرورها عوض شده باشند
+        print(f"[DEBUG] HAProxy reload detected on {target.name}, clearing classification cache")
+        classify_server.cache_clear()
+    
+    stats = {}
+    parsed = 0
+    for command, output in zip(STATS_POLL_COMMANDS, stat_outputs):
+        # proxy اشتباه در تنظیمات (مثلاً "No such proxy.") بقیه را از کار نمی‌اندازد
+        proxy_stats = parse_haproxy_stats(output)
+        if proxy_stats is None:
+            print(f"[ERROR] {target.name}: '{command}' returned no usable stats")
+            continue
+        stats.update(proxy_stats)
+        parsed += 1
+    
+    if not parsed:
+        return None, info, 'No usable stats'
+    target.rates.apply(time.time(), stats, int(info.get('Uptime_sec', '0') or '0') or None)
+    return stats, info, None
+
+def get_haproxy_state():
+    """آمار همه‌ی نمونه‌های HAProxy به صورت موازی، ادغام شده با برچسب instance"""
+    if _scrape_pool is None:
+        results = [scrape_target(haproxy_targets[0])]
+    else:
+        started = time.monotonic()
+        futures = []
+        for target in haproxy_targets:
+            future = _scrape_futures.get(target.name)
+            if future is not None and not future.done():
+                futures.append((target, future, False))
+                continue
+            future = _scrape_futures[target.name] = _scrape_pool.submit(scrape_target, target)
+            futures.append((target, future, True))
+        # هر هدف فقط تا timeout خودش منتظر می‌ماند؛ نودی که تا آن موقع جواب نداده در پس‌زمینه ادامه می‌دهد
+        # و جمع‌آوری بقیه معطل تلاش دوباره‌ی آن نمی‌شود
+        for target, future, fresh in futures:
+            if fresh:
+                wait([future], timeout=max(0.0, started + target.timeout - time.monotonic()))
+        results = [
+            future.result() if fresh and future.done()
+            else (None, None, 'Timed out' if fresh else 'Previous scrape still running')
+            for _, future, fresh in futures
+        ]
+    return merge_target_results(results)
+
+def merge_target_results(results):
+    """ادغام (stats, info, error) هر هدف به ترتیب haproxy_targets؛ None اگر هیچ کدام جواب نداده باشند"""
+    multiple = len(haproxy_targets) > 1
+    stats = {}
+    infos = []
+    instances = {}
+    for target, (target_stats, info, error) in zip(haproxy_targets, results):
+        instances[target.name] = {
+            'up': error is None,
+            'version': info.get('Version') if info else None,
+            'error': error
+        }
+        if target_stats is None:
+            continue
+        infos.append(info)
+        for name, data in target_stats.items():
+            data['instance'] = target.name
+            if multiple:
+                # نام سرورها فقط با بیش از یک نمونه پیشوند می‌گیرند (ممکن است در نودها تکراری باشند)
+                data['full_label'] = f"{target.name} - {data['full_label']}"
+                name = f"{target.name}/{name}"
+            stats[name] = data
+    
+    if not infos:
+        return None
+    info = dict(infos[0])
+    info['instances'] = instances
+    return stats, info
+
+def get_haproxy_stats():
+    """دریافت آمار از HAProxy - اصلاح نهایی"""
+    state = get_haproxy_state()
+    return state[0] if state else None
+
+def parse_proxy_scope(values):
+    """تبدیل پارامترهای proxy در query string (تکراری یا با کاما) به یک کلید ثابت"""
+    proxies = {name.strip() for value in values for name in value.split(',') if name.strip()}
+    return tuple(sorted(proxies))
+
+def build_stats_payload(stats, info, proxies=()):
+    """ساخت خروجی /api/stats (مرتب‌سازی و خلاصه) - فقط یک بار برای هر بار جمع‌آوری"""
+    if proxies:
+        stats = {name: data for name, data in stats.items() if data['backend'] in proxies}
+    
+    total_servers = len(stats)
+    active_servers = sum(1 for s in stats.values() if s['status'] == 'UP')
+    total_connections = sum(s['current_sessions'] for s in stats.values())
+    total_traffic = sum(s['bytes_in'] + s['bytes_out'] for s in stats.values())
+    
+    # پیدا کردن سرور فعال (که دارد ترافیک handle می‌کند)
+    active_server = None
+    backup_servers = []
+    
+    for name, data in stats.items():
+        if data['status'] == 'UP' and data['active'] and data['current_sessions'] > 0:
+            active_server = name
+        elif data['backup'] and data['status'] == 'UP':
+            backup_servers.append(name)
+    
+    # اگر سرور فعال نداشتیم، اولین سرور UP را انتخاب کن
+    if not active_server:
+        for name, data in stats.items():
+            if data['status'] == 'UP' and data['active']:
+                active_server = name
+                break
+    
+    # مرتب کردن سرورها بر اساس priority و وضعیت
+    sorted_servers = sorted(
+        stats.items(), 
+        key=lambda x: (x[1]['priority'], not x[1]['active'], x[1]['status'] != 'UP')
+    )
+    
+    return {
+        'stats': dict(sorted_servers),
+        'summary': {
+            'total_servers': total_servers,
+            'active_servers': active_servers,
+            'total_connections': total_connections,
+            'total_traffic': total_traffic,
+            'active_server': active_server,
+            'backup_servers': backup_servers,
+            'haproxy_version': info.get('Version'),
+            'haproxy_uptime': int(info.get('Uptime_sec', '0') or '0'),
+            'instances': info.get('instances', {}),
+            'weight_advice': [
+                item for item in info.get('weight_advice') or () if not proxies or item['backend'] in proxies
+            ] if info.get('weight_advice') is not None else None
+        }
+    }
+
+# فاصله‌ی جمع‌آوری آمار در پس‌زمینه (ثانیه) - مستقل از تعداد کاربران داشبورد
+STATS_POLL_INTERVAL = float(os.environ.get('STATS_POLL_INTERVAL', '2'))
+
+# فیلدهایی که در هر بار جمع‌آوری عوض می‌شوند و نباید نسخه‌ی جدید بسازند
+VOLATILE_SUMMARY_FIELDS = ('haproxy_uptime',)
+
+# snapshot منتشر شده هرگز تغییر نمی‌کند؛ هر بار جمع‌آوری یک snapshot جدید می‌سازد
+# version فقط وقتی بالا می‌رود که داده‌ها واقعاً تغییر کرده باشند
+StatsSnapshot = namedtuple('StatsSnapshot', ['version', 'timestamp', 'payload', 'error', 'state'])
+
+def _payload_changed(old, new):
+    """مقایسه‌ی دو payload بدون در نظر گرفتن فیلدهای متغیر (مثل uptime)"""
+    if old is None or new is None:
+        return old is not new
+    if old['stats'] != new['stats']:
+        return True
+    return any(
+        old['summary'].get(key) != value
+        for key, value in new['summary'].items()
+        if key not in VOLATILE_SUMMARY_FIELDS
+    )
+
+def compute_stats_delta(old, new):
+    """فقط سرورها و فیلدهایی که بین دو payload تغییر کرده‌اند"""
+    old_stats = old['stats']
+    new_stats = new['stats']
+    changed = {}
+    for name, data in new_stats.items():
+        previous = old_stats.get(name)
+        if previous is None:
+            # سرور جدید: همه‌ی فیلدها (شامل لیبل‌ها) فرستاده می‌شوند
+            changed[name] = data
+            continue
+        fields = {key: value for key, value in data.items() if previous.get(key) != value}
+        if fields:
+            changed[name] = fields
+    
+    delta = {
+        'changed': changed,
+        'removed': [name for name in old_stats if name not in new_stats],
+        'summary': {
+            key: value for key, value in new['summary'].items()
+            if old['summary'].get(key) != value and key not in VOLATILE_SUMMARY_FIELDS
+        }
+    }
+    if list(old_stats) != list(new_stats):
+        delta['order'] = list(new_stats)
+    return delta
+
+# تاریخچه‌ی درون برنامه: برای هر سرور ring buffer هایی با اندازه‌ی ثابت (array) از هر معیار
+# نمونه‌های خام برای مدت کوتاه و تجمیع min/max/avg برای بازه‌های طولانی‌تر نگه داشته می‌شوند
+HISTORY_SIZE = int(os.environ.get('HISTORY_SIZE', '1800'))
+
+# سطوح تجمیع به صورت "ثانیه‌های هر بازه:تعداد بازه" - پیش‌فرض: ۱ دقیقه برای ۱ روز، ۱ ساعت برای ۳۰ روز
+HISTORY_ROLLUPS = [
+    tuple(int(part) for part in tier.split(':'))
+    for tier in os.environ.get('HISTORY_ROLLUPS', '60:1440,3600:720').split(',') if tier
+]
+
+# معیارهای نگه داشته شده (نام ستون HAProxy -> فیلد آمار)
+HISTORY_METRICS = {
+    'scur': 'current_sessions',
+    'stot': 'total_sessions',
+    'bin': 'bytes_in',
+    'bout': 'bytes_out',
+    'status': 'status',
+}
+
+# وضعیت به عدد تبدیل می‌شود تا در همان آرایه‌ها جا شود
+STATUS_VALUES = {'UP': 1.0, 'NOLB': 0.5, 'DRAIN': 0.5, 'DOWN': 0.0, 'MAINT': -1.0}
+
+ROLLUP_AGGREGATES = ('min', 'max', 'avg')
+
+def _history_value(metric, value):
+    if metric == 'status':
+        # وضعیت‌های در حال گذار مثل "UP 1/3" هم با کلمه‌ی اول سنجیده می‌شوند
+        return STATUS_VALUES.get(str(value).split(' ', 1)[0], 0.0)
+    return float(value or 0)
+
+class RingBuffer:
+    """چند ستون array با ظرفیت ثابت؛ ستون times همیشه صعودی نوشته می‌شود"""
+    
+    __slots__ = ('capacity', 'columns', 'next', 'count')
+    
+    def __init__(self, capacity, columns):
+        self.capacity = capacity
+        self.columns = {name: array('d', bytes(8 * capacity)) for name in ('times',) + tuple(columns)}
+        self.next = 0
+        self.count = 0
+    
+    def append(self, row):
+        index = self.next
+        for name, column in self.columns.items():
+            column[index] = row[name]
+        self.next = (index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+    
+    @property
+    def full(self):
+        return self.count == self.capacity
+    
+    @property
+    def first_timestamp(self):
+        return self.columns['times'][self.next if self.full else 0] if self.count else None
+    
+    @property
+    def last_timestamp(self):
+        return self.columns['times'][self.next - 1] if self.count else None
+    
+    def _ordered(self, column):
+        """مقادیر به ترتیب زمان (قدیمی‌ترین اول)"""
+        if not self.full:
+            return column[:self.count]
+        return column[self.next:] + column[:self.next]
+    
+    def since(self, timestamp, names):
+        times = self._ordered(self.columns['times'])
+        start = bisect.bisect_right(times, timestamp)
+        result = {'times': times[start:].tolist()}
+        for name in names:
+            result[name] = self._ordered(self.columns[name])[start:].tolist()
+        return result
+    
+    def nbytes(self):
+        return self.capacity * 8 * len(self.columns)
+
+class RollupTier:
+    """تجمیع نمونه‌ها در بازه‌های resolution ثانیه‌ای؛ بازه‌ی جاری تا شروع بازه‌ی بعد در حافظه می‌ماند"""
+    
+    __slots__ = ('resolution', 'ring', '_bucket', '_pending')
+    
+    def __init__(self, resolution, capacity, metrics):
+        self.resolution = resolution
+        self.ring = RingBuffer(capacity, [f'{metric}:{aggregate}' for metric in metrics for aggregate in ROLLUP_AGGREGATES])
+        self._bucket = None
+        self._pending = None
+    
+    def add(self, timestamp, sample):
+        """ردیف بازه‌ی قبلی را برمی‌گرداند اگر با این نمونه بسته شده باشد"""
+        flushed = None
+        bucket = timestamp - timestamp % self.resolution
+        if bucket != self._bucket:
+            flushed = self.flush()
+            self._bucket = bucket
+            self._pending = {metric: [value, value, 0.0, 0] for metric, value in sample.items()}
+        for metric, value in sample.items():
+            pending = self._pending[metric]
+            if value < pending[0]:
+                pending[0] = value
+            if value > pending[1]:
+                pending[1] = value
+            pending[2] += value
+            pending[3] += 1
+        return flushed
+    
+    def _pending_row(self):
+        row = {'times': self._bucket}
+        for metric, (low, high, total, count) in self._pending.items():
+            row[f'{metric}:min'] = low
+            row[f'{metric}:max'] = high
+            row[f'{metric}:avg'] = total / count
+        return row
+    
+    def flush(self):
+        if self._pending is None:
+            return None
+        row = self._pending_row()
+        self.ring.append(row)
+        self._pending = None
+        return row
+    
+    def covers(self, since):
+        """آیا داده‌ی این سطح از since به بعد کامل است"""
+        if not self.ring.full:
+            return True
+        return self.ring.first_timestamp <= since
+    
+    def since(self, timestamp, metrics):
+        # بازه‌ای که since در وسط آن است هم برگردانده می‌شود
+        names = [f'{metric}:{aggregate}' for metric in metrics for aggregate in ROLLUP_AGGREGATES]
+        columns = self.ring.since(timestamp - self.resolution, names)
+        if self._pending is not None and self._bucket > timestamp - self.resolution:
+            row = self._pending_row()
+            for name, values in columns.items():
+                values.append(row[name])
+        
+        result = {'times': columns['times'], 'resolution': self.resolution, 'metrics': {}}
+        for aggregate in ROLLUP_AGGREGATES:
+            values = {metric: columns[f'{metric}:{aggregate}'] for metric in metrics}
+            if aggregate == 'avg':
+                result['metrics'] = values
+            else:
+                result[aggregate] = values
+        return result
+
+class ServerHistory:
+    """تاریخچه‌ی یک سرور: نمونه‌های خام و سطوح تجمیع"""
+    
+    __slots__ = ('interval', 'raw', 'rollups')
+    
+    def __init__(self, capacity, metrics, interval, rollups):
+        self.interval = interval
+        self.raw = RingBuffer(capacity, metrics)
+        self.rollups = [RollupTier(resolution, size, metrics) for resolution, size in sorted(rollups)]
+    
+    def append(self, timestamp, sample):
+        """ثبت نمونه؛ ردیف‌های تجمیعی بسته شده به صورت (resolution, row) برگردانده می‌شوند"""
+        row = dict(sample)
+        row['times'] = timestamp
+        self.raw.append(row)
+        return self._add_rollups(timestamp, sample)
+    
+    def _add_rollups(self, timestamp, sample):
+        flushed = []
+        for tier in self.rollups:
+            row = tier.add(timestamp, sample)
+            if row is not None:
+                flushed.append((tier.resolution, row))
+        return flushed
+    
+    def restore_raw(self, timestamp, sample):
+        """بازیابی از دیسک: بازه‌هایی که قبلاً تجمیع و ذخیره شده‌اند دوباره تجمیع نمی‌شوند"""
+        row = dict(sample)
+        row['times'] = timestamp
+        self.raw.append(row)
+        flushed = []
+        for tier in self.rollups:
+            last = tier.ring.last_timestamp
+            if last is None or timestamp >= last + tier.resolution:
+                row = tier.add(timestamp, sample)
+                if row is not None:
+                    flushed.append((tier.resolution, row))
+        return flushed
+    
+    def restore_rollup(self, resolution, row):
+        for tier in self.rollups:
+            if tier.resolution == resolution:
+                tier.ring.append(row)
+    
+    @property
+    def last_timestamp(self):
+        return self.raw.last_timestamp or 0.0
+    
+    def _raw_covers(self, since):
+        return not self.raw.full or self.raw.first_timestamp <= since
+    
+    def since(self, timestamp, metrics, step=0):
+        """پرس‌وجو از درشت‌ترین سطحی که با دقت step کل بازه را پوشش می‌دهد"""
+        tiers = [(self.interval, None, self._raw_covers(timestamp))]
+        tiers += [(tier.resolution, tier, tier.covers(timestamp)) for tier in self.rollups]
+        
+        fine_enough = [tier for resolution, tier, covers in tiers if covers and resolution <= step]
+        covering = [tier for resolution, tier, covers in tiers if covers]
+        if fine_enough:
+            tier = fine_enough[-1]
+        elif covering:
+            tier = covering[0]
+        else:
+            tier = tiers[-1][1]
+        
+        if tier is None:
+            columns = self.raw.since(timestamp, metrics)
+            return {
+                'times': columns.pop('times'),
+                'resolution': self.interval,
+                'metrics': columns
+            }
+        return tier.since(timestamp, metrics)
+    
+    def nbytes(self):
+        return self.raw.nbytes() + sum(tier.ring.nbytes() for tier in self.rollups)
+
+# ذخیره‌ی تاریخچه روی دیسک تا بعد از ری‌استارت سرویس از دست نرود (HISTORY_DIR خالی = فقط حافظه)
+HISTORY_DIR = os.environ.get('HISTORY_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'history'))
+
+# مدت نگهداری فایل‌ها (ثانیه): نمونه‌های خام و سطوح تجمیع
+HISTORY_RAW_RETENTION = int(os.environ.get('HISTORY_RAW_RETENTION', str(86400)))
+HISTORY_RETENTION = int(os.environ.get('HISTORY_RETENTION', str(30 * 86400)))
+
+# هر segment بازه‌ی زمانی ثابتی را پوشش می‌دهد و بعد از آن فایل بعدی شروع می‌شود
+HISTORY_SEGMENT_SECONDS = 86400
+
+# سرآیند segment: magic، طول رکورد، تعداد مقادیر هر رکورد، زمان شروع (۳۲ بایت با padding)
+SEGMENT_MAGIC = b'HAMSEG01'
+SEGMENT_HEADER = struct.Struct('<8sHHd')
+SEGMENT_HEADER_SIZE = 32
+
+class HistorySegments:
+    """یک جریان از segment های فقط-افزودنی با رکوردهای طول ثابت (timestamp, series id, values...)"""
+    
+    def __init__(self, directory, stream, value_count, span=HISTORY_SEGMENT_SECONDS, retention=HISTORY_RETENTION):
+        self.directory = directory
+        self.stream = stream
+        self.value_count = value_count
+        self.span = span
+        self.retention = retention
+        self.record = struct.Struct(f'<dI{value_count}d')
+        self._pattern = re.compile(rf'^{re.escape(stream)}-(\d+)\.seg$')
+        self._file = None
+        self._end = None
+    
+    def segments(self):
+        """(زمان شروع، مسیر) همه‌ی segment ها به ترتیب زمان"""
+        found = []
+        for name in os.listdir(self.directory):
+            match = self._pattern.match(name)
+            if match:
+                found.append((int(match.group(1)), os.path.join(self.directory, name)))
+        return sorted(found)
+    
+    def _header(self, start):
+        return SEGMENT_HEADER.pack(SEGMENT_MAGIC, self.record.size, self.value_count, start).ljust(SEGMENT_HEADER_SIZE, b'\0')
+    
+    def _compatible(self, header):
+        if len(header) < SEGMENT_HEADER.size:
+            return False
+        magic, record_size, value_count, _ = SEGMENT_HEADER.unpack_from(header)
+        return magic == SEGMENT_MAGIC and record_size == self.record.size and value_count == self.value_count
+    
+    def _open(self, start):
+        path = os.path.join(self.directory, f'{self.stream}-{start}.seg')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                header = f.read(SEGMENT_HEADER_SIZE)
+            size = os.path.getsize(path)
+            if size < SEGMENT_HEADER_SIZE or not self._compatible(header):
+                # فایل ناقص یا با قالب دیگر کنار گذاشته می‌شود، بازنویسی نمی‌شود
+                print(f"[ERROR] Incompatible history segment {path}, moving it aside")
+                os.replace(path, path + '.incompatible')
+            else:
+                # رکورد نیمه‌کاره‌ی انتهای فایل (crash وسط نوشتن) بریده می‌شود
+                partial = (size - SEGMENT_HEADER_SIZE) % self.record.size
+                if partial:
+                    print(f"[DEBUG] Truncating {partial} bytes of partial record from {path}")
+                    os.truncate(path, size - partial)
+                return open(path, 'ab')
+        
+        f = open(path, 'xb')
+        f.write(self._header(start))
+        f.flush()
+        os.fsync(f.fileno())
+        return f
+    
+    def append(self, records):
+        """records: لیست (timestamp, series_id, values) به ترتیب زمان"""
+        pack = self.record.pack
+        for start, group in itertools.groupby(records, key=lambda record: int(record[0] - record[0] % self.span)):
+            if self._file is None or start + self.span != self._end:
+                self.close()
+                self._file = self._open(start)
+                self._end = start + self.span
+                self.prune(start)
+            # کل دسته با یک write نوشته می‌شود
+            self._file.write(b''.join(pack(timestamp, series_id, *values) for timestamp, series_id, values in group))
+            self._file.flush()
+    
+    def last_timestamp(self):
+        """timestamp آخرین رکورد نوشته شده یا None"""
+        record_size = self.record.size
+        for start, path in reversed(self.segments()):
+            with open(path, 'rb') as f:
+                if not self._compatible(f.read(SEGMENT_HEADER_SIZE)):
+                    continue
+                count = (os.fstat(f.fileno()).st_size - SEGMENT_HEADER_SIZE) // record_size
+                if count > 0:
+                    f.seek(SEGMENT_HEADER_SIZE + (count - 1) * record_size)
+                    return struct.unpack('<d', f.read(8))[0]
+        return None
+    
+    def prune(self, now):
+        """حذف segment هایی که کل بازه‌ی آنها از مدت نگهداری گذشته است"""
+        for start, path in self.segments():
+            if start + self.span < now - self.retention:
+                os.unlink(path)
+    
+    def read(self, since=0.0):
+        """رکوردهای بعد از since، مستقیم از فایل‌ها با mmap"""
+        record_size = self.record.size
+        for start, path in self.segments():
+            if start + self.span <= since:
+                continue
+            with open(path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                count = (size - SEGMENT_HEADER_SIZE) // record_size
+                if count <= 0:
+                    continue
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    if not self._compatible(data[:SEGMENT_HEADER_SIZE]):
+                        continue
+                    # رکوردها به ترتیب زمان هستند: جستجوی دودویی روی timestamp
+                    low, high = 0, count
+                    while low < high:
+                        middle = (low + high) // 2
+                        if struct.unpack_from('<d', data, SEGMENT_HEADER_SIZE + middle * record_size)[0] < since:
+                            low = middle + 1
+                        else:
+                            high = middle
+                    chunk = data[SEGMENT_HEADER_SIZE + low * record_size:SEGMENT_HEADER_SIZE + count * record_size]
+            yield from self.record.iter_unpack(chunk)
+    
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class HistoryArchive:
+    """نسخه‌ی دیسکی تاریخچه: segment های خام، segment های هر سطح تجمیع و فایل شناسه‌ی سرورها"""
+    
+    def __init__(self, directory, metrics, rollups, raw_retention=HISTORY_RAW_RETENTION, retention=HISTORY_RETENTION):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.metrics = list(metrics)
+        self.series_path = os.path.join(directory, 'series.json')
+        self.series = self._load_series()
+        self.raw = HistorySegments(directory, 'raw', len(self.metrics), retention=raw_retention)
+        self.rollups = {
+            resolution: HistorySegments(directory, f'rollup{resolution}', len(self.metrics) * len(ROLLUP_AGGREGATES), retention=retention)
+            for resolution, _ in rollups
+        }
+        self.rollup_columns = [f'{metric}:{aggregate}' for metric in self.metrics for aggregate in ROLLUP_AGGREGATES]
+    
+    def _load_series(self):
+        try:
+            with open(self.series_path) as f:
+                return json.load(f)['series']
+        except FileNotFoundError:
+            return {}
+    
+    def reload_series(self):
+        self.series = self._load_series()
+    
+    def _save_series(self):
+        # فایل موقت + fsync + rename: یا نسخه‌ی قبلی می‌ماند یا نسخه‌ی کامل جدید
+        tmp_path = self.series_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'metrics': self.metrics, 'series': self.series}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.series_path)
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+    
+    def series_id(self, name):
+        series_id = self.series.get(name)
+        if series_id is None:
+            # شناسه قبل از اولین رکورد روی دیسک ثبت می‌شود
+            series_id = self.series[name] = len(self.series)
+            self._save_series()
+        return series_id
+    
+    def append(self, samples, flushed):
+        """samples: لیست (timestamp, name, sample)؛ flushed: لیست (name, resolution, row)"""
+        self.raw.append([
+            (timestamp, self.series_id(name), [sample[metric] for metric in self.metrics])
+            for timestamp, name, sample in samples
+        ])
+        by_resolution = {}
+        for name, resolution, row in flushed:
+            by_resolution.setdefault(resolution, []).append(
+                (row['times'], self.series_id(name), [row[column] for column in self.rollup_columns])
+            )
+        for resolution, records in by_resolution.items():
+            if resolution in self.rollups:
+                self.rollups[resolution].append(sorted(records, key=lambda record: record[0]))
+    
+    def close(self):
+        self.raw.close()
+        for segments in self.rollups.values():
+            segments.close()
+
+class HistoryStore:
+    """تاریخچه‌ی همه‌ی سرورها - از collector پر می‌شود و از /api/history خوانده می‌شود"""
+    
+    def __init__(self, capacity=HISTORY_SIZE, metrics=HISTORY_METRICS, interval=STATS_POLL_INTERVAL, rollups=HISTORY_ROLLUPS, archive=None):
+        self.capacity = capacity
+        self.metrics = dict(metrics)
+        self.interval = interval
+        self.rollups = list(rollups)
+        # سرورهایی که از پیکربندی حذف شده‌اند بعد از گذشتن طولانی‌ترین پنجره دور ریخته می‌شوند
+        self.retention = max([capacity * interval] + [resolution * size for resolution, size in self.rollups])
+        self.archive = archive
+        self._servers = {}
+        # سطرهای تجمیعی که restore از نمونه‌های خام دوباره ساخته و هنوز روی دیسک نیستند
+        self._restored = []
+        # آخرین سطر تجمیعی روی دیسک برای هر سطح؛ None یعنی این پروسه هنوز نمی‌نویسد (leader نیست)
+        self._written = None
+        self._lock = threading.Lock()
+    
+    def _series(self, name):
+        series = self._servers.get(name)
+        if series is None:
+            series = self._servers[name] = ServerHistory(self.capacity, self.metrics, self.interval, self.rollups)
+        return series
+    
+    def _archive(self, samples, flushed):
+        if self.archive is None:
+            return
+        try:
+            self.archive.append(samples, flushed)
+        except OSError as e:
+            # مشکل دیسک (مثلاً پر شدن) تاریخچه‌ی درون حافظه را متوقف نمی‌کند
+            print(f"[ERROR] Could not write history to {self.archive.directory}: {e}")
+    
+    def _unwritten(self, flushed):
+        """سطرهای تجمیعی که هنوز روی دیسک نیستند
+        
+        بعد از restore یا گرفتن قفل از leader قبلی، بازه‌هایی که در حافظه بسته می‌شوند ممکن است قبلاً نوشته شده باشند.
+        """
+        if self.archive is None:
+            return flushed
+        if self._written is None:
+            self._written = {resolution: segments.last_timestamp() for resolution, segments in self.archive.rollups.items()}
+        rows = []
+        for name, resolution, row in flushed:
+            written = self._written.get(resolution)
+            if written is None or row['times'] > written:
+                rows.append((name, resolution, row))
+        for name, resolution, row in rows:
+            self._written[resolution] = max(row['times'], self._written.get(resolution) or row['times'])
+        return rows
+    
+    def record(self, timestamp, stats, archive=True):
+        """ثبت یک نمونه برای همه‌ی سرورهای حاضر در این poll (archive=False: فقط حافظه)"""
+        with self._lock:
+            samples = []
+            flushed = []
+            for name, data in stats.items():
+                sample = {
+                    metric: _history_value(metric, data.get(field))
+                    for metric, field in self.metrics.items()
+                }
+                samples.append((timestamp, name, sample))
+                for resolution, row in self._series(name).append(timestamp, sample):
+                    flushed.append((name, resolution, row))
+            for name in [name for name, series in self._servers.items() if series.last_timestamp < timestamp - self.retention]:
+                del self._servers[name]
+            if archive:
+                # اولین نوشتن leader (بعد از گرفتن قفل) سطرهای restore را هم می‌نویسد
+                restored, self._restored = self._restored, []
+                self._archive(samples, self._unwritten(restored + flushed))
+            else:
+                self._written = None
+    
+    def restore(self, now=None):
+        """بازسازی ring buffer ها از فایل‌های دیسک در زمان شروع برنامه
+        
+        فقط حافظه: در زمان import هنوز leader انتخاب نشده و هر worker این کار را می‌کند.
+        """
+        if self.archive is None:
+            return 0
+        now = now or time.time()
+        names = {series_id: name for name, series_id in self.archive.series.items()}
+        metrics = list(self.archive.metrics)
+        rollup_columns = self.archive.rollup_columns
+        restored = 0
+        with self._lock:
+            # اول سطوح تجمیع، تا نمونه‌های خام فقط بازه‌های ذخیره نشده را دوباره تجمیع کنند
+            for resolution, size in self.rollups:
+                for timestamp, series_id, *values in self.archive.rollups[resolution].read(now - resolution * (size + 1)):
+                    name = names.get(series_id)
+                    if name is not None:
+                        row = dict(zip(rollup_columns, values))
+                        row['times'] = timestamp
+                        self._series(name).restore_rollup(resolution, row)
+                        restored += 1
+            
+            raw_window = max([(self.capacity + 1) * self.interval] + [resolution for resolution, _ in self.rollups])
+            flushed = []
+            for timestamp, series_id, *values in self.archive.raw.read(now - raw_window):
+                name = names.get(series_id)
+                if name is not None:
+                    for resolution, row in self._series(name).restore_raw(timestamp, dict(zip(metrics, values))):
+                        flushed.append((name, resolution, row))
+                    restored += 1
+            self._restored = flushed
+        return restored
+    
+    def servers(self):
+        with self._lock:
+            return list(self._servers)
+    
+    def query(self, server, metrics=None, since=0.0, step=0):
+        """None اگر سروری با این نام در تاریخچه نباشد"""
+        with self._lock:
+            series = self._servers.get(server)
+            if series is None:
+                return None
+            return series.since(since, metrics or list(self.metrics), step)
+    
+    def memory_bytes(self):
+        with self._lock:
+            return sum(series.nbytes() for series in self._servers.values())
+
+def open_history_archive():
+    if not HISTORY_DIR:
+        return None
+    try:
+        return HistoryArchive(HISTORY_DIR, HISTORY_METRICS, HISTORY_ROLLUPS)
+    except (OSError, ValueError) as e:
+        print(f"[ERROR] Could not open history directory {HISTORY_DIR}: {e}")
+        return None
+
+history = HistoryStore(archive=open_history_archive())
+if history.archive is not None:
+    print(f"[DEBUG] Restored {history.restore()} history records from {HISTORY_DIR}")
+
+# رویدادهای تغییر وضعیت (UP/DOWN/MAINT، check_status، تغییر سرور فعال) در SQLite (EVENTS_DB خالی = غیرفعال)
+EVENTS_DB = os.environ.get('EVENTS_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'events.db'))
+
+# حداکثر رویدادهای نوشته نشده (وقتی دیتابیس در دسترس نیست) که در حافظه نگه داشته می‌شوند
+EVENTS_PENDING_LIMIT = 10000
+
+# مدت نگهداری رویدادها (ثانیه، 0 = همیشه)؛ حذف قدیمی‌ها حداکثر هر EVENTS_PRUNE_INTERVAL ثانیه یک بار موقع نوشتن
+EVENTS_RETENTION = int(os.environ.get('EVENTS_RETENTION', str(90 * 86400)))
+EVENTS_PRUNE_INTERVAL = 3600
+
+EVENTS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    server TEXT,
+    kind TEXT NOT NULL,
+    old TEXT,
+    new TEXT,
+    duration REAL
+);
+CREATE INDEX IF NOT EXISTS events_server_ts ON events (server, ts);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+CREATE INDEX IF NOT EXISTS events_kind_ts ON events (kind, ts);
+'''
+
+# سروری که در یک poll نیست فقط وقتی فراموش می‌شود که نمونه‌ی HAProxy خودش جواب داده باشد (از پیکربندی حذف شده)
+# یا این مدت (ثانیه) دیده نشده باشد؛ قطعی یک نمونه وضعیت و آمار سرورهایش را صفر نمی‌کند
+SERVER_FORGET_AFTER = float(os.environ.get('SERVER_FORGET_AFTER', str(86400)))
+
+class ServerPresence:
+    """نمونه و آخرین زمان دیده شدن هر سرور، برای تصمیم درباره‌ی سرورهای غایب یک poll"""
+    
+    def __init__(self, ttl=SERVER_FORGET_AFTER):
+        self.ttl = ttl
+        self._seen = {}
+    
+    def forget(self, timestamp, stats, instances, tracked):
+        """نام‌هایی از tracked که باید فراموش شوند
+        
+        instances همان summary['instances'] است ({name: {'up': ...}})؛ None یعنی نامعلوم و فقط ttl حساب می‌شود.
+        """
+        for name, data in stats.items():
+            self._seen[name] = (data.get('instance'), timestamp)
+        gone = []
+        for name in tracked:
+            if name in stats:
+                continue
+            # سروری که هنوز دیده نشده (مثلاً از لاگ رویدادها seed شده) از همین حالا ttl می‌گیرد
+            instance, seen = self._seen.setdefault(name, (None, timestamp))
+            # نمونه‌ای که دیگر در HAPROXY_TARGETS نیست هم جواب داده حساب می‌شود
+            answered = instances is not None and instance is not None and instances.get(instance, {'up': True})['up']
+            if answered or timestamp - seen >= self.ttl:
+                gone.append(name)
+                del self._seen[name]
+        return gone
+
+class TransitionDetector:
+    """تشخیص تغییرات بین دو poll؛ duration مدت ماندن در وضعیت قبلی است"""
+    
+    def __init__(self):
+        self._states = {}
+        self._presence = ServerPresence()
+    
+    def seed(self, states):
+        """وضعیت آخر هر سرور از رویدادهای ذخیره شده، تا مدت‌ها بعد از ری‌استارت هم درست باشند"""
+        self._states.update(states)
+    
+    def _change(self, events, timestamp, server, kind, value):
+        key = (server, kind)
+        previous = self._states.get(key)
+        if previous is not None and previous[0] == value:
+            return
+        self._states[key] = (value, timestamp)
+        if previous is None:
+            # اولین مشاهده: وضعیت پایه، تغییری ثبت نمی‌شود
+            return
+        events.append({
+            'ts': timestamp,
+            'server': server,
+            'kind': kind,
+            'old': previous[0],
+            'new': value,
+            'duration': round(timestamp - previous[1], 3)
+        })
+    
+    def observe(self, timestamp, payload):
+        events = []
+        stats = payload['stats']
+        for name, data in stats.items():
+            # وضعیت‌های در حال گذار مثل "UP 1/3" با کلمه‌ی اول سنجیده می‌شوند
+            self._change(events, timestamp, name, 'status', str(data['status']).split(' ', 1)[0])
+            self._change(events, timestamp, name, 'check_status', data.get('check_status'))
+        self._change(events, timestamp, None, 'active_server', payload['summary'].get('active_server'))
+        
+        # سرورهای حذف شده فراموش می‌شوند؛ سرورهای نمونه‌ای که جواب نداده وضعیت قبلی را نگه می‌دارند
+        # تا تغییری که در این فاصله رخ داده بعد از برگشتن ثبت شود
+        tracked = {key[0] for key in self._states if key[0] is not None}
+        gone = set(self._presence.forget(timestamp, stats, payload['summary'].get('instances'), tracked))
+        for key in [key for key in self._states if key[0] in gone]:
+            del self._states[key]
+        return events
+
+class EventLog:
+    """ذخیره‌ی رویدادها در SQLite با WAL؛ رویدادهای هر poll در یک تراکنش نوشته می‌شوند"""
+    
+    def __init__(self, path, retention=EVENTS_RETENTION):
+        self.path = path
+        self.retention = retention
+        self._pending = []
+        self._next_prune = 0.0
+        self._lock = threading.Lock()
+        # اتصال نوشتن فقط از thread جمع‌آوری استفاده می‌شود؛ خواندن با اتصال جداگانه
+        self._writer = self._connect(check_same_thread=False)
+        self._writer.executescript(EVENTS_SCHEMA)
+    
+    def _connect(self, check_same_thread=True):
+        connection = sqlite3.connect(self.path, timeout=5, check_same_thread=check_same_thread)
+        connection.row_factory = sqlite3.Row
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+    
+    def last_states(self):
+        """(server, kind) -> (value, ts) از آخرین رویداد هر سرور"""
+        with self._lock:
+            rows = self._writer.execute(
+                'SELECT server, kind, new, ts FROM events WHERE id IN (SELECT MAX(id) FROM events GROUP BY server, kind)'
+            ).fetchall()
+        return {(row['server'], row['kind']): (row['new'], row['ts']) for row in rows}
+    
+    def add(self, events):
+        with self._lock:
+            self._pending.extend(events)
+            if not self._pending:
+                return
+            try:
+                with self._writer:
+                    self._writer.executemany(
+                        'INSERT INTO events (ts, server, kind, old, new, duration) '
+                        'VALUES (:ts, :server, :kind, :old, :new, :duration)',
+                        self._pending
+                    )
+                    self._prune()
+                self._pending = []
+            except sqlite3.Error as e:
+                # دفعه‌ی بعد دوباره تلاش می‌شود؛ قدیمی‌ترین‌ها اگر صف بیش از حد بزرگ شود دور ریخته می‌شوند
+                print(f"[ERROR] Could not write events to {self.path}: {e}")
+                del self._pending[:-EVENTS_PENDING_LIMIT]
+    
+    def _prune(self):
+        """حذف رویدادهای قدیمی‌تر از retention (داخل تراکنش نوشتن)
+        
+        آخرین رویداد هر (server, kind) می‌ماند تا last_states بعد از ری‌استارت وضعیت سرورهای بی‌تغییر را هم داشته باشد.
+        """
+        now = time.time()
+        if not self.retention or now < self._next_prune:
+            return
+        self._next_prune = now + EVENTS_PRUNE_INTERVAL
+        cutoff = now - self.retention
+        deleted = self._writer.execute(
+            'DELETE FROM events WHERE ts < ? AND id NOT IN (SELECT MAX(id) FROM events WHERE ts < ? GROUP BY server, kind)',
+            (cutoff, cutoff)
+        ).rowcount
+        if deleted:
+            print(f"[DEBUG] Pruned {deleted} events older than {self.retention}s from {self.path}")
+    
+    def status_events(self, since=None):
+        """رویدادهای status از قدیم به جدید (فقط از since به بعد، اگر داده شود)"""
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT ts, server, old, new, duration FROM events WHERE kind = 'status' AND ts >= ? ORDER BY ts, id",
+                (since if since is not None else float('-inf'),)
+            ).fetchall()
+        finally:
+            connection.close()
+        return [dict(row) for row in rows]
+    
+    def query(self, server=None, kind=None, since=None, until=None, before=None, limit=100):
+        """رویدادها از جدید به قدیم به ترتیب (ts, id)؛ before همان (ts, id) آخرین رویداد صفحه‌ی قبل است
+        
+        رویدادهای یک سرور از ایندکس events_server_ts و تغییرهای سرور فعالِ درگیر با آن جداگانه از events_kind_ts
+        خوانده و با UNION ALL یکی می‌شوند؛ یک OR روی هر دو، SQLite را به پیمایش کل جدول می‌انداخت.
+        """
+        conditions, params = [], []
+        if since is not None:
+            conditions.append('ts >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('ts < ?')
+            params.append(until)
+        if before is not None:
+            # ts <= ? بازه‌ی ایندکس است و id رویدادهای هم‌زمان را از هم جدا می‌کند
+            before_ts, before_id = before
+            conditions.append('ts <= ? AND (ts < ? OR id < ?)')
+            params += [before_ts, before_ts, before_id]
+        
+        branches = []
+        if server is None:
+            branches.append((['kind = ?'], [kind]) if kind is not None else ([], []))
+        else:
+            # +kind: ایندکس events_kind_ts برای این شاخه انتخاب نشود، events_server_ts خیلی باریک‌تر است
+            branches.append((['server = ?', '+kind = ?'], [server, kind]) if kind is not None else (['server = ?'], [server]))
+            if kind in (None, 'active_server'):
+                # تغییر سرور فعال هم برای سرورهای درگیر در آن برگردانده می‌شود
+                branches.append((["kind = 'active_server'", '(old = ? OR new = ?)'], [server, server]))
+        
+        selects, select_params = [], []
+        for branch_conditions, branch_params in branches:
+            where = ' AND '.join(branch_conditions + conditions)
+            selects.append(
+                'SELECT id, ts, server, kind, old, new, duration FROM events'
+                + (f' WHERE {where}' if where else '')
+                + ' ORDER BY ts DESC, id DESC LIMIT ?'
+            )
+            select_params += branch_params + params + [limit]
+        if len(selects) == 1:
+            sql = selects[0]
+        else:
+            sql = ' UNION ALL '.join(f'SELECT * FROM ({select})' for select in selects) + ' ORDER BY ts DESC, id DESC LIMIT ?'
+            select_params.append(limit)
+        
+        connection = self._connect()
+        try:
+            rows = connection.execute(sql, select_params).fetchall()
+        finally:
+            connection.close()
+        return [dict(row) for row in rows]
+
+def open_event_log():
+    if not EVENTS_DB:
+        return None
+    try:
+        return EventLog(EVENTS_DB)
+    except sqlite3.Error as e:
+        print(f"[ERROR] Could not open event log {EVENTS_DB}: {e}")
+        return None
+
+event_log = open_event_log()
+transitions = TransitionDetector()
+if event_log is not None:
+    transitions.seed(event_log.last_states())
+
+# callback(events) برای هر دسته رویداد جدید، فقط در leader (مثلاً hook ها و اعلان‌ها)
+event_listeners = []
+
+def add_event_listener(callback):
+    event_listeners.append(callback)
+
+def record_transitions(timestamp, payload, store=True):
+    """ثبت تغییرات این poll در لاگ رویدادها (store=False: فقط به‌روز نگه داشتن وضعیت)"""
+    events = transitions.observe(timestamp, payload)
+    if not store:
+        return
+    for event in events:
+        print(f"[DEBUG] Event: {event['kind']} {event['server'] or ''} {event['old']} -> {event['new']} after {event['duration']}s")
+    if event_log is not None:
+        event_log.add(events)
+    if events:
+        for callback in event_listeners:
+            try:
+                callback(events)
+            except Exception as e:
+                print(f"[ERROR] Event listener failed: {e}")
+
+# اعلان تغییرات به بیرون: webhook (POST با JSON) و/یا یک دستور محلی (بدون shell، رویدادها روی stdin)
+NOTIFY_WEBHOOK_URL = os.environ.get('NOTIFY_WEBHOOK_URL', '')
+NOTIFY_COMMAND = os.environ.get('NOTIFY_COMMAND', '')
+NOTIFY_KINDS = [kind for kind in os.environ.get('NOTIFY_KINDS', 'status,active_server').split(',') if kind]
+# رویدادهای این مدت (ثانیه) بعد از اولین رویداد با هم فرستاده می‌شوند
+NOTIFY_BATCH_DELAY = float(os.environ.get('NOTIFY_BATCH_DELAY', '2'))
+# حداقل فاصله‌ی دو ارسال به یک مقصد (ثانیه)
+NOTIFY_MIN_INTERVAL = float(os.environ.get('NOTIFY_MIN_INTERVAL', '10'))
+NOTIFY_TIMEOUT = float(os.environ.get('NOTIFY_TIMEOUT', '5'))
+NOTIFY_QUEUE_SIZE = 1000
+# تلاش دوباره با فاصله‌ی دو برابر شونده از NOTIFY_MIN_INTERVAL (حداکثر NOTIFY_BACKOFF_MAX) و بعد دور ریختن دسته
+NOTIFY_MAX_ATTEMPTS = 6
+NOTIFY_BACKOFF_MAX = 300.0
+
+def coalesce_events(events):
+    """یکی کردن رویدادهای هر (server, kind): از وضعیت اول به وضعیت آخر، با تعداد تغییرات (flap)"""
+    merged = {}
+    for event in events:
+        key = (event['server'], event['kind'])
+        entry = merged.get(key)
+        if entry is None:
+            merged[key] = dict(event, first_ts=event.get('first_ts', event['ts']), count=event.get('count', 1))
+            continue
+        entry['new'] = event['new']
+        entry['ts'] = event['ts']
+        entry['duration'] = event['duration']
+        entry['count'] += event.get('count', 1)
+    return sorted(merged.values(), key=lambda entry: entry['ts'])
+
+def describe_event(event):
+    """متن یک خطی رویداد برای پیام‌ها"""
+    subject = event['server'] if event['kind'] != 'active_server' else 'active server'
+    text = f"{subject}: {event['kind']} {event['old']} -> {event['new']}"
+    if event.get('count', 1) > 1:
+        text += f" ({event['count']} changes)"
+    return text
+
+class WebhookSink:
+    """ارسال دسته‌ی رویدادها با POST و بدنه‌ی JSON"""
+    
+    def __init__(self, url, timeout=NOTIFY_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+        self.name = f"webhook {url}"
+    
+    def send(self, message):
+        data = json.dumps(message).encode()
+        req = urllib.request.Request(self.url, data=data, method='POST', headers={
+            'Content-Type': 'application/json',
+            'User-Agent': 'HA-Monitor'
+        })
+        # پاسخ 4xx/5xx با HTTPError خطا می‌دهد
+        with urllib.request.urlopen(req, timeout=self.timeout) as response:
+            response.read()
+
+class CommandSink:
+    """اجرای یک دستور محلی برای هر دسته؛ JSON روی stdin و خلاصه در HA_EVENT_SUMMARY"""
+    
+    def __init__(self, command, timeout=NOTIFY_TIMEOUT):
+        self.args = shlex.split(command)
+        self.timeout = timeout
+        self.name = f"command {self.args[0]}"
+    
+    def send(self, message):
+        env = dict(os.environ, HA_EVENT_SUMMARY='\n'.join(describe_event(event) for event in message['events']))
+        result = subprocess.run(self.args, input=json.dumps(message).encode(), env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=self.timeout)
+        if result.returncode != 0:
+            raise RuntimeError(f"exit status {result.returncode}: {result.stderr.decode(errors='replace').strip()}")
+
+class Notifier:
+    """صف محدود و thread جدا برای هر مقصد - collector هیچ وقت منتظر ارسال نمی‌ماند"""
+    
+    def __init__(self, sink, kinds=NOTIFY_KINDS, batch_delay=NOTIFY_BATCH_DELAY,
+                 min_interval=NOTIFY_MIN_INTERVAL, queue_size=NOTIFY_QUEUE_SIZE):
+        self.sink = sink
+        self.kinds = set(kinds)
+        self.batch_delay = batch_delay
+        self.min_interval = min_interval
+        self._queue = deque(maxlen=queue_size)
+        self._dropped = 0
+        self._ready = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=f"notifier {sink.name}", daemon=True)
+        self._thread.start()
+    
+    def submit(self, events):
+        """event listener: فقط صف‌بندی؛ با پر شدن صف قدیمی‌ترین رویدادها کنار گذاشته می‌شوند"""
+        events = [event for event in events if event['kind'] in self.kinds]
+        if not events:
+            return
+        with self._ready:
+            overflow = len(self._queue) + len(events) - self._queue.maxlen
+            if overflow > 0:
+                self._dropped += overflow
+            self._queue.extend(events)
+            self._ready.notify()
+    
+    def _take(self):
+        with self._ready:
+            events = list(self._queue)
+            self._queue.clear()
+            dropped, self._dropped = self._dropped, 0
+        return events, dropped
+    
+    def _run(self):
+        batch, dropped = [], 0
+        last_sent = 0.0
+        attempt = 0
+        while True:
+            if not batch:
+                with self._ready:
+                    self._ready.wait_for(lambda: self._queue)
+                # رویدادهای پشت سر هم (flap) در یک دسته جمع می‌شوند؛ رویدادهای جدید تا ارسال بعدی در صف می‌مانند
+                time.sleep(max(self.batch_delay, last_sent + self.min_interval - time.monotonic()))
+            
+            events, more_dropped = self._take()
+            batch = coalesce_events(batch + events)
+            dropped += more_dropped
+            message = {
+                'source': 'ha-monitor',
+                'host': socket.gethostname(),
+                'events': batch,
+                'dropped': dropped
+            }
+            try:
+                self.sink.send(message)
+            except Exception as e:
+                attempt += 1
+                if attempt >= NOTIFY_MAX_ATTEMPTS:
+                    print(f"[ERROR] Notification to {self.sink.name} failed {attempt} times, dropping {len(batch)} events: {e}")
+                    batch, dropped, attempt = [], 0, 0
+                    continue
+                delay = min(NOTIFY_BACKOFF_MAX, max(1.0, self.min_interval) * 2 ** (attempt - 1))
+                print(f"[ERROR] Notification to {self.sink.name} failed ({e}), retrying in {delay}s")
+                time.sleep(delay)
+                continue
+            
+            print(f"[DEBUG] Sent {len(batch)} events to {self.sink.name}")
+            last_sent = time.monotonic()
+            batch, dropped, attempt = [], 0, 0
+
+def open_notifiers():
+    sinks = []
+    if NOTIFY_WEBHOOK_URL:
+        sinks.append(WebhookSink(NOTIFY_WEBHOOK_URL))
+    if NOTIFY_COMMAND:
+        sinks.append(CommandSink(NOTIFY_COMMAND))
+    return [Notifier(sink) for sink in sinks]
+
+notifiers = open_notifiers()
+for notifier in notifiers:
+    add_event_listener(notifier.submit)
+
+# پنجره‌ی میانگین نمایی نرخ flap (ثانیه) و نرخی (تغییر در دقیقه) که از آن به بعد سرور ناپایدار حساب می‌شود
+FLAP_WINDOW = float(os.environ.get('FLAP_WINDOW', '300'))
+FLAP_THRESHOLD = float(os.environ.get('FLAP_THRESHOLD', '2'))
+# بعد از ری‌استارت failures و MTBF/MTTR از رویدادهای این مدت (ثانیه) بازسازی می‌شوند
+FLAP_HISTORY = float(os.environ.get('FLAP_HISTORY', str(7 * 86400)))
+
+# وضعیت‌هایی که در دسترس/خراب حساب می‌شوند؛ MAINT و بقیه کار اپراتور هستند و در MTBF/MTTR نمی‌آیند
+STATUS_AVAILABILITY = {'UP': 'up', 'NOLB': 'up', 'DRAIN': 'up', 'DOWN': 'down'}
+
+class ServerFlaps:
+    __slots__ = ('status', 'since', 'rate', 'rate_ts', 'failures', 'repairs', 'up_time', 'down_time')
+    
+    def __init__(self, status, since):
+        self.status = status
+        self.since = since
+        self.rate = 0.0
+        self.rate_ts = since
+        self.failures = 0
+        self.repairs = 0
+        self.up_time = 0.0
+        self.down_time = 0.0
+
+class FlapTracker:
+    """نرخ flap (EWMA)، زمان در وضعیت فعلی و MTBF/MTTR هر سرور - به‌روزرسانی O(1) برای هر نمونه"""
+    
+    def __init__(self, window=FLAP_WINDOW, threshold=FLAP_THRESHOLD):
+        self.window = window
+        self.threshold = threshold
+        self._servers = {}
+        self._presence = ServerPresence()
+        self._lock = threading.Lock()
+    
+    def _observe(self, server, status, timestamp, since=None):
+        entry = self._servers.get(server)
+        if entry is None:
+            entry = self._servers[server] = ServerFlaps(status, timestamp if since is None else since)
+            return entry
+        if entry.status == status:
+            return entry
+        
+        old = STATUS_AVAILABILITY.get(entry.status)
+        new = STATUS_AVAILABILITY.get(status)
+        elapsed = max(0.0, timestamp - entry.since)
+        if old == 'up':
+            entry.up_time += elapsed
+        elif old == 'down':
+            entry.down_time += elapsed
+        if old and new and old != new:
+            # هر flap به اندازه‌ی 1/window اضافه می‌شود و مقدار قبلی با گذشت زمان نمایی کم می‌شود
+            entry.rate = self._rate(entry, timestamp) + 1.0 / self.window
+            entry.rate_ts = timestamp
+            if new == 'down':
+                entry.failures += 1
+            else:
+                entry.repairs += 1
+        entry.status = status
+        entry.since = timestamp
+        return entry
+    
+    def _rate(self, entry, timestamp):
+        return entry.rate * math.exp(-max(0.0, timestamp - entry.rate_ts) / self.window)
+    
+    def fields(self, entry, timestamp):
+        rate = round(self._rate(entry, timestamp) * 60, 2)
+        return {
+            'flap_rate': rate,
+            'flapping': rate >= self.threshold,
+            'state_since': entry.since,
+            'failures': entry.failures,
+            'mtbf': round(entry.up_time / entry.failures, 1) if entry.failures else None,
+            'mttr': round(entry.down_time / entry.repairs, 1) if entry.repairs else None
+        }
+    
+    def annotate(self, timestamp, stats, instances=None):
+        """stats جدید با فیلدهای flap هر سرور؛ دیکشنری سرورها کپی می‌شود چون ممکن است با snapshot قبلی مشترک باشند
+        
+        instances (info['instances']) می‌گوید سرور غایب از پیکربندی حذف شده یا فقط نمونه‌اش جواب نداده است.
+        """
+        annotated = {}
+        with self._lock:
+            for name, data in stats.items():
+                # lastchg فقط برای سروری که هنوز رویدادی از آن نداریم زمان شروع وضعیت را می‌دهد
+                # و چون هر ثانیه عوض می‌شود در خروجی نمی‌ماند
+                lastchg = data.get('lastchg')
+                since = timestamp - lastchg if lastchg is not None else None
+                entry = self._observe(name, str(data['status']).split(' ', 1)[0], timestamp, since)
+                fields = self.fields(entry, timestamp)
+                if 'lastchg' in data:
+                    data = {key: value for key, value in data.items() if key != 'lastchg'}
+                    data.update(fields)
+                elif any(data.get(key) != value for key, value in fields.items()):
+                    data = dict(data, **fields)
+                annotated[name] = data
+            # سرورهای حذف شده فراموش می‌شوند؛ قطعی نمونه‌ی HAProxy آمار flap سرورهایش را صفر نمی‌کند
+            for name in self._presence.forget(timestamp, stats, instances, list(self._servers)):
+                del self._servers[name]
+        return annotated
+    
+    def replay(self, events):
+        """بازسازی از رویدادهای status ذخیره شده (به ترتیب زمان)، تا آمار بعد از ری‌استارت از صفر شروع نشود"""
+        with self._lock:
+            self._servers.clear()
+            for event in events:
+                if event['server'] not in self._servers:
+                    self._observe(event['server'], event['old'], event['ts'] - (event['duration'] or 0))
+                self._observe(event['server'], event['new'], event['ts'])
+            return len(self._servers)
+
+flaps = FlapTracker()
+
+def replay_flaps():
+    if event_log is not None:
+        # فقط رویدادهای بازه‌ای که FlapTracker لازم دارد: FLAP_HISTORY و دست کم ده برابر FLAP_WINDOW برای flap_rate
+        count = flaps.replay(event_log.status_events(since=time.time() - max(FLAP_HISTORY, 10 * FLAP_WINDOW)))
+        print(f"[DEBUG] Restored flap statistics of {count} servers from {EVENTS_DB}")
+
+replay_flaps()
+
+# صدک‌های متحرک زمان‌ها روی آخرین LATENCY_WINDOW نمونه (هر جمع‌آوری یک نمونه)
+LATENCY_WINDOW = int(os.environ.get('LATENCY_WINDOW', '300'))
+LATENCY_METRICS = ('check_duration', 'qtime', 'ctime', 'rtime', 'ttime')
+LATENCY_PERCENTILES = (50, 95)
+
+class MovingPercentiles:
+    """پنجره‌ی لغزان به همراه نسخه‌ی مرتب آن؛ اضافه و حذف با bisect و خواندن صدک O(1)"""
+    __slots__ = ('_window', '_sorted')
+    
+    def __init__(self, size):
+        self._window = deque(maxlen=size)
+        self._sorted = []
+    
+    def add(self, value):
+        if len(self._window) == self._window.maxlen:
+            del self._sorted[bisect.bisect_left(self._sorted, self._window[0])]
+        self._window.append(value)
+        bisect.insort(self._sorted, value)
+    
+    def percentile(self, percent):
+        # nearest-rank
+        if not self._sorted:
+            return None
+        return self._sorted[max(0, math.ceil(len(self._sorted) * percent / 100) - 1)]
+
+class LatencyTracker:
+    """صدک‌های check_duration، qtime، ctime، rtime و ttime هر سرور در فیلد latency"""
+    
+    def __init__(self, metrics=LATENCY_METRICS, window=LATENCY_WINDOW):
+        self.metrics = metrics
+        self.window = window
+        self._servers = {}
+        self._presence = ServerPresence()
+    
+    def annotate(self, stats, instances=None):
+        """stats با فیلد latency؛ پنجره‌های سرورهای نمونه‌ای که جواب نداده مثل FlapTracker نگه داشته می‌شوند"""
+        annotated = {}
+        for name, data in stats.items():
+            windows = self._servers.setdefault(name, {})
+            # فقط سرورهای در دسترس نمونه می‌دهند؛ check_duration یک سرور DOWN همان timeout چک است
+            available = STATUS_AVAILABILITY.get(str(data['status']).split(' ', 1)[0]) == 'up'
+            latency = {}
+            for metric in self.metrics:
+                value = data.get(metric)
+                window = windows.get(metric)
+                if available and value is not None:
+                    if window is None:
+                        window = windows[metric] = MovingPercentiles(self.window)
+                    window.add(value)
+                if window is not None:
+                    latency[metric] = {f'p{percent}': window.percentile(percent) for percent in LATENCY_PERCENTILES}
+            annotated[name] = dict(data, latency=latency)
+        for name in self._presence.forget(time.time(), stats, instances, list(self._servers)):
+            del self._servers[name]
+        return annotated
+
+latency = LatencyTracker()
+
+# پیشنهاد وزن بر اساس تاخیر: off، advise (فقط نمایش در /api/stats) یا apply (اعمال با set server weight)
+WEIGHT_ADVISOR = os.environ.get('WEIGHT_ADVISOR', 'off')
+WEIGHT_ADVISOR_METRIC = os.environ.get('WEIGHT_ADVISOR_METRIC', 'check_duration')
+WEIGHT_PREFERRED = int(os.environ.get('WEIGHT_PREFERRED', '100'))
+WEIGHT_OTHERS = int(os.environ.get('WEIGHT_OTHERS', '10'))
+# سرور ترجیحی فقط وقتی عوض می‌شود که جایگزین دست کم این نسبت سریع‌تر باشد و از تغییر قبلی cooldown گذشته باشد
+WEIGHT_HYSTERESIS = float(os.environ.get('WEIGHT_HYSTERESIS', '0.2'))
+WEIGHT_COOLDOWN = float(os.environ.get('WEIGHT_COOLDOWN', '300'))
+
+class WeightAdvisor:
+    """انتخاب کم‌تاخیرترین سرور سالم هر backend (با hysteresis و cooldown) و وزن پیشنهادی سرورها"""
+    
+    def __init__(self, mode=WEIGHT_ADVISOR, metric=WEIGHT_ADVISOR_METRIC):
+        if mode not in ('off', 'advise', 'apply'):
+            raise ValueError(f"WEIGHT_ADVISOR must be off, advise or apply, not {mode!r}")
+        self.mode = mode
+        self.metric = metric
+        self._preferred = {}
+        self._changed_at = {}
+        self._applied = (None, 0.0)
+    
+    def _candidates(self, servers):
+        healthy = [
+            (name, data) for name, data in servers
+            if str(data['status']).split(' ', 1)[0] == 'UP' and not data.get('flapping')
+            and data.get('latency', {}).get(self.metric, {}).get('p50') is not None
+        ]
+        # وزن فقط بین سرورهای هم‌نقش معنی دارد: سرورهای اصلی، یا backup ها وقتی هیچ سرور اصلی سالم نیست
+        return [(name, data) for name, data in healthy if not data['backup']] or healthy
+    
+    def advise(self, timestamp, stats):
+        """فهرست پیشنهادها برای هر backend با بیش از یک گزینه؛ None وقتی غیرفعال است"""
+        if self.mode == 'off':
+            return None
+        groups = {}
+        for name, data in stats.items():
+            groups.setdefault((data.get('instance'), data['backend']), []).append((name, data))
+        
+        advice = []
+        for key, servers in groups.items():
+            candidates = self._candidates(servers)
+            if len(candidates) < 2:
+                continue
+            latencies = {name: data['latency'][self.metric]['p50'] for name, data in candidates}
+            best = min(latencies, key=latencies.get)
+            current = self._preferred.get(key)
+            if current not in latencies:
+                # اولین بار (یا وقتی سرور ترجیحی دیگر سالم نیست) سروری که الان بیشترین وزن را دارد
+                weights = sorted((data['weight'] for _, data in candidates), reverse=True)
+                heaviest = max(candidates, key=lambda item: item[1]['weight'])[0]
+                current = heaviest if weights[0] > weights[1] else None
+            
+            if current is None:
+                preferred = best
+            elif (best != current and latencies[best] <= latencies[current] * (1 - WEIGHT_HYSTERESIS)
+                  and timestamp - self._changed_at.get(key, 0.0) >= WEIGHT_COOLDOWN):
+                preferred = best
+            else:
+                preferred = current
+            if preferred != self._preferred.get(key):
+                self._preferred[key] = preferred
+                self._changed_at[key] = timestamp
+            
+            weights = {name: WEIGHT_PREFERRED if name == preferred else WEIGHT_OTHERS for name, _ in candidates}
+            advice.append({
+                'instance': key[0],
+                'backend': key[1],
+                'metric': self.metric,
+                'preferred': preferred,
+                'weights': weights,
+                'pending': sorted(name for name, weight in weights.items() if stats[name]['weight'] != weight)
+            })
+        return advice
+    
+    def apply(self, advice, stats):
+        """اعمال وزن‌های پیشنهادی که هنوز اعمال نشده‌اند (فقط در حالت apply)"""
+        changes = [
+            {'server': name, 'action': 'weight', 'weight': item['weights'][name]}
+            for item in advice or () for name in item['pending']
+        ]
+        if self.mode != 'apply' or not changes:
+            return None
+        # اگر HAProxy همان تغییرات را قبول نکرده، تا cooldown دوباره فرستاده نمی‌شوند
+        key = tuple((change['server'], change['weight']) for change in changes)
+        if self._applied[0] == key and time.monotonic() - self._applied[1] < WEIGHT_COOLDOWN:
+            return None
+        self._applied = (key, time.monotonic())
+        try:
+            results = apply_server_changes(plan_server_changes(changes, stats))
+        except ValueError as e:
+            print(f"[ERROR] Weight advisor: {e}")
+            return None
+        print(f"[DEBUG] Weight advisor applied {[(result['server'], result['ok']) for result in results]}")
+        collector.refresh_now()
+        return results
+
+weight_advisor = WeightAdvisor()
+
+# تعداد نسخه‌های اخیر که برای ساخت delta نگه داشته می‌شوند
+DELTA_HISTORY_SIZE = 32
+
+# اشتراک snapshot بین worker ها (مثلاً gunicorn -w 4): فقط یک worker از HAProxy می‌خواند
+# مسیر بدون پسوند؛ فایل‌های .json و .lock کنار هم ساخته می‌شوند. خالی یعنی هر process جمع‌آوری خودش را دارد
+STATS_SHARED_PATH = os.environ.get('STATS_SHARED_PATH', '')
+
+# فاصله‌ی بررسی فایل مشترک در worker هایی که leader نیستند (ثانیه)
+SHARED_POLL_INTERVAL = 0.25
+
+class SharedSnapshot:
+    """leader (دارنده‌ی flock روی فایل .lock) snapshot را در فایل .json می‌نویسد و بقیه آن را می‌خوانند"""
+    
+    def __init__(self, path):
+        self.path = path + '.json'
+        self.lock_path = path + '.lock'
+        # worker های دیگر با عوض کردن mtime این فایل از leader جمع‌آوری فوری می‌خواهند
+        self.refresh_path = path + '.refresh'
+        self.is_leader = False
+        self._lock_file = None
+        self._stamp = None
+        self._refresh_stamp = None
+    
+    def try_lead(self):
+        """گرفتن قفل بدون انتظار؛ قفل با مرگ leader خودبه‌خود آزاد می‌شود"""
+        if self.is_leader:
+            return True
+        if self._lock_file is None:
+            self._lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        self.is_leader = True
+        # درخواست‌های قبلی لازم نیستند، leader جدید همین حالا جمع‌آوری می‌کند
+        self.refresh_requested()
+        print(f"[DEBUG] Worker {os.getpid()} is now the stats collector leader ({self.lock_path})")
+        return True
+    
+    def request_refresh(self):
+        """از worker غیر leader: جمع‌آوری فوری در leader"""
+        with open(self.refresh_path, 'a'):
+            os.utime(self.refresh_path)
+    
+    def refresh_requested(self):
+        """در leader: آیا از آخرین بررسی worker دیگری request_refresh کرده است؟"""
+        try:
+            stamp = os.stat(self.refresh_path).st_mtime_ns
+        except FileNotFoundError:
+            stamp = None
+        requested = stamp != self._refresh_stamp
+        self._refresh_stamp = stamp
+        return requested
+    
+    def write(self, snapshot):
+        """نوشتن اتمیک: فایل موقت و rename، خواننده‌ها هرگز فایل نیمه‌کاره نمی‌بینند"""
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'version': snapshot.version,
+                'timestamp': snapshot.timestamp,
+                'error': snapshot.error,
+                'state': snapshot.state
+            }, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+    
+    def read(self):
+        """snapshot جدید leader یا None اگر از دفعه‌ی قبل تغییری نکرده"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        stamp = (stat.st_ino, stat.st_mtime_ns)
+        if stamp == self._stamp:
+            return None
+        with open(self.path) as f:
+            data = json.load(f)
+        self._stamp = stamp
+        return data
+
+class StatsCollector:
+    """جمع‌آوری مشترک آمار در پس‌زمینه - همه‌ی درخواست‌ها از آخرین snapshot استفاده می‌کنند"""
+    
+    def __init__(self, interval=STATS_POLL_INTERVAL):
+        self.interval = interval
+        self._snapshot = None
+        self._version = 0
+        self._history = deque(maxlen=DELTA_HISTORY_SIZE)
+        self._delta_cache = {}
+        self._scoped_cache = {}
+        self._body_cache = {}
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._published = threading.Condition()
+        self._wakeup = threading.Event()
+        # collector و StatusWatcher هر دو منتشر می‌کنند
+        self._publish_lock = threading.RLock()
+        self._listeners = []
+        self.shared = None
+        # در حالت ASGI جمع‌آوری با event loop انجام می‌شود و thread شروع نمی‌شود
+        self.external = False
+    
+    @property
+    def snapshot(self):
+        return self._snapshot
+    
+    def ensure_started(self):
+        """شروع thread جمع‌آوری (فقط یک بار، در اولین درخواست)"""
+        with self._start_lock:
+            if self._thread is None and not self.external:
+                self._thread = threading.Thread(target=self._run, name='stats-collector', daemon=True)
+                self._thread.start()
+                print(f"[DEBUG] Stats collector started (interval {self.interval}s)")
+        status_watcher.start()
+    
+    def wait_for_snapshot(self, timeout):
+        """انتظار برای اولین snapshot بعد از راه‌اندازی"""
+        with self._published:
+            self._published.wait_for(lambda: self._snapshot is not None, timeout)
+        return self._snapshot
+    
+    def wait_for_change(self, version, timeout):
+        """انتظار تا انتشار نسخه‌ای غیر از version؛ در صورت timeout مقدار None"""
+        with self._published:
+            changed = self._published.wait_for(
+                lambda: self._snapshot is not None and self._snapshot.version != version, timeout)
+            return self._snapshot if changed else None
+    
+    def _cached(self, cache, key, build):
+        with self._published:
+            value = cache.get(key)
+        if value is None:
+            value = build()
+            with self._published:
+                # کلاینت‌ها معمولاً در چند نسخه‌ی اخیر هستند؛ cache کوچک کافی است
+                if len(cache) >= DELTA_HISTORY_SIZE:
+                    cache.clear()
+                cache[key] = value
+        return value
+    
+    def scoped_payload(self, version, payload, state, proxies):
+        """payload محدود به چند proxy (برای ?proxy=) - یک بار برای هر نسخه ساخته می‌شود"""
+        if not proxies or payload is None:
+            return payload
+        return self._cached(self._scoped_cache, (version, proxies),
+                            lambda: build_stats_payload(state[0], state[1], proxies))
+    
+    def delta_since(self, base_version, snapshot, proxies=()):
+        """تغییرات snapshot نسبت به base_version؛ None یعنی کلاینت باید کل آمار را بگیرد"""
+        if snapshot.payload is None:
+            return None
+        with self._published:
+            base = next((entry for entry in self._history if entry[0] == base_version), None)
+        if base is None:
+            return None
+        
+        def build():
+            old = self.scoped_payload(*base, proxies)
+            new = self.scoped_payload(snapshot.version, snapshot.payload, snapshot.state, proxies)
+            return compute_stats_delta(old, new)
+        
+        return self._cached(self._delta_cache, (base_version, snapshot.version, proxies), build)
+    
+    def refresh_now(self):
+        """جمع‌آوری فوری بدون صبر برای دوره‌ی بعدی (در worker غیر leader، جمع‌آوری leader)"""
+        self._wakeup.set()
+        if self.shared is not None and not self.shared.is_leader:
+            try:
+                self.shared.request_refresh()
+            except OSError as e:
+                print(f"[ERROR] Could not signal the stats collector leader: {e}")
+    
+    def clear_refresh(self):
+        """قبل از هر جمع‌آوری؛ refresh_now ای که از این به بعد برسد wait_for_refresh بعدی را بیدار می‌کند"""
+        self._wakeup.clear()
+    
+    def wait_for_refresh(self, timeout):
+        """صبر تا دوره‌ی بعدی جمع‌آوری یا درخواست refresh_now بعد از آخرین clear_refresh"""
+        if self.shared is None or not self.shared.is_leader:
+            self._wakeup.wait(timeout)
+            return
+        # leader درخواست‌های worker های دیگر را هر SHARED_POLL_INTERVAL از فایل .refresh می‌بیند
+        deadline = time.monotonic() + timeout
+        while not self._wakeup.wait(max(0.0, min(SHARED_POLL_INTERVAL, deadline - time.monotonic()))):
+            if self.shared.refresh_requested() or time.monotonic() >= deadline:
+                return
+    
+    def add_listener(self, callback):
+        """callback(snapshot) بعد از انتشار هر نسخه‌ی جدید (از thread انتشار دهنده صدا زده می‌شود)"""
+        self._listeners.append(callback)
+    
+    def collect(self):
+        """یک بار جمع‌آوری از HAProxy و انتشار snapshot جدید"""
+        started = time.time()
+        return self.publish(get_haproxy_state(), started)
+    
+    def publish(self, state, started=None, record=True):
+        """انتشار نتیجه‌ی یک بار جمع‌آوری ((stats, info) یا None)
+        
+        started: زمان شروع جمع‌آوری؛ تغییر وضعیت‌هایی که StatusWatcher بعد از آن دیده روی نتیجه اعمال می‌شوند.
+        record=False: فقط وضعیت عوض شده، نمونه‌ای به تاریخچه اضافه نمی‌شود.
+        """
+        with self._publish_lock:
+            if state is not None and started is not None:
+                state = (status_watcher.overlay(state[0], started), state[1])
+            advice = None
+            if state is not None:
+                stats, info = flaps.annotate(time.time(), state[0], state[1].get('instances')), state[1]
+                if record:
+                    # صدک‌ها فقط از جمع‌آوری کامل؛ انتشار StatusWatcher همان زمان‌های قبلی را دارد
+                    stats = latency.annotate(stats, info.get('instances'))
+                    advice = weight_advisor.advise(time.time(), stats)
+                    info = dict(info, weight_advice=advice)
+                state = (stats, info)
+            if state is None:
+                payload, error = None, 'Could not fetch HAProxy stats'
+            else:
+                payload, error = build_stats_payload(*state), None
+            
+            with self._published:
+                previous = self._snapshot
+                changed = previous is None or previous.error != error or _payload_changed(previous.payload, payload)
+                version = self._version + 1 if changed else self._version
+            snapshot = self._install(StatsSnapshot(version, time.time(), payload, error, state), primary=True, record=record)
+            if self.shared is not None:
+                self.shared.write(snapshot)
+        if advice:
+            weight_advisor.apply(advice, state[0])
+        return snapshot
+    
+    def apply_status(self, statuses):
+        """انتشار فوری وضعیت‌های جدید ({server: status}) روی آخرین آمار، بدون جمع‌آوری کامل"""
+        with self._publish_lock:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.state is None:
+                return None
+            stats, info = snapshot.state
+            patched = overlay_status(stats, statuses)
+            if patched is stats:
+                return None
+            return self.publish((patched, info), record=False)
+    
+    def install_shared(self, data):
+        """نصب snapshot خوانده شده از فایل مشترک leader (با همان شماره‌ی نسخه)"""
+        state = tuple(data['state']) if data['state'] is not None else None
+        payload = build_stats_payload(*state) if state is not None else None
+        return self._install(StatsSnapshot(data['version'], data['timestamp'], payload, data['error'], state), primary=False)
+    
+    def _install(self, snapshot, primary, record=True):
+        with self._published:
+            previous = self._snapshot
+            changed = previous is None or previous.version != snapshot.version
+            if changed and snapshot.payload is not None:
+                self._history.append((snapshot.version, snapshot.payload, snapshot.state))
+            self._version = snapshot.version
+            self._snapshot = snapshot
+            if changed:
+                self._published.notify_all()
+        if changed:
+            for callback in self._listeners:
+                callback(snapshot)
+        # تاریخچه در هر poll ثبت می‌شود، حتی وقتی نسخه‌ی جدیدی ساخته نشده
+        # فقط leader روی دیسک می‌نویسد؛ بقیه‌ی worker ها تاریخچه و وضعیت را فقط در حافظه دنبال می‌کنند
+        if snapshot.state is not None:
+            if record:
+                history.record(snapshot.timestamp, snapshot.state[0], archive=primary)
+            record_transitions(snapshot.timestamp, snapshot.payload, store=primary)
+        return snapshot
+    
+    def follow_step(self):
+        """worker غیر leader: یک بار خواندن فایل مشترک؛ True وقتی قفل leader گرفته شد (حالت ASGI هم از این استفاده می‌کند)"""
+        if self.shared.try_lead():
+            if history.archive is not None:
+                # leader قبلی ممکن است سرور جدیدی به series.json اضافه کرده باشد
+                history.archive.reload_series()
+            # آمار flap از رویدادهایی که leader قبلی ثبت کرده
+            replay_flaps()
+            return True
+        self.clear_refresh()
+        data = self.shared.read()
+        if data is not None:
+            self.install_shared(data)
+        return False
+    
+    def _follow(self):
+        """خواندن فایل مشترک تا وقتی قفل leader آزاد شود"""
+        while not self.follow_step():
+            self.wait_for_refresh(SHARED_POLL_INTERVAL)
+    
+    def _run(self):
+        while True:
+            try:
+                if self.shared is not None and not self.shared.is_leader:
+                    self._follow()
+                self.clear_refresh()
+                self.collect()
+            except Exception as e:
+                print(f"[ERROR] Exception in stats collector: {e}")
+                import traceback
+                traceback.print_exc()
+            self.wait_for_refresh(self.interval)
+
+collector = StatsCollector()
+
+# فاصله‌ی بررسی سریع وضعیت سرورها (ثانیه)، هم‌اندازه‌ی inter چک‌های HAProxy؛ 0 یعنی غیرفعال
+STATUS_WATCH_INTERVAL = float(os.environ.get('STATUS_WATCH_INTERVAL', '0.2'))
+# بعد از خطا، آن نمونه‌ی HAProxy تا این مدت بررسی سریع نمی‌شود (ثانیه)
+STATUS_WATCH_RETRY = 5.0
+
+# بیت‌های srv_admin_state در show servers state (FMAINT|IMAINT|CMAINT|RMAINT|HMAINT و FDRAIN|IDRAIN)
+SERVER_ADMIN_MAINT = 0x01 | 0x02 | 0x04 | 0x20 | 0x40
+SERVER_ADMIN_DRAIN = 0x08 | 0x10
+# srv_op_state (STOPPED, STARTING, RUNNING, STOPPING) با همان نام‌های ستون status در show stat
+SERVER_OP_STATES = {'0': 'DOWN', '1': 'UP', '2': 'UP', '3': 'NOLB'}
+
+SERVERS_STATE_COMMANDS = [f"show servers state {proxy}" for proxy in STATS_PROXIES] or ['show servers state']
+# برای HAProxy قدیمی‌تر از 1.6 که show servers state ندارد
+STATUS_STAT_COMMANDS = build_stat_commands(STATS_PROXIES, ['server'])
+
+def parse_servers_state(output):
+    """تبدیل خروجی show servers state به {svname: status}؛ None اگر پاسخ خطا باشد"""
+    lines = output.splitlines()
+    # خط اول شماره‌ی نسخه‌ی قالب است و خط دوم نام ستون‌ها
+    if not lines or not lines[0].strip().isdigit():
+        return None
+    columns = {}
+    states = {}
+    for line in lines[1:]:
+        if line.startswith('#'):
+            columns = {name: i for i, name in enumerate(line[1:].split())}
+            continue
+        fields = line.split()
+        try:
+            name = fields[columns['srv_name']]
+            op_state = fields[columns['srv_op_state']]
+            admin = int(fields[columns['srv_admin_state']])
+        except (KeyError, IndexError, ValueError):
+            continue
+        if admin & SERVER_ADMIN_MAINT:
+            states[name] = 'MAINT'
+        elif admin & SERVER_ADMIN_DRAIN and op_state in ('1', '2'):
+            states[name] = 'DRAIN'
+        else:
+            states[name] = SERVER_OP_STATES.get(op_state, 'UNKNOWN')
+    return states
+
+def parse_stat_status(output):
+    """فقط ستون status از show stat؛ None اگر پاسخ خطا باشد"""
+    lines = output.strip().splitlines()
+    if not lines or not lines[0].startswith('# '):
+        return None
+    columns = lines[0][2:].split(',')
+    svname, status = columns.index('svname'), columns.index('status')
+    return {
+        row[svname]: str(row[status]).split(' ', 1)[0]
+        for row in csv.reader(lines[1:])
+        if len(row) > status and row[svname] not in ('FRONTEND', 'BACKEND')
+    }
+
+def overlay_status(stats, statuses):
+    """کپی stats با وضعیت‌های جدید؛ اگر وضعیت هیچ سروری (کلمه‌ی اول) عوض نشده همان stats برمی‌گردد"""
+    changed = {name: status for name, status in statuses.items()
+               if name in stats and str(stats[name]['status']).split(' ', 1)[0] != status}
+    if not changed:
+        return stats
+    stats = dict(stats)
+    for name, status in changed.items():
+        stats[name] = dict(stats[name], status=status)
+    return stats
+
+class StatusWatcher:
+    """بررسی سریع فقط وضعیت سرورها تا failover در چند صد میلی‌ثانیه دیده شود
+    
+    تغییرات با collector.apply_status منتشر می‌شوند: داشبورد، لاگ رویدادها و event_listeners
+    همان مسیر جمع‌آوری کامل را می‌بینند، بدون show stat و parse کامل.
+    """
+    
+    def __init__(self, interval=STATUS_WATCH_INTERVAL):
+        self.interval = interval
+        # نشست جدا از collector تا پشت یک show stat بزرگ منتظر نماند
+        self._sessions = {}
+        self._commands = {}
+        self._retry_at = {}
+        self._states = {}
+        # server -> (status, ts) آخرین تغییرات، برای اعمال روی جمع‌آوری‌هایی که زودتر شروع شده‌اند
+        self._changes = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._start_lock = threading.Lock()
+    
+    def start(self):
+        # هر نمونه thread خودش را دارد تا یک نود در دسترس نبودن (timeout و تلاش دوباره) بقیه را دیر نکند
+        with self._start_lock:
+            if not self._threads and self.interval > 0:
+                for target in haproxy_targets:
+                    thread = threading.Thread(target=self._run, args=(target,), name=f'status-watcher-{target.name}', daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+                print(f"[DEBUG] Status watcher started for {len(self._threads)} targets (interval {self.interval}s)")
+    
+    def _scan(self, target):
+        session = self._sessions.get(target.name)
+        if session is None:
+            session = self._sessions[target.name] = HAProxyRuntimeSession(target.address, target.timeout)
+        commands = self._commands.get(target.name, SERVERS_STATE_COMMANDS)
+        parser = parse_servers_state if commands is SERVERS_STATE_COMMANDS else parse_stat_status
+        
+        states = {}
+        for reply in session.execute_many(commands):
+            parsed = parser(reply)
+            if parsed is None:
+                if commands is SERVERS_STATE_COMMANDS:
+                    print(f"[DEBUG] {target.name}: show servers state failed ({reply.strip()}), using show stat")
+                    self._commands[target.name] = STATUS_STAT_COMMANDS
+                    return self._scan(target)
+                raise HAProxySocketError(f"Unexpected reply to {commands}: {reply.strip()}")
+            states.update(parsed)
+        return states
+    
+    def poll(self, target):
+        """یک بار بررسی یک نمونه؛ {server: status} سرورهایی که وضعیتشان عوض شده"""
+        timestamp = time.time()
+        multiple = len(haproxy_targets) > 1
+        changes = {}
+        if self._retry_at.get(target.name, 0) > time.monotonic():
+            return changes
+        try:
+            states = self._scan(target)
+        except HAProxySocketError as e:
+            print(f"[ERROR] Status watcher {target.name}: {e}")
+            self._retry_at[target.name] = time.monotonic() + STATUS_WATCH_RETRY
+            return changes
+        for name, status in states.items():
+            key = f"{target.name}/{name}" if multiple else name
+            previous = self._states.get(key)
+            self._states[key] = status
+            # اولین مشاهده فقط وضعیت پایه است
+            if previous is not None and previous != status:
+                changes[key] = status
+        
+        if changes:
+            print(f"[DEBUG] Status watcher: {changes}")
+            with self._lock:
+                for name, status in changes.items():
+                    self._changes[name] = (status, timestamp)
+            collector.apply_status(changes)
+        return changes
+    
+    def overlay(self, stats, since):
+        """اعمال تغییراتی که بعد از since دیده شده‌اند روی نتیجه‌ی یک جمع‌آوری کامل (که ممکن است قدیمی‌تر باشد)"""
+        with self._lock:
+            self._changes = {name: change for name, change in self._changes.items() if change[1] >= since}
+            recent = {name: status for name, (status, _) in self._changes.items()}
+        return overlay_status(stats, recent) if recent else stats
+    
+    def _run(self, target):
+        while True:
+            started = time.monotonic()
+            # با چند worker فقط leader بررسی و منتشر می‌کند
+            if collector.shared is None or collector.shared.is_leader:
+                try:
+                    self.poll(target)
+                except Exception as e:
+                    print(f"[ERROR] Exception in status watcher: {e}")
+                    import traceback
+                    traceback.print_exc()
+            time.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+status_watcher = StatusWatcher()
+
+def snapshot_result(snapshot, proxies=()):
+    """خروجی JSON یک snapshot به همراه نسخه و عمر آن"""
+    result = dict(collector.scoped_payload(snapshot.version, snapshot.payload, snapshot.state, proxies))
+    summary = result['summary'] = dict(result['summary'])
+    for key in VOLATILE_SUMMARY_FIELDS:
+        summary[key] = snapshot.payload['summary'].get(key)
+    result['version'] = snapshot.version
+    result['collected_at'] = snapshot.timestamp
+    result['age'] = round(time.time() - snapshot.timestamp, 3)
+    return result
+
+def snapshot_delta_result(delta, base_version, snapshot):
+    """خروجی JSON تغییرات نسبت به base_version"""
+    summary = dict(delta['summary'])
+    for key in VOLATILE_SUMMARY_FIELDS:
+        summary[key] = snapshot.payload['summary'].get(key)
+    
+    result = dict(delta)
+    result['summary'] = summary
+    result['delta'] = True
+    result['base_version'] = base_version
+    result['version'] = snapshot.version
+    result['collected_at'] = snapshot.timestamp
+    result['age'] = round(time.time() - snapshot.timestamp, 3)
+    return result
+
+# بدنه‌های کوچک‌تر از این (بایت) فشرده نمی‌شوند
+STATS_GZIP_MIN_SIZE = 1024
+
+StatsBody = namedtuple('StatsBody', ['data', 'etag', 'encoding'])
+
+def accepts_gzip(accept_encoding):
+    """آیا هدر Accept-Encoding شامل gzip (بدون q=0) است"""
+    for part in accept_encoding.lower().split(','):
+        coding, _, params = part.partition(';')
+        if coding.strip() == 'gzip':
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+def _etag_key(tag):
+    # نسخه‌ی gzip و نسخه‌ی عادی یک بدنه هم‌ارز هستند؛ proxy ها ممکن است tag را weak کنند
+    tag = tag.strip()
+    if tag.startswith('W/'):
+        tag = tag[2:]
+    return tag.replace('-gzip"', '"')
+
+def etag_matches(if_none_match, etag):
+    """مقایسه‌ی If-None-Match با ETag (شامل * و فهرست چند tag)"""
+    if not if_none_match:
+        return False
+    tags = {_etag_key(tag) for tag in if_none_match.split(',')}
+    return '*' in tags or _etag_key(etag) in tags
+
+def stats_body(snapshot, proxies=(), since=None, gzipped=False):
+    """بدنه‌ی JSON آماده‌ی /api/stats و ETag آن - برای هر نسخه یک بار serialize و فشرده می‌شود
+    
+    collected_at، age و فیلدهای متغیر summary (مثل haproxy_uptime) در بدنه نیستند تا ETag فقط با نسخه عوض شود؛
+    stats_headers آنها را در هدرها می‌فرستد.
+    """
+    delta = collector.delta_since(since, snapshot, proxies) if since is not None else None
+    base = since if delta is not None else None
+    
+    def build():
+        if delta is not None:
+            result = snapshot_delta_result(delta, since, snapshot)
+        else:
+            result = snapshot_result(snapshot, proxies)
+        for key in ('collected_at', 'age'):
+            del result[key]
+        result['summary'] = {key: value for key, value in result['summary'].items() if key not in VOLATILE_SUMMARY_FIELDS}
+        data = json.dumps(result, separators=(',', ':')).encode()
+        # ETag از محتوای بدنه؛ بعد از restart شماره‌ی نسخه‌ها از اول شروع می‌شود
+        return StatsBody(data, f'"{hashlib.sha1(data).hexdigest()[:24]}"', None)
+    
+    key = (snapshot.version, proxies, base)
+    body = collector._cached(collector._body_cache, key, build)
+    if not gzipped or len(body.data) < STATS_GZIP_MIN_SIZE:
+        return body
+    return collector._cached(collector._body_cache, key + ('gzip',), lambda: StatsBody(
+        gzip.compress(body.data, compresslevel=6, mtime=0), f'{body.etag[:-1]}-gzip"', 'gzip'))
+
+def stats_headers(snapshot):
+    """زمان جمع‌آوری و عمر snapshot برای پاسخ‌های /api/stats (200 و 304)"""
+    age = max(0.0, time.time() - snapshot.timestamp)
+    return [
+        ('Age', str(int(age))),
+        ('Last-Modified', formatdate(snapshot.timestamp, usegmt=True)),
+        ('X-Stats-Age', f'{age:.3f}'),
+        ('X-Collected-At', f'{snapshot.timestamp:.3f}'),
+        ('X-HAProxy-Uptime', str(snapshot.payload['summary'].get('haproxy_uptime', 0)))
+    ]
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     error = None
@@ -287,56 +2737,438 @@ def logout():
 @app.route('/api/stats')
 @login_required
 def api_stats():
-    """API endpoint برای دریافت آمار - کاملاً dynamic"""
+    """API endpoint برای دریافت آمار - از snapshot مشترک، بدون تماس مستقیم با HAProxy"""
     print("[DEBUG] API /api/stats called")
-    stats = get_haproxy_stats()
+    collector.ensure_started()
+    snapshot = collector.snapshot or collector.wait_for_snapshot(HAPROXY_SOCKET_TIMEOUT * 2)
     
-    if stats is None:
+    if snapshot is None or snapshot.payload is None:
         print("[ERROR] Could not fetch HAProxy stats")
-        return jsonify({'error': 'Could not fetch HAProxy stats'}), 500
+        error = {'error': snapshot.error if snapshot else 'Could not fetch HAProxy stats'}
+        if snapshot:
+            error['age'] = round(time.time() - snapshot.timestamp, 3)
+        return jsonify(error), 500
+    
+    # ?proxy=at فقط سرورهای یک (یا چند) backend را برمی‌گرداند
+    proxies = parse_proxy_scope(request.args.getlist('proxy'))
+    
+    # کلاینتی که نسخه‌ی قبلی را دارد فقط تغییرات را می‌گیرد
+    since = request.args.get('since', type=int)
+    body = stats_body(snapshot, proxies, since, accepts_gzip(request.headers.get('Accept-Encoding', '')))
+    
+    # تا وقتی نسخه عوض نشده، کلاینتی که همین بدنه را دارد فقط 304 می‌گیرد
+    headers = {'ETag': body.etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+    headers.update(stats_headers(snapshot))
+    if etag_matches(request.headers.get('If-None-Match', ''), body.etag):
+        return Response(status=304, headers=headers)
+    if body.encoding:
+        headers['Content-Encoding'] = body.encoding
+    return Response(body.data, mimetype='application/json', headers=headers)
+
+# فاصله‌ی ارسال keepalive روی stream وقتی داده‌ای تغییر نکرده (ثانیه)
+STREAM_KEEPALIVE_INTERVAL = 15
+
+def _is_empty_delta(delta):
+    return not (delta['changed'] or delta['removed'] or delta['summary'] or 'order' in delta)
+
+def _stream_message(snapshot, base_version=None, proxies=()):
+    """تبدیل snapshot به یک پیام Server-Sent Events (در صورت امکان فقط تغییرات)"""
+    if snapshot.payload is None:
+        return f"id: {snapshot.version}\nevent: stats-error\ndata: {json.dumps({'error': snapshot.error})}\n\n"
+    
+    delta = collector.delta_since(base_version, snapshot, proxies) if base_version is not None else None
+    if delta is not None:
+        if _is_empty_delta(delta):
+            # تغییر در proxy هایی بوده که این کلاینت نمی‌بیند
+            return None
+        data = json.dumps(snapshot_delta_result(delta, base_version, snapshot), separators=(',', ':'))
+        return f"id: {snapshot.version}\nevent: stats-delta\ndata: {data}\n\n"
+    
+    data = json.dumps(snapshot_result(snapshot, proxies), separators=(',', ':'))
+    return f"id: {snapshot.version}\nevent: stats\ndata: {data}\n\n"
+
+@app.route('/api/stats/stream')
+@login_required
+def api_stats_stream():
+    """ارسال push آمار با Server-Sent Events - فقط وقتی چیزی تغییر کرده"""
+    collector.ensure_started()
+    proxies = parse_proxy_scope(request.args.getlist('proxy'))
+    # بعد از قطع و وصل، مرورگر آخرین id دریافتی را می‌فرستد
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    
+    def generate():
+        # version آخرین نسخه‌ی دیده شده و base_version آخرین نسخه‌ی فرستاده شده به کلاینت است
+        version = base_version = last_event_id
+        snapshot = collector.snapshot or collector.wait_for_snapshot(HAPROXY_SOCKET_TIMEOUT * 2)
         
-    total_servers = len(stats)
-    active_servers = sum(1 for s in stats.values() if s['status'] == 'UP')
-    total_connections = sum(s['current_sessions'] for s in stats.values())
-    total_traffic = sum(s['bytes_in'] + s['bytes_out'] for s in stats.values())
+        while True:
+            if snapshot is None:
+                yield ': keepalive\n\n'
+            elif snapshot.version != version:
+                # یک بار آمار فعلی (یا تغییرات نسبت به Last-Event-ID)، بعد فقط تغییرات
+                message = _stream_message(snapshot, base_version, proxies)
+                version = snapshot.version
+                if message is not None:
+                    yield message
+                    base_version = version if snapshot.payload is not None else None
+            snapshot = collector.wait_for_change(version, STREAM_KEEPALIVE_INTERVAL)
     
-    # پیدا کردن سرور فعال (که دارد ترافیک handle می‌کند)
-    active_server = None
-    backup_servers = []
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/history')
+@login_required
+def api_history():
+    """تاریخچه‌ی معیارهای یک سرور (یا همه‌ی سرورها) از ring buffer های درون برنامه"""
+    collector.ensure_started()
+    server = request.args.get('server')
+    since = request.args.get('since', 0.0, type=float)
+    # step: فاصله‌ی مطلوب بین نقاط (ثانیه)؛ برای بازه‌های طولانی سطح تجمیع درشت‌تر انتخاب می‌شود
+    step = request.args.get('step', 0.0, type=float)
+    metrics = [metric for value in request.args.getlist('metric') for metric in value.split(',') if metric]
+    unknown = [metric for metric in metrics if metric not in history.metrics]
+    if unknown:
+        return jsonify({'error': f"Unknown metric: {', '.join(unknown)}", 'metrics': list(history.metrics)}), 400
     
-    for name, data in stats.items():
-        if data['status'] == 'UP' and data['active'] and data['current_sessions'] > 0:
-            active_server = name
-        elif data['backup'] and data['status'] == 'UP':
-            backup_servers.append(name)
+    if server:
+        series = history.query(server, metrics, since, step)
+        if series is None:
+            return jsonify({'error': f'No history for server {server}'}), 404
+        result = {'server': server}
+        result.update(series)
+        return jsonify(result)
     
-    # اگر سرور فعال نداشتیم، اولین سرور UP را انتخاب کن
-    if not active_server:
-        for name, data in stats.items():
-            if data['status'] == 'UP' and data['active']:
-                active_server = name
-                break
+    servers = {}
+    for name in history.servers():
+        series = history.query(name, metrics, since, step)
+        if series is not None:
+            servers[name] = series
+    return jsonify({
+        'servers': servers,
+        'capacity': history.capacity,
+        'interval': history.interval,
+        'rollups': history.rollups,
+        'memory_bytes': history.memory_bytes()
+    })
+
+# حداکثر تعداد رویداد در هر صفحه‌ی /api/events
+EVENTS_PAGE_LIMIT = 1000
+
+@app.route('/api/events')
+@login_required
+def api_events():
+    """لاگ رویدادها، صفحه به صفحه از جدید به قدیم (?before=<next_before صفحه‌ی قبل>، به شکل ts:id)"""
+    if event_log is None:
+        return jsonify({'error': 'Event log is disabled'}), 404
+    kind = request.args.get('kind')
+    if kind is not None and kind not in ('status', 'check_status', 'active_server'):
+        return jsonify({'error': f'Unknown event kind: {kind}'}), 400
+    limit = max(1, min(request.args.get('limit', 100, type=int), EVENTS_PAGE_LIMIT))
+    before = request.args.get('before')
+    if before is not None:
+        try:
+            before_ts, before_id = before.split(':')
+            before = (float(before_ts), int(before_id))
+        except ValueError:
+            return jsonify({'error': 'before must be the next_before of the previous page'}), 400
     
-    # مرتب کردن سرورها بر اساس priority و وضعیت
-    sorted_servers = sorted(
-        stats.items(), 
-        key=lambda x: (x[1]['priority'], not x[1]['active'], x[1]['status'] != 'UP')
+    events = event_log.query(
+        server=request.args.get('server'),
+        kind=kind,
+        since=request.args.get('since', type=float),
+        until=request.args.get('until', type=float),
+        before=before,
+        limit=limit
     )
+    return jsonify({
+        'events': events,
+        'next_before': f"{events[-1]['ts']}:{events[-1]['id']}" if len(events) == limit else None
+    })
+
+# کنترل سرورها از داشبورد: action -> دستور runtime API
+SERVER_CONTROL_ACTIONS = {
+    'ready': 'set server {backend}/{server} state ready',
+    'drain': 'set server {backend}/{server} state drain',
+    'maint': 'set server {backend}/{server} state maint',
+    'weight': 'set server {backend}/{server} weight {weight}'
+}
+SERVER_WEIGHT_MAX = 256
+# حداکثر تعداد تغییر در یک درخواست
+SERVER_CONTROL_LIMIT = 1000
+# نام‌هایی که در دستور قرار می‌گیرند فقط از این کاراکترها باشند
+RUNTIME_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_.:-]+$')
+
+def plan_server_changes(changes, stats):
+    """اعتبارسنجی تغییرات در برابر آخرین آمار؛ {instance: [(server, action, command)]} یا ValueError"""
+    plan = {}
+    multiple = len(haproxy_targets) > 1
+    for change in changes:
+        if not isinstance(change, dict):
+            raise ValueError('Each change must be an object with server and action')
+        name = change.get('server')
+        action = change.get('action')
+        if action not in SERVER_CONTROL_ACTIONS:
+            raise ValueError(f"Unknown action: {action}")
+        data = stats.get(name) if isinstance(name, str) else None
+        if data is None:
+            raise ValueError(f"Unknown server: {name}")
+        
+        # با چند نمونه کلید سرورها "instance/svname" است
+        server = name[len(data['instance']) + 1:] if multiple else name
+        if not RUNTIME_NAME_PATTERN.match(server) or not RUNTIME_NAME_PATTERN.match(data['backend']):
+            raise ValueError(f"Unsupported server name: {name}")
+        weight = change.get('weight')
+        if action == 'weight' and (isinstance(weight, bool) or not isinstance(weight, int) or not 0 <= weight <= SERVER_WEIGHT_MAX):
+            raise ValueError(f"weight must be an integer between 0 and {SERVER_WEIGHT_MAX}")
+        
+        command = SERVER_CONTROL_ACTIONS[action].format(backend=data['backend'], server=server, weight=weight)
+        plan.setdefault(data['instance'], []).append((name, action, command))
+    return plan
+
+def apply_server_changes(plan):
+    """ارسال دستورات هر نمونه در یک batch روی همان نشست runtime API که آمار را می‌خواند"""
+    targets = {target.name: target for target in haproxy_targets}
+    results = []
+    for instance, items in plan.items():
+        error = None
+        try:
+            replies = targets[instance].session.execute_many([command for _, _, command in items])
+        except HAProxySocketError as e:
+            replies, error = [None] * len(items), str(e)
+        for (name, action, command), reply in zip(items, replies):
+            # HAProxy برای set server موفق پاسخ خالی می‌دهد
+            message = error if reply is None else reply.strip()
+            print(f"[DEBUG] {instance}: {command}: {message or 'OK'}")
+            results.append({'server': name, 'action': action, 'ok': not message, 'message': message or None})
+    return results
+
+@app.route('/api/servers/control', methods=['POST'])
+@login_required
+def api_servers_control():
+    """drain / ready / maint / weight برای یک یا چند سرور (فقط JSON)"""
+    # فرم‌های سایت‌های دیگر نمی‌توانند بدنه‌ی JSON بفرستند
+    if not request.is_json:
+        return jsonify({'error': 'Expected an application/json body'}), 415
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({'error': 'Invalid JSON body'}), 400
+    changes = body.get('changes')
+    if changes is None and 'action' in body:
+        # شکل کوتاه: یک action برای چند سرور
+        servers = body.get('servers')
+        if not isinstance(servers, list):
+            return jsonify({'error': 'servers must be a list'}), 400
+        changes = [{'server': name, 'action': body['action'], 'weight': body.get('weight')} for name in servers]
+    if not isinstance(changes, list) or not changes:
+        return jsonify({'error': 'No changes given'}), 400
+    if len(changes) > SERVER_CONTROL_LIMIT:
+        return jsonify({'error': f'At most {SERVER_CONTROL_LIMIT} changes per request'}), 400
     
-    result = {
-        'stats': dict(sorted_servers),
-        'summary': {
-            'total_servers': total_servers,
-            'active_servers': active_servers,
-            'total_connections': total_connections,
-            'total_traffic': total_traffic,
-            'active_server': active_server,
-            'backup_servers': backup_servers
-        }
-    }
+    collector.ensure_started()
+    snapshot = collector.snapshot or collector.wait_for_snapshot(HAPROXY_SOCKET_TIMEOUT * 2)
+    if snapshot is None or snapshot.state is None:
+        return jsonify({'error': 'No stats available from HAProxy'}), 503
+    try:
+        plan = plan_server_changes(changes, snapshot.state[0])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    results = apply_server_changes(plan)
+    # snapshot بلافاصله دوباره جمع‌آوری می‌شود، نه در دوره‌ی بعدی
+    collector.refresh_now()
+    ok = all(result['ok'] for result in results)
+    return jsonify({'ok': ok, 'results': results}), 200 if ok else 502
+
+# توکن /metrics (هدر Authorization: Bearer <token>)؛ بدون توکن فقط کاربر وارد شده، مثل بقیه‌ی API
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# METRICS_PUBLIC=1 احراز هویت /metrics را صریحاً برمی‌دارد (مثلاً وقتی فقط روی شبکه‌ی داخلی در دسترس است)
+METRICS_PUBLIC = os.environ.get('METRICS_PUBLIC', '') == '1'
+METRICS_PREFIX = 'haproxy_monitor'
+METRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# متن عددهای صحیح کوچک (بیشتر مقدارهای /metrics) از پیش ساخته شده تا هر بار str صدا زده نشود.
+# 1.0 == 1 است، پس عدد اعشاری صحیح هم متن عدد صحیح را می‌گیرد (1 به جای 1.0 که در OpenMetrics یکی است)
+NUMBER_TEXT = {number: str(number).encode() for number in range(10000)}
+METRICS_PERCENTILES = tuple(f'p{percent}' for percent in LATENCY_PERCENTILES)
+
+# (نام، نوع، توضیح، فیلد آمار) - برای counter ها پسوند _total به نام نمونه اضافه می‌شود
+SERVER_METRICS = [
+    ('server_current_sessions', 'gauge', 'Current sessions (scur)', 'current_sessions'),
+    ('server_sessions', 'counter', 'Total sessions (stot)', 'total_sessions'),
+    ('server_bytes_in', 'counter', 'Bytes received from clients (bin)', 'bytes_in'),
+    ('server_bytes_out', 'counter', 'Bytes sent to clients (bout)', 'bytes_out'),
+    ('server_up', 'gauge', 'Server status is UP', 'status'),
+    ('server_weight', 'gauge', 'Server weight', 'weight'),
+    ('server_active', 'gauge', 'Server is an active server (act)', 'active'),
+    ('server_backup', 'gauge', 'Server is a backup server (bck)', 'backup'),
+    ('server_bytes_in_per_second', 'gauge', 'Received bytes per second between the last two scrapes', 'bytes_in_per_sec'),
+    ('server_bytes_out_per_second', 'gauge', 'Sent bytes per second between the last two scrapes', 'bytes_out_per_sec'),
+    ('server_sessions_per_second', 'gauge', 'New sessions per second between the last two scrapes', 'sessions_per_sec'),
+    ('server_flap_rate', 'gauge', 'UP/DOWN changes per minute (exponential moving average)', 'flap_rate'),
+    ('server_flapping', 'gauge', 'Server changes state more often than FLAP_THRESHOLD', 'flapping'),
+    ('server_check_duration_milliseconds', 'gauge', 'Duration of the last health check (check_duration)', 'check_duration'),
+    ('server_connect_time_milliseconds', 'gauge', 'Average connect time over the last 1024 requests (ctime)', 'ctime'),
+    ('server_total_time_milliseconds', 'gauge', 'Average total session time over the last 1024 requests (ttime)', 'ttime'),
+]
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# رشته‌ی لیبل هر سرور فقط یک بار ساخته می‌شود
+@lru_cache(maxsize=CLASSIFICATION_CACHE_SIZE)
+def metric_labels(server, backend, instance, server_type, location):
+    labels = [('server', server), ('backend', backend), ('instance', instance), ('type', server_type), ('location', location)]
+    return ','.join(f'{name}="{_label_value(value)}"' for name, value in labels if value is not None)
+
+def _column(rows, key, default=None):
+    """مقدار key در هر dict از rows؛ حلقه با map در C اجرا می‌شود"""
+    return list(map(dict.get, rows, itertools.repeat(key), itertools.repeat(default)))
+
+def _metrics_layout(labels, missing):
+    """متن ثابت بخش سرورهای /metrics (UTF-8) به صورت تکه‌های بین مقدارها، به ترتیب ستون‌های render_metrics
+    
+    تکه‌ی i همه‌ی متن پیش از مقدار i است: پایان سطر قبلی، سرآیند خانواده‌ی جدید و نام نمونه با لیبل‌ها.
+    missing برای هر ستون یک بایت به ازای هر سطر دارد (1 یعنی مقدار None و بدون سطر) یا خالی است.
+    """
+    families = []
+    for metric, metric_type, help_text, field in SERVER_METRICS:
+        name = f'{METRICS_PREFIX}_{metric}'
+        sample = f'{name}_total' if metric_type == 'counter' else name
+        families.append((f'# TYPE {name} {metric_type}\n# HELP {name} {help_text}\n', [f'{sample}{{{label}}} ' for label in labels]))
+    name = f'{METRICS_PREFIX}_server_is_active_server'
+    families.append((f'# TYPE {name} gauge\n# HELP {name} Server is the one currently carrying traffic (1) or not (0)\n', [f'{name}{{{label}}} ' for label in labels]))
+    # quantile در OpenMetrics مخصوص summary است؛ این gauge ها لیبل percentile دارند
+    for metric in LATENCY_METRICS:
+        name = f'{METRICS_PREFIX}_server_{metric}_window_milliseconds'
+        families.append((
+            f'# TYPE {name} gauge\n# HELP {name} Moving {metric} percentile over the last {LATENCY_WINDOW} samples\n',
+            [f'{name}{{{label},percentile="{percentile}"}} ' for label in labels for percentile in METRICS_PERCENTILES],
+        ))
+    
+    pieces = []
+    pending = ''
+    for (header, rows), skip in zip(families, missing):
+        pending += header
+        if skip:
+            rows = itertools.compress(rows, map(operator.not_, skip))
+        for row in rows:
+            pieces.append((pending + row).encode())
+            pending = '\n'
+    pieces.append(pending.encode())
+    return pieces
+
+_metrics_layout_cache = (None, None)
+
+def render_metrics(payload):
+    """متن OpenMetrics یک payload به صورت UTF-8 (بدون سطر # EOF)
+    
+    نام نمونه و لیبل‌های سطرها فقط وقتی سرورها، منبع لیبل‌ها یا جای مقدارهای None عوض شود دوباره قالب‌بندی می‌شوند؛
+    هر snapshot فقط ستون مقدارها را جمع می‌کند و لای تکه‌های ثابت join می‌کند (زمان: tools/bench-metrics.py).
+    """
+    global _metrics_layout_cache
+    stats = payload['stats']
+    summary = payload['summary']
+    active_server = summary.get('active_server')
+    servers = list(stats)
+    datas = list(stats.values())
+    sources = [_column(datas, field) for field in ('backend', 'instance', 'type', 'location')]
+    
+    # یک ستون به ازای هر خانواده به ترتیب سرورها؛ None یعنی سرور در آن خانواده سطری ندارد
+    columns = []
+    for _, _, _, field in SERVER_METRICS:
+        column = _column(datas, field)
+        if field == 'status':
+            column = [None if value is None else value == 'UP' for value in column]
+        columns.append(column)
+    columns.append([server == active_server for server in servers])
+    # صدک‌های هر سرور کنار هم: p50 و p95 سرور اول، سپس سرور دوم ...
+    latencies = [latency or {} for latency in _column(datas, 'latency')]
+    width = len(METRICS_PERCENTILES)
+    for metric in LATENCY_METRICS:
+        windows = _column(latencies, metric, {})
+        column = [None] * (len(windows) * width)
+        for index, percentile in enumerate(METRICS_PERCENTILES):
+            column[index::width] = _column(windows, percentile)
+        columns.append(column)
+    
+    # متن مقدارها: ستون‌هایی که همه‌اش عدد صحیح کوچک (یا bool، چون True == 1) است از جدول NUMBER_TEXT،
+    # بقیه (شمارنده‌های بزرگ، اعشاری‌ها) یک‌جا با str؛ هر دو با map در C
+    texts = []
+    missing = []
+    for column in columns:
+        column_texts = list(map(NUMBER_TEXT.get, column))
+        skip = b''
+        if None in column_texts and None in column:
+            skip = bytes(map(operator.is_, column, itertools.repeat(None)))
+            column = list(itertools.compress(column, map(operator.is_not, column, itertools.repeat(None))))
+            column_texts = list(map(NUMBER_TEXT.get, column))
+        if None in column_texts:
+            column_texts = '\n'.join(map(str, column)).encode().split(b'\n')
+        texts += column_texts
+        missing.append(skip)
+    
+    key = (servers, sources, missing)
+    cached_key, pieces = _metrics_layout_cache
+    if cached_key != key:
+        pieces = _metrics_layout(tuple(map(metric_labels, servers, *sources)), missing)
+        _metrics_layout_cache = (key, pieces)
+    lines = [None] * (len(texts) * 2 + 1)
+    lines[::2] = pieces
+    lines[1::2] = texts
+    
+    tail = []
+    for metric, help_text in (('servers', 'Number of servers'), ('servers_active', 'Number of servers that are UP')):
+        name = f'{METRICS_PREFIX}_{metric}'
+        value = summary['total_servers'] if metric == 'servers' else summary['active_servers']
+        tail.append(f'# TYPE {name} gauge\n# HELP {name} {help_text}\n{name} {value}\n')
     
-    print(f"[DEBUG] API response: {len(result['stats'])} servers, active: {active_server}")
-    return jsonify(result)
+    name = f'{METRICS_PREFIX}_instance_up'
+    tail.append(f'# TYPE {name} gauge\n# HELP {name} HAProxy instance answered the last scrape\n')
+    for instance, status in summary.get('instances', {}).items():
+        tail.append(f'{name}{{instance="{_label_value(instance)}"}} {1 if status["up"] else 0}\n')
+    lines.append(''.join(tail).encode())
+    return b''.join(lines)
+
+_metrics_cache = (None, None)
+_metrics_lock = threading.Lock()
+
+def cached_metrics(snapshot):
+    """متن /metrics (bytes) هر نسخه فقط یک بار ساخته می‌شود"""
+    global _metrics_cache
+    version, body = _metrics_cache
+    if version != snapshot.version:
+        body = render_metrics(snapshot.payload)
+        with _metrics_lock:
+            _metrics_cache = (snapshot.version, body)
+    return body
+
+@app.route('/metrics')
+def metrics():
+    """خروجی OpenMetrics برای Prometheus از آخرین snapshot"""
+    if not METRICS_PUBLIC and 'logged_in' not in session:
+        # Prometheus به login ریدایرکت نمی‌شود؛ 401 می‌گیرد
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if not METRICS_TOKEN or scheme.lower() != 'bearer' or not secrets.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+            return Response('Unauthorized\n', status=401, mimetype='text/plain', headers={'WWW-Authenticate': 'Bearer'})
+    
+    collector.ensure_started()
+    snapshot = collector.snapshot or collector.wait_for_snapshot(HAPROXY_SOCKET_TIMEOUT * 2)
+    name = f'{METRICS_PREFIX}_scrape_success'
+    if snapshot is None or snapshot.payload is None:
+        body = f'# TYPE {name} gauge\n# HELP {name} Last HAProxy scrape succeeded\n{name} 0\n# EOF\n'
+        return Response(body, mimetype=METRICS_CONTENT_TYPE)
+    
+    age = f'{METRICS_PREFIX}_snapshot_age_seconds'
+    # پسوند جدا ساخته می‌شود تا متن بزرگ سرورها فقط یک بار کپی شود
+    suffix = (
+        f'# TYPE {name} gauge\n# HELP {name} Last HAProxy scrape succeeded\n{name} 1\n'
+        + f'# TYPE {age} gauge\n# HELP {age} Seconds since the served snapshot was collected\n'
+        + f'{age} {round(time.time() - snapshot.timestamp, 3)}\n# EOF\n'
+    )
+    body = cached_metrics(snapshot) + suffix.encode()
+    return Response(body, mimetype=METRICS_CONTENT_TYPE)
 
 @app.route('/')
 @login_required
@@ -541,6 +3373,50 @@ def dashboard():
             font-weight: bold;
         }
 
+        .flapping-indicator {
+            background: #ef4444;
+            color: white;
+            padding: 4px 8px;
+            border-radius: 10px;
+            font-size: 0.7em;
+            font-weight: bold;
+        }
+
+        .preferred-indicator {
+            background: #22c55e;
+            color: white;
+            padding: 4px 8px;
+            border-radius: 10px;
+            font-size: 0.7em;
+            font-weight: bold;
+        }
+
+        .server-actions {
+            display: flex;
+            gap: 6px;
+            margin-top: 12px;
+        }
+
+        .server-actions button {
+            flex: 1;
+            background: rgba(255,255,255,0.15);
+            color: #fff;
+            border: 1px solid rgba(255,255,255,0.25);
+            border-radius: 8px;
+            padding: 6px 4px;
+            font-size: 0.8em;
+            cursor: pointer;
+        }
+
+        .server-actions button:hover {
+            background: rgba(255,255,255,0.3);
+        }
+
+        .server-actions button:disabled {
+            opacity: 0.5;
+            cursor: wait;
+        }
+
         .server-info {
             display: grid;
             grid-template-columns: 1fr 1fr;
@@ -565,6 +3441,22 @@ def dashboard():
             font-weight: bold;
         }
 
+        .sparkline {
+            display: block;
+            width: 100%;
+            height: 36px;
+            margin-top: 12px;
+            background: rgba(255,255,255,0.05);
+            border-radius: 8px;
+        }
+
+        .sparkline polyline {
+            fill: none;
+            stroke: #4ade80;
+            stroke-width: 1.5;
+            vector-effect: non-scaling-stroke;
+        }
+
         .connection-label {
             background: linear-gradient(45deg, #8b5cf6, #ec4899);
             color: white;
@@ -669,18 +3561,44 @@ def dashboard():
 
     <div class="last-update">
         آخرین بروزرسانی: <span id="last-update">-</span>
+        <span id="haproxy-version"></span>
     </div>
 
     <script>
         const HAPROXY_STATS_URL = '/api/stats';
+        const HAPROXY_STREAM_URL = '/api/stats/stream';
+        const HAPROXY_HISTORY_URL = '/api/history';
+        const POLL_INTERVAL = 5000;
+        const SPARKLINE_WINDOW = 600;
+        const SPARKLINE_REFRESH = 60000;
+        const STATE_DURATION_REFRESH = 10000;
+        const HAPROXY_CONTROL_URL = '/api/servers/control';
+        const CONTROL_LABELS = { ready: 'فعال کردن', drain: 'تخلیه (drain)', maint: 'تعمیر (maint)' };
+        
+        let pollTimer = null;
+        let currentData = null;
+        
+        // داشبورد با /?proxy=at فقط سرورهای همان backend را از API می‌گیرد
+        const PAGE_PARAMS = new URLSearchParams(window.location.search);
+
+        function apiUrl(base, params = {}) {
+            const query = new URLSearchParams();
+            PAGE_PARAMS.getAll('proxy').forEach((proxy) => query.append('proxy', proxy));
+            Object.entries(params).forEach(([key, value]) => query.set(key, value));
+            const queryString = query.toString();
+            return queryString ? `${base}?${queryString}` : base;
+        }
 
-        async function fetchStats() {
+        async function fetchStats(full = false) {
             const refreshBtn = document.getElementById('refresh-text');
             refreshBtn.innerHTML = '<div class="loading"></div>';
             
+            // با داشتن نسخه‌ی قبلی فقط تغییرات درخواست می‌شود
+            const url = (currentData && !full) ? apiUrl(HAPROXY_STATS_URL, { since: currentData.version }) : apiUrl(HAPROXY_STATS_URL);
+            
             try {
-                const response = await fetch(HAPROXY_STATS_URL);
-                if (response.status === 401) {
+                const response = await fetch(url);
+                if (response.status === 401 || response.redirected) {
                     window.location.href = '/login';
                     return;
                 }
@@ -688,7 +3606,11 @@ def dashboard():
                     throw new Error(`HTTP ${response.status}: ${response.statusText}`);
                 }
                 const data = await response.json();
-                updateUI(data);
+                // زمان جمع‌آوری و uptime در هدرها هستند تا بدنه (و ETag) فقط با نسخه عوض شود
+                data.collected_at = Number(response.headers.get('X-Collected-At'));
+                data.age = Number(response.headers.get('X-Stats-Age'));
+                data.summary = Object.assign({}, data.summary, { haproxy_uptime: Number(response.headers.get('X-HAProxy-Uptime')) });
+                handleStats(data);
             } catch (error) {
                 console.error('Error:', error);
                 showError('خطا در دریافت اطلاعات سرور: ' + error.message);
@@ -698,19 +3620,75 @@ def dashboard():
             }
         }
 
+        // اعمال تغییرات روی آخرین آمار دریافتی؛ false یعنی نسخه‌ها هم‌خوان نیستند
+        function applyDelta(delta) {
+            if (!currentData || delta.base_version !== currentData.version) {
+                return false;
+            }
+            
+            const order = delta.order || Object.keys(currentData.stats);
+            const stats = {};
+            order.forEach((name) => {
+                const previous = currentData.stats[name];
+                const changes = delta.changed[name] || {};
+                stats[name] = previous ? Object.assign({}, previous, changes) : changes;
+            });
+            delta.removed.forEach((name) => delete stats[name]);
+            
+            currentData = {
+                stats: stats,
+                summary: Object.assign({}, currentData.summary, delta.summary),
+                version: delta.version,
+                collected_at: delta.collected_at,
+                age: delta.age
+            };
+            return true;
+        }
+
+        function handleStats(data) {
+            if (data.delta) {
+                if (!applyDelta(data)) {
+                    fetchStats(true);
+                    return;
+                }
+            } else {
+                currentData = data;
+            }
+            updateUI(currentData);
+        }
+
+        // کارت هر سرور فقط یک بار ساخته می‌شود و بعد فقط مقادیر تغییر کرده بروزرسانی می‌شوند
+        const cardCache = new Map();
+
+        function setText(id, value) {
+            const element = document.getElementById(id);
+            if (element.textContent !== String(value)) {
+                element.textContent = value;
+            }
+        }
+
         function updateUI(data) {
             const { stats, summary } = data;
             
             // بروزرسانی آمار کلی
-            document.getElementById('total-servers').textContent = summary.total_servers;
-            document.getElementById('active-servers').textContent = summary.active_servers;
-            document.getElementById('active-connections').textContent = summary.total_connections;
-            document.getElementById('total-traffic').textContent = formatBytes(summary.total_traffic);
+            setText('total-servers', summary.total_servers);
+            setText('active-servers', summary.active_servers);
+            setText('active-connections', summary.total_connections);
+            setText('total-traffic', formatBytes(summary.total_traffic));
+            setText('haproxy-version', summary.haproxy_version ? `| HAProxy ${summary.haproxy_version}` : '');
             
             const container = document.getElementById('servers-container');
-            container.innerHTML = '';
+            const names = Object.keys(stats);
+            
+            // حذف کارت سرورهایی که دیگر وجود ندارند
+            cardCache.forEach((entry, serverName) => {
+                if (!(serverName in stats)) {
+                    entry.card.remove();
+                    cardCache.delete(serverName);
+                }
+            });
             
-            if (Object.keys(stats).length === 0) {
+            if (names.length === 0) {
                 container.innerHTML = `
                     <div class="no-servers">
                         <h3>❌ هیچ سروری یافت نشد</h3>
@@ -720,76 +3698,261 @@ def dashboard():
                 return;
             }
             
-            Object.entries(stats).forEach(([serverName, serverStats]) => {
-                const serverCard = createServerCard(serverName, serverStats, summary.active_server);
-                container.appendChild(serverCard);
+            // حذف پیام‌های بارگذاری/خطا
+            container.querySelectorAll('.no-servers').forEach((element) => element.remove());
+            
+            // سرورهای ترجیحی پیشنهاد وزن (وقتی WEIGHT_ADVISOR فعال است)
+            const preferred = new Set((summary.weight_advice || []).map((item) => item.preferred));
+            
+            names.forEach((serverName, index) => {
+                let entry = cardCache.get(serverName);
+                if (!entry) {
+                    entry = createServerCard(serverName);
+                    cardCache.set(serverName, entry);
+                }
+                updateServerCard(entry, serverName, stats[serverName], summary.active_server, preferred.has(serverName));
+                
+                // جابجایی فقط وقتی ترتیب عوض شده
+                if (container.children[index] !== entry.card) {
+                    container.insertBefore(entry.card, container.children[index] || null);
+                }
             });
         }
 
-        function createServerCard(serverName, stats, activeServer) {
-            const isOnline = stats.status === 'UP';
-            const isActive = serverName === activeServer;
-            const isBackup = stats.backup;
-            
+        function createServerCard(serverName) {
             const card = document.createElement('div');
-            card.className = `server-card ${isActive ? 'active' : ''} ${isBackup ? 'backup' : ''}`;
-            
-            // لیبل کانکشن
-            let connectionLabel = '';
-            if (stats.current_sessions > 0) {
-                connectionLabel = `<span class="connection-label">🔗 ${stats.current_sessions} فعال</span>`;
-            }
+            card.className = 'server-card';
             
             card.innerHTML = `
-                <div class="server-status ${isOnline ? 'status-online' : 'status-offline'}"></div>
+                <div class="server-status" data-field="status_dot"></div>
                 
                 <div class="server-header">
                     <div>
                         <div class="server-name">
-                            ${stats.display_name}
-                            ${connectionLabel}
-                        </div>
-                        <div style="margin-top: 8px; font-size: 0.9em; opacity: 0.8;">
-                            ${stats.full_label}
+                            <span data-field="display_name"></span>
+                            <span class="connection-label" data-field="connection_label"></span>
                         </div>
+                        <div style="margin-top: 8px; font-size: 0.9em; opacity: 0.8;" data-field="full_label"></div>
                     </div>
                     <div class="server-labels">
-                        <div class="server-type">${stats.type}</div>
-                        <div class="server-location">${stats.location}</div>
-                        ${isActive ? '<div class="active-indicator">🎯 فعال</div>' : ''}
-                        ${isBackup ? '<div class="backup-indicator">🔄 پشتیبان</div>' : ''}
+                        <div class="server-type" data-field="type"></div>
+                        <div class="server-location" data-field="location"></div>
+                        <div class="active-indicator" data-field="active_indicator">🎯 فعال</div>
+                        <div class="backup-indicator" data-field="backup_indicator">🔄 پشتیبان</div>
+                        <div class="flapping-indicator" data-field="flapping_indicator">⚠️ ناپایدار</div>
+                        <div class="preferred-indicator" data-field="preferred_indicator">⚡ کم‌تاخیرترین</div>
                     </div>
                 </div>
                 
                 <div class="server-info">
                     <div class="info-item">
                         <div class="info-label">وضعیت</div>
-                        <div class="info-value">${isOnline ? '✅ آنلاین' : '❌ آفلاین'}</div>
+                        <div class="info-value" data-field="status"></div>
                     </div>
                     <div class="info-item">
                         <div class="info-label">کانکشن‌های فعال</div>
-                        <div class="info-value">${stats.current_sessions}</div>
+                        <div class="info-value" data-field="current_sessions"></div>
                     </div>
                     <div class="info-item">
                         <div class="info-label">کل جلسات</div>
-                        <div class="info-value">${stats.total_sessions.toLocaleString()}</div>
+                        <div class="info-value" data-field="total_sessions"></div>
                     </div>
                     <div class="info-item">
                         <div class="info-label">وزن سرور</div>
-                        <div class="info-value">${stats.weight}</div>
+                        <div class="info-value" data-field="weight"></div>
                     </div>
                     <div class="info-item">
                         <div class="info-label">ترافیک ورودی</div>
-                        <div class="info-value">${formatBytes(stats.bytes_in)}</div>
+                        <div class="info-value" data-field="bytes_in"></div>
                     </div>
                     <div class="info-item">
                         <div class="info-label">ترافیک خروجی</div>
-                        <div class="info-value">${formatBytes(stats.bytes_out)}</div>
+                        <div class="info-value" data-field="bytes_out"></div>
+                    </div>
+                    <div class="info-item">
+                        <div class="info-label">نرخ ورودی</div>
+                        <div class="info-value" data-field="bytes_in_per_sec"></div>
+                    </div>
+                    <div class="info-item">
+                        <div class="info-label">نرخ خروجی</div>
+                        <div class="info-value" data-field="bytes_out_per_sec"></div>
+                    </div>
+                    <div class="info-item">
+                        <div class="info-label">مدت در این وضعیت</div>
+                        <div class="info-value" data-field="state_duration"></div>
+                    </div>
+                    <div class="info-item">
+                        <div class="info-label">نرخ تغییر وضعیت</div>
+                        <div class="info-value" data-field="flap_rate"></div>
+                    </div>
+                    <div class="info-item">
+                        <div class="info-label">MTBF</div>
+                        <div class="info-value" data-field="mtbf"></div>
+                    </div>
+                    <div class="info-item">
+                        <div class="info-label">MTTR</div>
+                        <div class="info-value" data-field="mttr"></div>
+                    </div>
+                    <div class="info-item">
+                        <div class="info-label">تاخیر چک (p50 / p95)</div>
+                        <div class="info-value" data-field="check_latency"></div>
+                    </div>
+                    <div class="info-item">
+                        <div class="info-label">زمان اتصال (p50 / p95)</div>
+                        <div class="info-value" data-field="connect_latency"></div>
                     </div>
                 </div>
+                
+                <svg class="sparkline" viewBox="0 0 100 30" preserveAspectRatio="none">
+                    <title>کانکشن‌های فعال در ۱۰ دقیقه‌ی اخیر</title>
+                    <polyline data-field="sparkline" points=""></polyline>
+                </svg>
+                
+                <div class="server-actions">
+                    <button data-action="ready" title="set server ... state ready">▶️ فعال</button>
+                    <button data-action="drain" title="set server ... state drain">⏸️ تخلیه</button>
+                    <button data-action="maint" title="set server ... state maint">🔧 تعمیر</button>
+                    <button data-action="weight" title="set server ... weight">⚖️ وزن</button>
+                </div>
             `;
             
-            return card;
+            card.querySelectorAll('[data-action]').forEach((button) => {
+                button.addEventListener('click', () => controlServer(serverName, button.dataset.action, button));
+            });
+            
+            const refs = {};
+            card.querySelectorAll('[data-field]').forEach((element) => {
+                refs[element.dataset.field] = element;
+            });
+            
+            return { card: card, refs: refs, values: {} };
+        }
+
+        // تغییر DOM فقط وقتی مقدار با دفعه‌ی قبل فرق دارد
+        function patchText(entry, field, value) {
+            if (entry.values[field] !== value) {
+                entry.values[field] = value;
+                entry.refs[field].textContent = value;
+            }
+        }
+
+        function patchVisible(entry, field, visible) {
+            const key = field + ':visible';
+            if (entry.values[key] !== visible) {
+                entry.values[key] = visible;
+                entry.refs[field].style.display = visible ? '' : 'none';
+            }
+        }
+
+        function patchClass(entry, key, element, className) {
+            if (entry.values[key] !== className) {
+                entry.values[key] = className;
+                element.className = className;
+            }
+        }
+
+        function updateServerCard(entry, serverName, stats, activeServer, isPreferred) {
+            const isOnline = stats.status === 'UP';
+            const isActive = serverName === activeServer;
+            const isBackup = stats.backup;
+            
+            patchClass(entry, 'card', entry.card, `server-card ${isActive ? 'active' : ''} ${isBackup ? 'backup' : ''}`);
+            patchClass(entry, 'status_dot', entry.refs.status_dot, `server-status ${isOnline ? 'status-online' : 'status-offline'}`);
+            
+            patchText(entry, 'display_name', stats.display_name);
+            patchText(entry, 'full_label', stats.full_label);
+            patchText(entry, 'type', stats.type);
+            patchText(entry, 'location', stats.location);
+            
+            // لیبل کانکشن
+            patchVisible(entry, 'connection_label', stats.current_sessions > 0);
+            patchText(entry, 'connection_label', `🔗 ${stats.current_sessions} فعال`);
+            patchVisible(entry, 'active_indicator', isActive);
+            patchVisible(entry, 'backup_indicator', isBackup);
+            patchVisible(entry, 'flapping_indicator', Boolean(stats.flapping));
+            patchVisible(entry, 'preferred_indicator', isPreferred);
+            
+            patchText(entry, 'status', isOnline ? '✅ آنلاین' : '❌ آفلاین');
+            patchText(entry, 'current_sessions', String(stats.current_sessions));
+            patchText(entry, 'total_sessions', stats.sessions_per_sec == null
+                ? stats.total_sessions.toLocaleString()
+                : `${stats.total_sessions.toLocaleString()} (${stats.sessions_per_sec}/s)`);
+            patchText(entry, 'weight', String(stats.weight));
+            patchText(entry, 'bytes_in', formatBytes(stats.bytes_in));
+            patchText(entry, 'bytes_out', formatBytes(stats.bytes_out));
+            patchText(entry, 'bytes_in_per_sec', formatRate(stats.bytes_in_per_sec));
+            patchText(entry, 'bytes_out_per_sec', formatRate(stats.bytes_out_per_sec));
+            
+            entry.stateSince = stats.state_since;
+            patchStateDuration(entry);
+            patchText(entry, 'flap_rate', stats.flap_rate == null ? '-' : `${stats.flap_rate}/min`);
+            patchText(entry, 'mtbf', formatDuration(stats.mtbf));
+            patchText(entry, 'mttr', formatDuration(stats.mttr));
+            patchText(entry, 'check_latency', formatLatency(stats.latency, 'check_duration'));
+            patchText(entry, 'connect_latency', formatLatency(stats.latency, 'ctime'));
+            
+            recordSparkline(serverName, currentData.collected_at, stats.current_sessions);
+            patchSparkline(entry, serverName);
+        }
+
+        // نمودار کوچک کانکشن‌های فعال: تاریخچه از /api/history و بعد نقاط زنده از هر بروزرسانی
+        const sparklines = new Map();
+
+        function recordSparkline(serverName, timestamp, value) {
+            let series = sparklines.get(serverName);
+            if (!series) {
+                series = { times: [], values: [] };
+                sparklines.set(serverName, series);
+            }
+            if (series.times.length && series.times[series.times.length - 1] >= timestamp) {
+                return;
+            }
+            series.times.push(timestamp);
+            series.values.push(value);
+            // نقاط خارج از پنجره دور ریخته می‌شوند
+            const cutoff = timestamp - SPARKLINE_WINDOW;
+            let start = 0;
+            while (start < series.times.length && series.times[start] < cutoff) start++;
+            if (start) {
+                series.times.splice(0, start);
+                series.values.splice(0, start);
+            }
+        }
+
+        function patchSparkline(entry, serverName) {
+            const series = sparklines.get(serverName);
+            if (!series || !series.times.length) return;
+            
+            const end = series.times[series.times.length - 1];
+            const begin = end - SPARKLINE_WINDOW;
+            const max = Math.max(1, ...series.values);
+            const points = series.times.map((time, i) => {
+                const x = ((time - begin) / SPARKLINE_WINDOW) * 100;
+                const y = 29 - (series.values[i] / max) * 28;
+                return `${x.toFixed(1)},${y.toFixed(1)}`;
+            }).join(' ');
+            
+            if (entry.values.sparkline !== points) {
+                entry.values.sparkline = points;
+                entry.refs.sparkline.setAttribute('points', points);
+            }
+        }
+
+        async function loadSparklines() {
+            const since = Date.now() / 1000 - SPARKLINE_WINDOW;
+            try {
+                const response = await fetch(apiUrl(HAPROXY_HISTORY_URL, { metric: 'scur', since: since }));
+                if (!response.ok || response.redirected) return;
+                const data = await response.json();
+                Object.entries(data.servers).forEach(([serverName, series]) => {
+                    // تاریخچه‌ی کامل سرور جایگزین نقاط زنده‌ی قبلی می‌شود
+                    sparklines.set(serverName, { times: series.times, values: series.metrics.scur });
+                    const entry = cardCache.get(serverName);
+                    if (entry) patchSparkline(entry, serverName);
+                });
+            } catch (error) {
+                console.error('History error:', error);
+            }
         }
 
         function formatBytes(bytes) {
@@ -800,6 +3963,71 @@ def dashboard():
             return parseFloat((bytes / Math.pow(k, i)).toFixed(2)) + ' ' + sizes[i];
         }
 
+        // ارسال دستور کنترل؛ آمار جدید از stream (یا poll بعدی) می‌رسد
+        async function controlServer(serverName, action, button) {
+            const change = { server: serverName, action: action };
+            if (action === 'weight') {
+                const value = prompt(`وزن جدید ${serverName} (0 تا 256):`);
+                if (value === null) return;
+                change.weight = parseInt(value, 10);
+                if (isNaN(change.weight)) return;
+            } else if (!confirm(`${CONTROL_LABELS[action]} سرور ${serverName}؟`)) {
+                return;
+            }
+            
+            button.disabled = true;
+            try {
+                const response = await fetch(HAPROXY_CONTROL_URL, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ changes: [change] })
+                });
+                if (response.status === 401 || response.redirected) {
+                    window.location.href = '/login';
+                    return;
+                }
+                const result = await response.json();
+                const failed = (result.results || []).filter((item) => !item.ok);
+                if (result.error || failed.length) {
+                    alert(result.error || failed.map((item) => `${item.server}: ${item.message}`).join('\\n'));
+                }
+            } catch (error) {
+                alert('خطا در ارسال دستور: ' + error.message);
+            } finally {
+                button.disabled = false;
+            }
+        }
+
+        // مدت در وضعیت فعلی بدون آمدن داده‌ی جدید هم جلو می‌رود
+        function patchStateDuration(entry) {
+            if (entry.stateSince == null) return;
+            patchText(entry, 'state_duration', formatDuration(Date.now() / 1000 - entry.stateSince));
+        }
+
+        function formatDuration(seconds) {
+            if (seconds == null) return '-';
+            seconds = Math.max(0, Math.round(seconds));
+            if (seconds < 60) return `${seconds}s`;
+            const minutes = Math.floor(seconds / 60);
+            if (minutes < 60) return `${minutes}m ${seconds % 60}s`;
+            const hours = Math.floor(minutes / 60);
+            if (hours < 24) return `${hours}h ${minutes % 60}m`;
+            return `${Math.floor(hours / 24)}d ${hours % 24}h`;
+        }
+
+        // صدک‌های p50 / p95 یک زمان (میلی‌ثانیه) از فیلد latency
+        function formatLatency(latency, metric) {
+            const value = latency && latency[metric];
+            if (!value || value.p50 == null) return '-';
+            return `${value.p50} / ${value.p95} ms`;
+        }
+
+        // نرخ‌ها از اولین نمونه‌ی دوم به بعد در دسترس هستند
+        function formatRate(bytesPerSec) {
+            if (bytesPerSec == null) return '-';
+            return formatBytes(Math.round(bytesPerSec)) + '/s';
+        }
+
         function updateLastUpdateTime() {
             const now = new Date();
             const timeStr = now.toLocaleTimeString('fa-IR');
@@ -808,6 +4036,8 @@ def dashboard():
 
         function showError(message) {
             const container = document.getElementById('servers-container');
+            // کارت‌ها با پیام خطا جایگزین می‌شوند و دفعه‌ی بعد از نو ساخته می‌شوند
+            cardCache.clear();
             container.innerHTML = `
                 <div class="no-servers">
                     <h3>⚠️ ${message}</h3>
@@ -816,15 +4046,67 @@ def dashboard():
             `;
         }
 
-        // بروزرسانی خودکار هر 5 ثانیه
-        setInterval(fetchStats, 5000);
+        // polling فقط وقتی stream در دسترس نیست
+        function startPolling() {
+            if (!pollTimer) {
+                pollTimer = setInterval(() => fetchStats(), POLL_INTERVAL);
+            }
+        }
+
+        function stopPolling() {
+            clearInterval(pollTimer);
+            pollTimer = null;
+        }
+
+        // دریافت push تغییرات از سرور (Server-Sent Events)
+        function connectStream() {
+            if (!window.EventSource) {
+                startPolling();
+                return;
+            }
+            
+            const source = new EventSource(apiUrl(HAPROXY_STREAM_URL));
+            const onStats = (event) => {
+                stopPolling();
+                handleStats(JSON.parse(event.data));
+                updateLastUpdateTime();
+            };
+            source.addEventListener('stats', onStats);
+            source.addEventListener('stats-delta', onStats);
+            source.addEventListener('stats-error', (event) => {
+                showError('خطا در دریافت اطلاعات سرور: ' + JSON.parse(event.data).error);
+                updateLastUpdateTime();
+            });
+            source.onerror = () => {
+                // EventSource خودش دوباره وصل می‌شود؛ تا آن موقع polling
+                startPolling();
+            };
+        }
         
         // بارگذاری اولیه
         fetchStats();
+        connectStream();
+        loadSparklines();
+        setInterval(loadSparklines, SPARKLINE_REFRESH);
+        setInterval(() => cardCache.forEach(patchStateDuration), STATE_DURATION_REFRESH);
     </script>
 </body>
 </html>
     '''
 
+def create_app(start=True):
+    """برنامه‌ی آماده برای سرور WSGI؛ مثلاً: gunicorn -w 4 -b 0.0.0.0:5000 'ha-apiv2:create_app()'
+    
+    start: شروع collector و StatusWatcher همین حالا (در هر worker)، نه با اولین درخواست؛
+    وگرنه بعد از restart تا باز شدن داشبورد هیچ رویداد، تاریخچه یا اعلانی ثبت نمی‌شود.
+    """
+    if STATS_SHARED_PATH and collector.shared is None:
+        # با چند worker فقط یکی از HAProxy می‌خواند و بقیه snapshot او را از فایل مشترک می‌گیرند
+        collector.shared = SharedSnapshot(STATS_SHARED_PATH)
+    if start:
+        collector.ensure_started()
+    return app
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # reloader حالت debug برنامه را در یک process فرزند اجرا می‌کند؛ process ناظر جمع‌آوری نمی‌کند
+    create_app(start=os.environ.get('WERKZEUG_RUN_MAIN') == 'true').run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+حالت ASGI برای ha-apiv2: همان مسیرها روی یک event loop.
+
+/api/stats و /api/stats/stream مستقیم روی asyncio اجرا می‌شوند (بدون یک thread برای هر کلاینت)
+و HAProxy با سوکت غیر مسدود کننده خوانده می‌شود. بقیه‌ی مسیرها (/login، / و ...) همان
+view های Flask هستند که در thread pool اجرا می‌شوند. کوکی session همان کوکی Flask است.
+
+    pip install uvicorn
+    python3 ha-asgi.py
+    # یا
+    uvicorn ha-asgi:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import importlib.util
+import io
+import json
+import os
+import sys
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+from itsdangerous import BadSignature
+
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _load_apiv2():
+    # نام فایل خط تیره دارد و با import معمولی بارگذاری نمی‌شود
+    module = sys.modules.get('ha_apiv2')
+    if module is None:
+        spec = importlib.util.spec_from_file_location('ha_apiv2', os.path.join(HERE, 'ha-apiv2.py'))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules['ha_apiv2'] = module
+        spec.loader.exec_module(module)
+    return module
+
+
+apiv2 = _load_apiv2()
+# collector این حالت AsyncCollector است که در lifespan startup شروع می‌شود
+flask_app = apiv2.create_app(start=False)
+collector = apiv2.collector
+
+# حداکثر اندازه‌ی یک پاسخ runtime API (خروجی show stat با تعداد زیادی سرور)
+READ_LIMIT = 16 * 1024 * 1024
+
+
+class AsyncRuntimeSession:
+    """نسخه‌ی asyncio نشست prompt روی runtime API (یونیکس یا TCP)"""
+
+    PROMPT = apiv2.HAProxyRuntimeSession.PROMPT
+
+    def __init__(self, address, timeout=apiv2.HAPROXY_SOCKET_TIMEOUT):
+        self.address = address
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    async def _connect(self):
+        if apiv2.is_tcp_address(self.address):
+            host, _, port = self.address.rpartition(':')
+            connect = asyncio.open_connection(host.strip('[]'), int(port), limit=READ_LIMIT)
+        else:
+            connect = asyncio.open_unix_connection(self.address, limit=READ_LIMIT)
+        self._reader, self._writer = await connect
+        print(f"[DEBUG] Opened async runtime API session on {self.address}")
+        self._writer.write(b'prompt\n')
+        await self._reader.readuntil(self.PROMPT)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def _exchange(self, payload, count):
+        if self._writer is None:
+            await self._connect()
+        self._writer.write(payload)
+        await self._writer.drain()
+        replies = []
+        for _ in range(count):
+            reply = await self._reader.readuntil(self.PROMPT)
+            replies.append(reply[:-len(self.PROMPT)].decode('utf-8', errors='replace') + '\n')
+        return replies
+
+    async def execute_many(self, commands):
+        """مثل HAProxyRuntimeSession.execute_many: همه‌ی دستورات در یک write"""
+        for command in commands:
+            if '\n' in command or ';' in command:
+                raise ValueError(f"Invalid runtime API command: {command!r}")
+        payload = ''.join(f"{command}\n" for command in commands).encode()
+
+        async with self._lock:
+            for attempt in (1, 2):
+                try:
+                    return await asyncio.wait_for(self._exchange(payload, len(commands)), self.timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, OSError) as e:
+                    self.close()
+                    if isinstance(e, asyncio.TimeoutError):
+                        error = apiv2.HAProxySocketError(f"Timed out after {self.timeout}s waiting for reply to {commands}")
+                    else:
+                        error = apiv2.HAProxySocketError(f"Error talking to HAProxy socket {self.address}: {e!r}")
+                    if attempt == 2:
+                        raise error
+                    print(f"[DEBUG] Async runtime API session lost ({error}), reconnecting")
+
+
+class AsyncCollector:
+    """جمع‌آوری با asyncio و انتشار از طریق همان StatsCollector برنامه‌ی Flask"""
+
+    def __init__(self, targets):
+        self.sessions = [(target, AsyncRuntimeSession(target.address, target.timeout)) for target in targets]
+        self._task = None
+        self._changed = None
+        self._loop = None
+
+    async def _scrape(self, target, session):
+        try:
+            replies = await session.execute_many(apiv2.STATS_POLL_COMMANDS)
+        except apiv2.HAProxySocketError as e:
+            print(f"[ERROR] {target.name}: {e}")
+            return None, str(e)
+        return replies, None
+
+    def _process(self, scraped, started):
+        results = []
+        for (target, _), (replies, error) in zip(self.sessions, scraped):
+            results.append((None, None, error) if replies is None else apiv2.process_target_replies(target, replies))
+        return collector.publish(apiv2.merge_target_results(results), started)
+
+    async def collect(self):
+        started = time.time()
+        scraped = await asyncio.gather(*(self._scrape(target, session) for target, session in self.sessions))
+        # parse و ثبت تاریخچه/رویدادها کار CPU و دیسک است و event loop را معطل نمی‌کند
+        return await self._loop.run_in_executor(None, self._process, scraped, started)
+
+    async def _follow(self):
+        # مثل حالت Flask با STATS_SHARED_PATH: فقط leader از HAProxy می‌خواند، بقیه‌ی worker ها فایل مشترک را
+        while not await self._loop.run_in_executor(None, collector.follow_step):
+            await self._loop.run_in_executor(None, collector.wait_for_refresh, apiv2.SHARED_POLL_INTERVAL)
+
+    async def _run(self):
+        while True:
+            try:
+                if collector.shared is not None and not collector.shared.is_leader:
+                    await self._follow()
+                collector.clear_refresh()
+                await self.collect()
+            except Exception as e:
+                print(f"[ERROR] Exception in async stats collector: {e}")
+                import traceback
+                traceback.print_exc()
+            # refresh_now از view های Flask هم کار می‌کند
+            await self._loop.run_in_executor(None, collector.wait_for_refresh, collector.interval)
+
+    def _notify(self, snapshot):
+        # از thread انتشار دهنده صدا زده می‌شود
+        self._loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        collector.external = True
+        collector.add_listener(self._notify)
+        self._task = asyncio.ensure_future(self._run())
+        print(f"[DEBUG] Async stats collector started (interval {collector.interval}s)")
+        # بررسی سریع وضعیت‌ها کوتاه و کم‌هزینه است و در thread خودش می‌ماند
+        apiv2.status_watcher.start()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        for _, session in self.sessions:
+            session.close()
+
+    async def wait_for_change(self, version, timeout):
+        """نسخه‌ای غیر از version یا None بعد از timeout"""
+        deadline = time.monotonic() + timeout
+        while True:
+            snapshot = collector.snapshot
+            if snapshot is not None and snapshot.version != version:
+                return snapshot
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return None
+
+
+async_collector = AsyncCollector(apiv2.haproxy_targets)
+
+
+def _headers(scope):
+    return {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+
+
+def is_logged_in(headers):
+    """خواندن کوکی session امضا شده‌ی Flask (همان کلید و serializer)"""
+    cookie = SimpleCookie(headers.get('cookie', ''))
+    morsel = cookie.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if morsel is None:
+        return False
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    try:
+        data = serializer.loads(morsel.value, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return False
+    return 'logged_in' in data
+
+
+async def _send_response(send, status, body, content_type='application/json', headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode())] + list(headers)
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _send_json(send, status, data):
+    await _send_response(send, status, json.dumps(data, separators=(',', ':')).encode())
+
+
+async def _redirect_to_login(send):
+    await _send_response(send, 302, b'', 'text/html', [(b'location', b'/login')])
+
+
+async def api_stats(scope, receive, send):
+    """همان /api/stats برنامه‌ی Flask، بدون thread"""
+    query = parse_qs(scope['query_string'].decode('latin-1'))
+    snapshot = collector.snapshot or await async_collector.wait_for_change(None, apiv2.HAPROXY_SOCKET_TIMEOUT * 2)
+
+    if snapshot is None or snapshot.payload is None:
+        error = {'error': snapshot.error if snapshot else 'Could not fetch HAProxy stats'}
+        if snapshot:
+            error['age'] = round(time.time() - snapshot.timestamp, 3)
+        await _send_json(send, 500, error)
+        return
+
+    headers = _headers(scope)
+    proxies = apiv2.parse_proxy_scope(query.get('proxy', []))
+    since = query.get('since', [None])[0]
+    since = int(since) if since is not None and since.lstrip('-').isdigit() else None
+    body = apiv2.stats_body(snapshot, proxies, since, apiv2.accepts_gzip(headers.get('accept-encoding', '')))
+
+    cache_headers = [
+        (b'etag', body.etag.encode()), (b'cache-control', b'no-cache'), (b'vary', b'Accept-Encoding')
+    ] + [(name.lower().encode(), value.encode()) for name, value in apiv2.stats_headers(snapshot)]
+    if apiv2.etag_matches(headers.get('if-none-match', ''), body.etag):
+        await _send_response(send, 304, b'', headers=cache_headers)
+        return
+    if body.encoding:
+        cache_headers.append((b'content-encoding', body.encoding.encode()))
+    await _send_response(send, 200, body.data, headers=cache_headers)
+
+
+async def _wait_for_disconnect(receive):
+    # اولین پیام‌ها بدنه‌ی درخواست هستند؛ قطع شدن کلاینت با http.disconnect اعلام می‌شود
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def api_stats_stream(scope, receive, send):
+    """همان /api/stats/stream، با انتظار روی asyncio.Event به جای یک thread برای هر کلاینت"""
+    query = parse_qs(scope['query_string'].decode('latin-1'))
+    proxies = apiv2.parse_proxy_scope(query.get('proxy', []))
+    last_event_id = _headers(scope).get('last-event-id', '')
+    version = base_version = int(last_event_id) if last_event_id.isdigit() else None
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')]
+    })
+
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        snapshot = collector.snapshot or await async_collector.wait_for_change(None, apiv2.HAPROXY_SOCKET_TIMEOUT * 2)
+        while not disconnected.done():
+            message = None
+            if snapshot is None:
+                message = ': keepalive\n\n'
+            elif snapshot.version != version:
+                message = apiv2._stream_message(snapshot, base_version, proxies)
+                version = snapshot.version
+                if message is not None:
+                    base_version = version if snapshot.payload is not None else None
+            if message is not None:
+                await send({'type': 'http.response.body', 'body': message.encode(), 'more_body': True})
+
+            waiter = asyncio.ensure_future(async_collector.wait_for_change(version, apiv2.STREAM_KEEPALIVE_INTERVAL))
+            await asyncio.wait([waiter, disconnected], return_when=asyncio.FIRST_COMPLETED)
+            if not waiter.done():
+                waiter.cancel()
+                break
+            snapshot = waiter.result()
+    except OSError:
+        pass
+    finally:
+        disconnected.cancel()
+
+
+def _wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in _headers(scope).items():
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'content-length':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _call_wsgi(environ):
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = headers
+
+    result = flask_app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], body
+
+
+async def wsgi_fallback(scope, receive, send):
+    """بقیه‌ی مسیرها (/login، /، /api/history، ...) با view های Flask در thread pool"""
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    environ = _wsgi_environ(scope, b''.join(chunks))
+    status, headers, body = await asyncio.get_running_loop().run_in_executor(None, _call_wsgi, environ)
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+NATIVE_ROUTES = {
+    '/api/stats': api_stats,
+    '/api/stats/stream': api_stats_stream,
+}
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            async_collector.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await async_collector.stop()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    handler = NATIVE_ROUTES.get(scope['path'])
+    if handler is None or scope['method'] != 'GET':
+        await wsgi_fallback(scope, receive, send)
+        return
+    if not is_logged_in(_headers(scope)):
+        await _redirect_to_login(send)
+        return
+    await handler(scope, receive, send)
+
+
+if __name__ == '__main__':
+    if uvicorn is None:
+        sys.exit("[ERROR] ASGI mode needs uvicorn: pip install uvicorn")
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', '5000')))
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+زمان ساخت متن /metrics (render_metrics) برای تعداد زیادی سرور، در برابر بودجه‌ی مشخص.
+
+payload از همان مسیر collector ساخته می‌شود (parse، آمار flap و صدک‌های تاخیر با چند نمونه):
+
+    python3 tools/bench-metrics.py --servers 1000 --budget 10
+
+اگر بهترین زمان از بودجه (میلی‌ثانیه) بیشتر باشد با کد 1 خارج می‌شود.
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import os
+import random
+import sys
+import time
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_payload(app, dump, samples):
+    """payload مثل collector: چند جمع‌آوری پشت سر هم تا صدک‌ها پنجره‌ی واقعی داشته باشند"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        stats = app.parse_haproxy_stats(dump)
+    random.seed(7)
+    tracker = app.LatencyTracker()
+    for _ in range(samples):
+        for data in stats.values():
+            for metric in app.LATENCY_METRICS:
+                data[metric] = random.randint(1, 400)
+        annotated = tracker.annotate(app.flaps.annotate(time.time(), stats))
+    return app.build_stats_payload(annotated, {'Version': '2.8.0', 'Uptime_sec': '1000'})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the /metrics renderer')
+    parser.add_argument('--servers', type=int, default=1000)
+    parser.add_argument('--samples', type=int, default=30, help='تعداد جمع‌آوری برای پر کردن پنجره‌ی صدک‌ها')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--budget', type=float, default=10.0, help='حداکثر زمان قابل قبول (میلی‌ثانیه)')
+    args = parser.parse_args()
+
+    # تاریخچه و لاگ رویدادهای دیسکی برای benchmark لازم نیست
+    os.environ.setdefault('HISTORY_DIR', '')
+    os.environ.setdefault('EVENTS_DB', '')
+    app = load('ha_apiv2', os.path.join(HERE, '..', 'ha-apiv2.py'))
+    bench_parser = load('bench_parser', os.path.join(HERE, 'bench-parser.py'))
+    payload = build_payload(app, bench_parser.synthetic_dump(args.servers), args.samples)
+
+    text = app.render_metrics(payload)
+    seconds = min(timeit.repeat(lambda: app.render_metrics(payload), number=1, repeat=args.repeat))
+    lines = text.count(b'\n')
+    print(f"[INFO] {len(payload['stats'])} servers, {lines} lines, {len(text) / 1024:.0f} KiB")
+    print(f"{'render_metrics':>16}: {seconds * 1000:8.2f} ms (budget {args.budget:.1f} ms)")
+    if seconds * 1000 > args.budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
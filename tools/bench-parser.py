@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+مقایسه‌ی سرعت parser ستونی show stat با مسیر قبلی (csv.DictReader + تشخیص نوع در هر بار).
+
+یک خروجی مصنوعی با تعداد زیادی سرور می‌سازد و هر دو parser را روی آن اجرا می‌کند.
+مسیر جدید از cache تشخیص سرورها استفاده می‌کند (مثل حالت پایدار بعد از اولین poll):
+
+    python3 tools/bench-parser.py --servers 5000
+"""
+import argparse
+import contextlib
+import csv
+import importlib.util
+import io
+import os
+import random
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SAMPLE = os.path.join(HERE, 'samples', 'show-stat.csv')
+APP = os.path.join(HERE, '..', 'ha-apiv2.py')
+
+NAME_PARTS = ['wg', 'wireguard', 'ovpn', 'openvpn', 'v2ray', 'ipsec', 'vxlan', 'ss', 'relay']
+LOCATIONS = ['de', 'fl', 'us', 'uk', 'fr', 'nl', 'ir']
+
+
+def load_app():
+    # تاریخچه و لاگ رویدادهای دیسکی برای benchmark لازم نیست
+    os.environ.setdefault('HISTORY_DIR', '')
+    os.environ.setdefault('EVENTS_DB', '')
+    spec = importlib.util.spec_from_file_location('ha_apiv2', APP)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def synthetic_dump(servers, backends=50):
+    """ساخت خروجی show stat با تعداد دلخواه سرور از روی نمونه‌ی ضبط شده"""
+    with open(SAMPLE) as f:
+        lines = f.read().rstrip('\n').split('\n')
+    header = lines[0]
+    columns = header[2:].split(',')
+    template = next(line.split(',') for line in lines[1:] if line.split(',')[1] not in ('FRONTEND', 'BACKEND'))
+    frontend = next(line.split(',') for line in lines[1:] if line.split(',')[1] == 'FRONTEND')
+    backend = next(line.split(',') for line in lines[1:] if line.split(',')[1] == 'BACKEND')
+    col = {name: i for i, name in enumerate(columns)}
+
+    random.seed(42)
+    out = [header]
+    per_backend = max(1, servers // backends)
+    count = 0
+    for b in range(backends):
+        pxname = f'be{b}'
+        row = list(frontend)
+        row[col['pxname']] = pxname
+        out.append(','.join(row))
+        for _ in range(per_backend):
+            if count >= servers:
+                break
+            row = list(template)
+            row[col['pxname']] = pxname
+            row[col['svname']] = f"{random.choice(NAME_PARTS)}-{random.choice(LOCATIONS)}-{count}"
+            row[col['status']] = random.choice(['UP', 'UP', 'UP', 'DOWN', 'MAINT'])
+            row[col['scur']] = str(random.randint(0, 500))
+            row[col['bin']] = str(random.randint(0, 10 ** 12))
+            row[col['bout']] = str(random.randint(0, 10 ** 12))
+            if random.random() < 0.1:
+                row[col['check_desc']] = '"Layer4 connection problem, info: ""Connection refused"""'
+            out.append(','.join(row))
+            count += 1
+        row = list(backend)
+        row[col['pxname']] = pxname
+        out.append(','.join(row))
+    return '\n'.join(out) + '\n\n'
+
+
+def legacy_detect_server_type(server_name):
+    """تشخیص نوع به روش قبلی: زنجیره‌ی بررسی زیررشته برای هر سرور در هر بار"""
+    name_lower = server_name.lower()
+    if 'wg' in name_lower or 'wireguard' in name_lower:
+        return {'type': 'WireGuard', 'icon': '🔐', 'priority': 1}
+    elif 'ipsec' in name_lower or 'esp' in name_lower:
+        return {'type': 'IPSec', 'icon': '🛡️', 'priority': 2}
+    elif 'vxlan' in name_lower:
+        return {'type': 'VXLAN', 'icon': '🌐', 'priority': 3}
+    elif 'openvpn' in name_lower or 'ovpn' in name_lower:
+        return {'type': 'OpenVPN', 'icon': '🔒', 'priority': 4}
+    elif 'v2ray' in name_lower or 'vmess' in name_lower:
+        return {'type': 'V2Ray', 'icon': '⚡', 'priority': 5}
+    elif 'shadowsocks' in name_lower or 'ss' in name_lower:
+        return {'type': 'Shadowsocks', 'icon': '👤', 'priority': 6}
+    else:
+        return {'type': 'Unknown', 'icon': '❓', 'priority': 99}
+
+
+def legacy_detect_location(server_name):
+    """تشخیص موقعیت به روش قبلی"""
+    name_lower = server_name.lower()
+    if 'de' in name_lower or 'germany' in name_lower or 'german' in name_lower:
+        return {'location': 'آلمان', 'flag': '🇩🇪'}
+    elif 'fl' in name_lower or 'finland' in name_lower or 'finnish' in name_lower:
+        return {'location': 'فنلاند', 'flag': '🇫🇮'}
+    elif 'us' in name_lower or 'usa' in name_lower or 'america' in name_lower:
+        return {'location': 'آمریکا', 'flag': '🇺🇸'}
+    elif 'uk' in name_lower or 'britain' in name_lower or 'england' in name_lower:
+        return {'location': 'انگلستان', 'flag': '🇬🇧'}
+    elif 'fr' in name_lower or 'france' in name_lower:
+        return {'location': 'فرانسه', 'flag': '🇫🇷'}
+    elif 'nl' in name_lower or 'netherlands' in name_lower or 'holland' in name_lower:
+        return {'location': 'هلند', 'flag': '🇳🇱'}
+    else:
+        return {'location': 'نامشخص', 'flag': '🌍'}
+
+
+def legacy_parse(app, output):
+    """مسیر قبلی: replace روی کل رشته + csv.DictReader برای همه‌ی ردیف‌ها"""
+    csv_data = output.replace('# pxname', 'pxname')
+    stats = {}
+    for row in csv.DictReader(io.StringIO(csv_data)):
+        svname = row.get('svname', '')
+        if svname and svname not in ['FRONTEND', 'BACKEND']:
+            server_type_info = legacy_detect_server_type(svname)
+            location_info = legacy_detect_location(svname)
+            stats[svname] = {
+                'status': row.get('status', 'UNKNOWN'),
+                'current_sessions': int(row.get('scur', '0') or '0'),
+                'total_sessions': int(row.get('stot', '0') or '0'),
+                'bytes_in': int(row.get('bin', '0') or '0'),
+                'bytes_out': int(row.get('bout', '0') or '0'),
+                'check_status': row.get('check_status', 'N/A'),
+                'active': row.get('act', '0') == '1',
+                'backup': row.get('bck', '0') == '1',
+                'weight': int(row.get('weight', '0') or '0'),
+                'backend': row.get('pxname', 'Unknown'),
+                'type': server_type_info['type'],
+                'icon': server_type_info['icon'],
+                'priority': server_type_info['priority'],
+                'location': location_info['location'],
+                'flag': location_info['flag'],
+                'display_name': f"{location_info['flag']} {server_type_info['icon']} {svname}",
+                'full_label': f"{location_info['location']} - {server_type_info['type']}"
+            }
+            for name in ('check_duration', 'lastchg', 'qtime', 'ctime', 'rtime', 'ttime'):
+                stats[svname][name] = int(row[name]) if row.get(name) else None
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark show stat parsers')
+    parser.add_argument('--servers', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = load_app()
+    output = synthetic_dump(args.servers)
+    print(f"[INFO] Synthetic dump: {args.servers} servers, {len(output) / 1024:.0f} KiB")
+
+    # خروجی debug برنامه در زمان‌سنجی نادیده گرفته می‌شود
+    with contextlib.redirect_stdout(io.StringIO()):
+        new = app.parse_haproxy_stats(output)
+    old = legacy_parse(app, output)
+    assert new == old, 'parsers disagree'
+
+    def run_new():
+        with contextlib.redirect_stdout(io.StringIO()):
+            app.parse_haproxy_stats(output)
+
+    results = {
+        'csv.DictReader': min(timeit.repeat(lambda: legacy_parse(app, output), number=1, repeat=args.repeat)),
+        'columnar': min(timeit.repeat(run_new, number=1, repeat=args.repeat)),
+    }
+    for name, seconds in results.items():
+        print(f"{name:>16}: {seconds * 1000:8.2f} ms")
+    print(f"{'speedup':>16}: {results['csv.DictReader'] / results['columnar']:8.2f}x")
+
+
+if __name__ == '__main__':
+    main()
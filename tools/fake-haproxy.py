@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+سوکت جعلی HAProxy برای تست محلی داشبورد بدون نیاز به HAProxy واقعی.
+
+خروجی ضبط شده‌ی `show stat` را از فایل می‌خواند و روی یک سوکت یونیکس پاسخ می‌دهد:
+
+    python3 tools/fake-haproxy.py --socket /tmp/haproxy.sock
+    HAPROXY_SOCKET=/tmp/haproxy.sock python3 ha-apiv2.py
+
+با --tcp به جای سوکت یونیکس روی TCP گوش می‌دهد (مثل stats socket روی نودهای دیگر):
+
+    python3 tools/fake-haproxy.py --tcp 127.0.0.1:9999
+"""
+import argparse
+import os
+import random
+import socket
+import socketserver
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SAMPLE = os.path.join(HERE, 'samples', 'show-stat.csv')
+
+
+class FakeRuntimeAPI:
+    """پاسخ‌دهنده‌ی دستورات runtime API از روی خروجی ضبط شده"""
+
+    def __init__(self, sample_path, delay=0.0, simulate=False):
+        with open(sample_path) as f:
+            # فایل نمونه شامل خط خالی پایانی حالت غیر تعاملی است
+            lines = f.read().rstrip('\n').split('\n')
+        self.header = lines[0]
+        self.columns = {name: i for i, name in enumerate(self.header[2:].split(','))}
+        self.rows = [line.split(',') for line in lines[1:]]
+        self.delay = delay
+        self.simulate = simulate
+        self.started = time.time()
+        self.advanced = 0.0
+        self.lock = threading.Lock()
+
+    def _servers(self):
+        svname = self.columns['svname']
+        return [row for row in self.rows if row[svname] not in ('FRONTEND', 'BACKEND')]
+
+    def _advance(self):
+        """شبیه‌سازی ترافیک و گاهی قطع و وصل شدن سرورها"""
+        col = self.columns
+        for row in self._servers():
+            if random.random() < 0.02:
+                row[col['status']] = 'DOWN' if row[col['status']] == 'UP' else 'UP'
+                row[col['lastchg']] = '0'
+            if row[col['status']] != 'UP':
+                row[col['scur']] = '0'
+                continue
+            scur = max(0, int(row[col['scur']] or 0) + random.randint(-3, 3))
+            row[col['scur']] = str(scur)
+            row[col['stot']] = str(int(row[col['stot']] or 0) + random.randint(0, 3))
+            row[col['bin']] = str(int(row[col['bin']] or 0) + scur * random.randint(1000, 200000))
+            row[col['bout']] = str(int(row[col['bout']] or 0) + scur * random.randint(5000, 900000))
+
+    def _tick(self):
+        """در حالت simulate حداکثر یک بار در ثانیه، هر چقدر هم دستور برسد"""
+        if self.simulate and time.time() - self.advanced >= 1.0:
+            self.advanced = time.time()
+            self._advance()
+
+    def _row_type(self, row):
+        svname = row[self.columns['svname']]
+        return {'FRONTEND': 1, 'BACKEND': 2}.get(svname, 4)
+
+    def show_stat(self, args=()):
+        """show stat [{<iid>|<proxy>} <type> <sid>]"""
+        col = self.columns
+        proxy, type_mask, sid = '-1', 7, '-1'
+        if len(args) == 3:
+            proxy, sid = args[0], args[2]
+            type_mask = int(args[1])
+        with self.lock:
+            self._tick()
+            rows = self.rows
+            if proxy != '-1':
+                rows = [row for row in rows if proxy in (row[col['pxname']], row[col['iid']])]
+                if not rows:
+                    return 'No such proxy.\n'
+            rows = [row for row in rows if self._row_type(row) & type_mask]
+            if sid != '-1':
+                rows = [row for row in rows if row[col['sid']] == sid]
+            return '\n'.join([self.header] + [','.join(row) for row in rows]) + '\n'
+
+    def show_servers_state(self, args=()):
+        """show servers state [<backend>] - قالب نسخه‌ی 1 مثل HAProxy 2.x"""
+        col = self.columns
+        with self.lock:
+            self._tick()
+            rows = self._servers()
+            if args:
+                rows = [row for row in rows if row[col['pxname']] == args[0]]
+                if not rows:
+                    return "Can't find backend.\n"
+            lines = [
+                '1',
+                '# be_id be_name srv_id srv_name srv_addr srv_op_state srv_admin_state srv_uweight srv_iweight '
+                'srv_time_since_last_change srv_check_status srv_check_result srv_check_health srv_check_state '
+                'srv_agent_state bk_f_forced_id srv_f_forced_id srv_fqdn srv_port srvrecord'
+            ]
+            for row in rows:
+                status = row[col['status']].split(' ', 1)[0]
+                op_state = {'DOWN': 0, 'NOLB': 3}.get(status, 2)
+                admin_state = {'MAINT': 1, 'DRAIN': 8}.get(status, 0)
+                addr, _, port = (row[col['addr']] or '-:0').rpartition(':')
+                weight = row[col['weight']] or '0'
+                lines.append(' '.join([
+                    row[col['iid']], row[col['pxname']], row[col['sid']], row[col['svname']], addr or '-',
+                    str(op_state), str(admin_state), weight, weight, row[col['lastchg']] or '0',
+                    '6', '3' if op_state else '1', '0', '6', '0', '0', '0', '-', port or '0', '-'
+                ]))
+            return '\n'.join(lines) + '\n'
+
+    def set_server(self, args):
+        """set server <backend>/<server> state [ready|drain|maint] | weight <weight>[%]"""
+        col = self.columns
+        if len(args) != 3 or '/' not in args[0]:
+            return "Require 'backend/server'.\n"
+        backend, _, name = args[0].partition('/')
+        with self.lock:
+            row = next((row for row in self._servers() if row[col['pxname']] == backend and row[col['svname']] == name), None)
+            if row is None:
+                return 'No such server.\n'
+            if args[1] == 'state':
+                status = {'ready': 'UP', 'drain': 'DRAIN', 'maint': 'MAINT'}.get(args[2])
+                if status is None:
+                    return "'set server <srv> state' expects 'ready', 'drain' and 'maint'.\n"
+                if row[col['status']] != status:
+                    row[col['status']] = status
+                    row[col['lastchg']] = '0'
+                return ''
+            if args[1] == 'weight':
+                weight = args[2].rstrip('%')
+                if not weight.isdigit() or int(weight) > 256:
+                    return 'Integer value expected.\n'
+                row[col['weight']] = weight
+                return ''
+            return "'set server <srv>' only supports 'state' and 'weight' in this fake.\n"
+
+    def show_info(self):
+        uptime = int(time.time() - self.started)
+        return (
+            "Name: HAProxy\n"
+            "Version: 2.4.22-fake\n"
+            f"Pid: {os.getpid()}\n"
+            f"Uptime_sec: {uptime}\n"
+        )
+
+    def execute(self, command):
+        if self.delay:
+            time.sleep(self.delay)
+        command = command.strip()
+        words = command.split()
+        if words[:2] == ['show', 'stat']:
+            return self.show_stat(words[2:])
+        if words[:3] == ['show', 'servers', 'state']:
+            return self.show_servers_state(words[3:])
+        if words[:2] == ['set', 'server']:
+            return self.set_server(words[2:])
+        if command == 'show info':
+            return self.show_info()
+        return "Unknown command. Please enter one of the following commands only :\n  help : this message\n"
+
+
+class Handler(socketserver.StreamRequestHandler):
+    """مثل HAProxy: بدون prompt یک خط دستور و بستن اتصال، با prompt نشست تعاملی"""
+
+    def handle(self):
+        # مثل `stats timeout` در HAProxy، نشست بیکار بسته می‌شود
+        self.connection.settimeout(self.server.idle_timeout)
+        interactive = False
+        while True:
+            try:
+                line = self.rfile.readline().decode(errors='replace')
+            except socket.timeout:
+                return
+            if not line:
+                return
+            for command in line.strip().split(';'):
+                command = command.strip()
+                if command == 'prompt':
+                    interactive = not interactive
+                    output = ''
+                elif command == 'quit':
+                    return
+                else:
+                    output = self.server.api.execute(command)
+                self.wfile.write((output + ('\n> ' if interactive else '\n')).encode())
+            if not interactive:
+                return
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake HAProxy runtime API socket')
+    parser.add_argument('--socket', default='/tmp/haproxy.sock', help='مسیر سوکت یونیکس')
+    parser.add_argument('--tcp', metavar='HOST:PORT', help='گوش دادن روی TCP به جای سوکت یونیکس')
+    parser.add_argument('--sample', default=DEFAULT_SAMPLE, help='فایل خروجی ضبط شده‌ی show stat')
+    parser.add_argument('--delay', type=float, default=0.0, help='تاخیر مصنوعی برای هر دستور (ثانیه)')
+    parser.add_argument('--idle-timeout', type=float, default=10.0, help='بستن نشست‌های بیکار بعد از این مدت (ثانیه)')
+    parser.add_argument('--simulate', action='store_true', help='شبیه‌سازی ترافیک و تغییر وضعیت سرورها')
+    args = parser.parse_args()
+
+    if args.tcp:
+        host, _, port = args.tcp.rpartition(':')
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        server = socketserver.ThreadingTCPServer((host, int(port)), Handler)
+        address = args.tcp
+    else:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        server = socketserver.ThreadingUnixStreamServer(args.socket, Handler)
+        address = args.socket
+    server.daemon_threads = True
+    server.api = FakeRuntimeAPI(args.sample, args.delay, args.simulate)
+    server.idle_timeout = args.idle_timeout
+    print(f"[INFO] Fake HAProxy listening on {address} (sample: {args.sample})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if not args.tcp:
+            os.unlink(args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+تست بار داشبورد: تعداد زیادی stream باز (/api/stats/stream) به همراه درخواست‌های هم‌زمان /api/stats.
+
+برای مقایسه‌ی حالت Flask و حالت ASGI همان دستور را روی هر دو اجرا کنید:
+
+    HAPROXY_SOCKET=/tmp/haproxy.sock python3 ha-apiv2.py
+    python3 tools/load-test.py --url http://127.0.0.1:5000 --streams 300 --clients 50
+
+    HAPROXY_SOCKET=/tmp/haproxy.sock python3 ha-asgi.py
+    python3 tools/load-test.py --url http://127.0.0.1:5000 --streams 300 --clients 50
+"""
+import argparse
+import asyncio
+import http.cookiejar
+import statistics
+import time
+import urllib.parse
+import urllib.request
+
+
+def login(url, username, password):
+    """ورود با فرم /login و برگرداندن هدر Cookie"""
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    data = urllib.parse.urlencode({'username': username, 'password': password}).encode()
+    opener.open(f"{url}/login", data, timeout=10).read()
+    cookie = '; '.join(f"{c.name}={c.value}" for c in jar)
+    if not cookie:
+        raise SystemExit('[ERROR] Login failed, no session cookie')
+    return cookie
+
+
+async def http_get(host, port, path, cookie, timeout):
+    """یک درخواست GET با اتصال جدید؛ (status, زمان پاسخ)"""
+    started = time.perf_counter()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nCookie: {cookie}\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    status = int(response.split(b' ', 2)[1]) if response else 0
+    return status, time.perf_counter() - started
+
+
+async def stream_client(host, port, cookie, stop, results):
+    """یک stream باز نگه داشته می‌شود و رویدادهای دریافتی شمرده می‌شوند"""
+    started = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), 10)
+    except (OSError, asyncio.TimeoutError):
+        results['stream_errors'] += 1
+        return
+    try:
+        writer.write(f"GET /api/stats/stream HTTP/1.1\r\nHost: {host}\r\nCookie: {cookie}\r\n\r\n".encode())
+        await writer.drain()
+        first = True
+        while not stop.is_set():
+            try:
+                line = await asyncio.wait_for(reader.readline(), 1)
+            except asyncio.TimeoutError:
+                continue
+            if not line:
+                break
+            if line.startswith(b'event:'):
+                if first:
+                    results['first_event'].append(time.perf_counter() - started)
+                    first = False
+                results['events'] += 1
+        if first:
+            results['stream_errors'] += 1
+    except OSError:
+        results['stream_errors'] += 1
+    finally:
+        writer.close()
+
+
+async def request_client(host, port, cookie, stop, results, timeout):
+    while not stop.is_set():
+        try:
+            status, elapsed = await http_get(host, port, '/api/stats', cookie, timeout)
+        except (OSError, asyncio.TimeoutError):
+            results['request_errors'] += 1
+            continue
+        if status == 200:
+            results['latencies'].append(elapsed)
+        else:
+            results['request_errors'] += 1
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run(args, cookie):
+    parsed = urllib.parse.urlparse(args.url)
+    host, port = parsed.hostname, parsed.port or 80
+    stop = asyncio.Event()
+    results = {'latencies': [], 'request_errors': 0, 'events': 0, 'first_event': [], 'stream_errors': 0}
+
+    tasks = [asyncio.ensure_future(stream_client(host, port, cookie, stop, results)) for _ in range(args.streams)]
+    # اول stream ها باز می‌شوند، بعد درخواست‌های /api/stats در کنار آنها
+    await asyncio.sleep(args.ramp)
+    started = time.perf_counter()
+    tasks += [asyncio.ensure_future(request_client(host, port, cookie, stop, results, args.timeout)) for _ in range(args.clients)]
+    await asyncio.sleep(args.duration)
+    stop.set()
+    elapsed = time.perf_counter() - started
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    latencies = results['latencies']
+    print(f"[INFO] {args.url}: {args.streams} streams, {args.clients} request clients, {elapsed:.1f}s")
+    print(f"{'requests/s':>18}: {len(latencies) / elapsed:8.1f}")
+    print(f"{'latency p50':>18}: {percentile(latencies, 0.50) * 1000:8.1f} ms")
+    print(f"{'latency p99':>18}: {percentile(latencies, 0.99) * 1000:8.1f} ms")
+    print(f"{'request errors':>18}: {results['request_errors']:8d}")
+    print(f"{'streams connected':>18}: {len(results['first_event']):8d}")
+    print(f"{'stream errors':>18}: {results['stream_errors']:8d}")
+    print(f"{'first event p50':>18}: {statistics.median(results['first_event']) * 1000 if results['first_event'] else float('nan'):8.1f} ms")
+    print(f"{'events received':>18}: {results['events']:8d}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test /api/stats and /api/stats/stream')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--username', default='soheil')
+    parser.add_argument('--password', default='star')
+    parser.add_argument('--streams', type=int, default=200, help='تعداد stream های هم‌زمان')
+    parser.add_argument('--clients', type=int, default=20, help='تعداد کلاینت‌های هم‌زمان /api/stats')
+    parser.add_argument('--duration', type=float, default=10.0, help='مدت تست (ثانیه)')
+    parser.add_argument('--ramp', type=float, default=2.0, help='زمان باز شدن stream ها قبل از شروع اندازه‌گیری (ثانیه)')
+    parser.add_argument('--timeout', type=float, default=10.0)
+    args = parser.parse_args()
+
+    cookie = login(args.url, args.username, args.password)
+    asyncio.run(run(args, cookie))
+
+
+if __name__ == '__main__':
+    main()
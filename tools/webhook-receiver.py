@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+گیرنده‌ی محلی webhook برای تست اعلان‌ها بدون سرویس واقعی.
+
+هر POST را با زمان رسیدن و خلاصه‌ی رویدادها چاپ می‌کند:
+
+    python3 tools/webhook-receiver.py --port 8099
+    NOTIFY_WEBHOOK_URL=http://127.0.0.1:8099/hook HAPROXY_SOCKET=/tmp/haproxy.sock python3 ha-apiv2.py
+
+با --fail-rate بخشی از درخواست‌ها با 500 جواب می‌گیرند تا تلاش دوباره و backoff دیده شود.
+"""
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        if random.random() < self.server.fail_rate:
+            print(f"[{time.strftime('%H:%M:%S')}] {self.path}: answering 500")
+            self.send_response(500)
+            self.end_headers()
+            return
+
+        try:
+            message = json.loads(body)
+        except ValueError:
+            print(f"[{time.strftime('%H:%M:%S')}] {self.path}: invalid JSON ({len(body)} bytes)")
+            self.send_response(400)
+            self.end_headers()
+            return
+        events = message.get('events', [])
+        print(f"[{time.strftime('%H:%M:%S')}] {self.path}: {len(events)} events from {message.get('host')}, dropped {message.get('dropped', 0)}")
+        for event in events:
+            subject = event.get('server') or 'active server'
+            print(f"    {subject}: {event.get('kind')} {event.get('old')} -> {event.get('new')} (x{event.get('count', 1)})")
+        if self.server.verbose:
+            print(json.dumps(message, indent=2, ensure_ascii=False))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local webhook receiver for testing notifications')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='سهم درخواست‌هایی که با 500 جواب می‌گیرند (0 تا 1)')
+    parser.add_argument('--delay', type=float, default=0.0, help='تاخیر مصنوعی قبل از پاسخ (ثانیه)')
+    parser.add_argument('--verbose', action='store_true', help='چاپ کامل JSON دریافتی')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.fail_rate = args.fail_rate
+    server.delay = args.delay
+    server.verbose = args.verbose
+    print(f"[INFO] Webhook receiver listening on http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()